@@ -0,0 +1,16 @@
+import hmac
+import os
+from typing import Optional
+from fastapi import Header, HTTPException, status
+
+# Rutas /admin/*: sólo con la cabecera X-Admin-Token igual a CHAT_ADMIN_TOKEN
+# (sin esa variable, desactivadas). Lo que cambian es de cada proceso: con
+# --workers N afecta sólo al worker que atiende la petición.
+ADMIN_TOKEN = os.getenv("CHAT_ADMIN_TOKEN", "")
+
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Administración desactivada")
+    if x_admin_token is None or not hmac.compare_digest(x_admin_token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Token de administración inválido")
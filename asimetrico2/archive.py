@@ -0,0 +1,295 @@
+# Retención por días: la tabla messages sólo guarda los últimos días ("caliente");
+# cada día más viejo se escribe en un segmento comprimido de sólo-añadir y se
+# borra de la tabla. El historial lee la tabla y, si la página no se llena,
+# sigue por los segmentos sin que el cliente note la diferencia.
+#   python archive.py                -> archiva lo más viejo que CHAT_ARCHIVE_AFTER_DAYS
+#   python archive.py --keep-days 7  -> o con otro margen
+# Formato del segmento archive/<día>-<primer id>.seg: bloques zlib independientes, cada uno
+# con filas JSON de una sola sala ordenadas por (timestamp, id). Dónde empieza
+# cada bloque y qué rango cubre se guarda en archive_blocks.
+import argparse
+import asyncio
+import base64
+import bisect
+import json
+import os
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from datetime import datetime, date, timedelta
+from sqlalchemy import select, delete, update, func, tuple_, DateTime, LargeBinary
+from database import engine, init_db, Message, ArchiveSegment, ArchiveBlock
+
+ARCHIVE_DIR = os.getenv("CHAT_ARCHIVE_DIR", "archive")
+# Días que se quedan en la tabla caliente; 0 desactiva el archivado automático
+ARCHIVE_AFTER_DAYS = int(os.getenv("CHAT_ARCHIVE_AFTER_DAYS", "30"))
+ARCHIVE_CHECK_S = float(os.getenv("CHAT_ARCHIVE_CHECK_S", "3600"))
+BLOCK_ROWS = int(os.getenv("CHAT_ARCHIVE_BLOCK_ROWS", "1000"))
+# Bloques descomprimidos que se guardan en memoria para paginar seguido
+BLOCK_CACHE_SIZE = 64
+
+messages = Message.__table__
+
+# Función opcional conn -> id máximo que se puede archivar (sha256 no archiva
+# mensajes que aún no cubre un checkpoint firmado)
+id_ceiling = None
+
+
+# === Filas <-> JSON ===
+def _row_json(row) -> str:
+    data = {}
+    for column in messages.columns:
+        value = row._mapping[column]
+        if isinstance(value, datetime):
+            value = value.isoformat()
+        elif isinstance(value, bytes):
+            value = base64.b64encode(value).decode()
+        data[column.name] = value
+    return json.dumps(data, ensure_ascii=False)
+
+
+def _row_message(data: dict) -> Message:
+    """Message suelto (fuera de sesión) con las mismas columnas que tenía en la tabla"""
+    for column in messages.columns:
+        value = data.get(column.name)
+        if value is None:
+            continue
+        if isinstance(column.type, DateTime):
+            data[column.name] = datetime.fromisoformat(value)
+        elif isinstance(column.type, LargeBinary):
+            data[column.name] = base64.b64decode(value)
+    return Message(**data)
+
+
+# === Escritura ===
+def _write_segment(path: str, rows) -> list:
+    """Escribe el segmento y devuelve sus bloques; rows viene ordenado por sala y tiempo"""
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    blocks = []
+    offset = 0
+    with open(tmp_path, "wb") as f:
+        start = 0
+        while start < len(rows):
+            room = rows[start].room
+            end = start
+            while end < len(rows) and end - start < BLOCK_ROWS and rows[end].room == room:
+                end += 1
+            chunk = rows[start:end]
+            data = zlib.compress("\n".join(_row_json(row) for row in chunk).encode(), 6)
+            f.write(data)
+            blocks.append({
+                "room": room, "offset": offset, "length": len(data), "rows": len(chunk),
+                "first_timestamp": chunk[0].timestamp, "first_id": chunk[0].id,
+                "last_timestamp": chunk[-1].timestamp, "last_id": chunk[-1].id,
+            })
+            offset += len(data)
+            start = end
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return blocks
+
+
+def archive_day(day: date) -> int:
+    """Mueve un día de la tabla caliente a su segmento; devuelve las filas archivadas"""
+    start = datetime.combine(day, datetime.min.time())
+    end = start + timedelta(days=1)
+    in_day = (messages.c.timestamp >= start) & (messages.c.timestamp < end)
+    # Se lee fuera de la transacción: nadie escribe ya en un día pasado
+    with engine.connect() as conn:
+        rows = conn.execute(select(messages).where(in_day)
+                            .order_by(messages.c.room, messages.c.timestamp, messages.c.id)).all()
+        ceiling = id_ceiling(conn) if id_ceiling is not None else None
+        newest = conn.execute(select(func.max(messages.c.id))).scalar()
+    # El mensaje más nuevo se queda siempre en la tabla: sin él SQLite volvería
+    # a dar ids ya usados (y repetidos en los segmentos y el índice de búsqueda)
+    rows = [row for row in rows if row.id != newest]
+    if ceiling is not None:
+        # Lo que aún no se puede archivar se queda en la tabla: el próximo pase
+        # lo lleva a otro segmento del mismo día
+        rows = [row for row in rows if row.id <= ceiling]
+    if not rows:
+        return 0
+    first_id, last_id = min(row.id for row in rows), max(row.id for row in rows)
+    # Los segmentos nunca se reescriben: filas que lleguen tarde a un día ya
+    # archivado (p. ej. una importación) van a un segmento nuevo del mismo día
+    path = os.path.join(ARCHIVE_DIR, f"{day.isoformat()}-{first_id}.seg")
+    with engine.connect() as conn:
+        if conn.execute(select(ArchiveSegment.id).where(ArchiveSegment.path == path)).first():
+            return 0
+    blocks = _write_segment(path, rows)
+
+    with engine.begin() as conn:
+        # Escritura sin efecto para tomar el lock: si otro worker archivó lo mismo, no se repite
+        conn.execute(update(ArchiveSegment.__table__).where(ArchiveSegment.path == path).values(path=path))
+        if conn.execute(select(ArchiveSegment.id).where(ArchiveSegment.path == path)).first():
+            return 0
+        segment_id = conn.execute(ArchiveSegment.__table__.insert().values(
+            day=day, path=path, rows=len(rows), first_id=first_id, last_id=last_id,
+            created_at=datetime.utcnow(),
+        )).inserted_primary_key[0]
+        conn.execute(ArchiveBlock.__table__.insert(), [dict(block, segment_id=segment_id) for block in blocks])
+        conn.execute(delete(messages).where(in_day, messages.c.id <= last_id))
+    return len(rows)
+
+
+def archive_cold_days(keep_days: int = ARCHIVE_AFTER_DAYS) -> int:
+    cutoff = datetime.combine(datetime.utcnow().date() - timedelta(days=keep_days), datetime.min.time())
+    with engine.connect() as conn:
+        oldest = conn.execute(select(func.min(messages.c.timestamp))).scalar()
+    total = 0
+    day = oldest.date() if oldest is not None else None
+    while day is not None and datetime.combine(day, datetime.min.time()) < cutoff:
+        archived = archive_day(day)
+        if archived:
+            print(f"🗄️ Archivados {archived} mensajes del {day.isoformat()}")
+        total += archived
+        day += timedelta(days=1)
+    return total
+
+
+async def archiver_loop():
+    """Archiva los días fríos al arrancar y luego cada ARCHIVE_CHECK_S segundos"""
+    if ARCHIVE_AFTER_DAYS <= 0:
+        return
+    while True:
+        try:
+            await asyncio.to_thread(archive_cold_days, ARCHIVE_AFTER_DAYS)
+        except Exception as exc:
+            print(f"Error archivando mensajes: {exc}")
+        await asyncio.sleep(ARCHIVE_CHECK_S)
+
+
+# === Lectura ===
+_block_cache = OrderedDict()
+_block_lock = threading.Lock()
+
+
+def read_block(path: str, offset: int, length: int) -> list:
+    """Mensajes de un bloque, en orden (timestamp, id); los últimos usados quedan en memoria"""
+    key = (path, offset)
+    with _block_lock:
+        cached = _block_cache.get(key)
+        if cached is not None:
+            _block_cache.move_to_end(key)
+            return cached
+    with open(path, "rb") as f:
+        f.seek(offset)
+        data = zlib.decompress(f.read(length)).decode()
+    block = [_row_message(json.loads(line)) for line in data.split("\n")]
+    with _block_lock:
+        _block_cache[key] = block
+        while len(_block_cache) > BLOCK_CACHE_SIZE:
+            _block_cache.popitem(last=False)
+    return block
+
+
+def archived_page(room: str, position, limit: int, user_id=None) -> list:
+    """Como history.page_query pero sobre los segmentos: del más nuevo al más viejo"""
+    stmt = (select(ArchiveBlock.offset, ArchiveBlock.length, ArchiveBlock.last_timestamp,
+                   ArchiveBlock.last_id, ArchiveSegment.path)
+            .join(ArchiveSegment, ArchiveBlock.segment_id == ArchiveSegment.id)
+            .where(ArchiveBlock.room == room))
+    if position is not None:
+        stmt = stmt.where(tuple_(ArchiveBlock.first_timestamp, ArchiveBlock.first_id) < tuple_(*position))
+    stmt = stmt.order_by(ArchiveBlock.last_timestamp.desc(), ArchiveBlock.last_id.desc())
+    found = []
+    with engine.connect() as conn:
+        for block in conn.execute(stmt):
+            # Bloques del más nuevo al más viejo: en cuanto uno termina antes que
+            # lo ya encontrado, ninguno de los siguientes puede entrar en la página
+            if len(found) >= limit and (block.last_timestamp, block.last_id) < (found[-1].timestamp, found[-1].id):
+                break
+            for msg in read_block(block.path, block.offset, block.length):
+                if position is not None and (msg.timestamp, msg.id) >= position:
+                    continue
+                if user_id is not None and msg.user_id != user_id:
+                    continue
+                found.append(msg)
+            found.sort(key=lambda msg: (msg.timestamp, msg.id), reverse=True)
+            del found[limit:]
+    return found
+
+
+def iter_archived():
+    """Todos los mensajes archivados, segmento a segmento (para mantenimiento y exportación)"""
+    with engine.connect() as conn:
+        blocks = conn.execute(
+            select(ArchiveBlock.offset, ArchiveBlock.length, ArchiveSegment.path)
+            .join(ArchiveSegment, ArchiveBlock.segment_id == ArchiveSegment.id)
+            .order_by(ArchiveSegment.id, ArchiveBlock.offset)
+        ).all()
+    for block in blocks:
+        yield from read_block(block.path, block.offset, block.length)
+
+
+def archived_by_ids(hits) -> list:
+    """Mensajes archivados a partir de pares (id, sala), p. ej. resultados de búsqueda"""
+    found = []
+    with engine.connect() as conn:
+        for message_id, room in hits:
+            blocks = conn.execute(
+                select(ArchiveBlock.offset, ArchiveBlock.length, ArchiveSegment.path)
+                .join(ArchiveSegment, ArchiveBlock.segment_id == ArchiveSegment.id)
+                .where(ArchiveSegment.first_id <= message_id, ArchiveSegment.last_id >= message_id,
+                       ArchiveBlock.room == room)
+            ).all()
+            for block in blocks:
+                msg = next((msg for msg in read_block(block.path, block.offset, block.length)
+                            if msg.id == message_id), None)
+                if msg is not None:
+                    found.append(msg)
+                    break
+    return found
+
+
+_segment_cache = OrderedDict()
+
+
+def _segment_by_id(conn, segment_id: int) -> tuple:
+    """(ids, mensajes) de un segmento entero ordenado por id; se guardan los dos últimos"""
+    with _block_lock:
+        cached = _segment_cache.get(segment_id)
+    if cached is not None:
+        return cached
+    blocks = conn.execute(
+        select(ArchiveBlock.offset, ArchiveBlock.length, ArchiveSegment.path)
+        .join(ArchiveSegment, ArchiveBlock.segment_id == ArchiveSegment.id)
+        .where(ArchiveBlock.segment_id == segment_id)
+    ).all()
+    rows = sorted((msg for block in blocks for msg in read_block(block.path, block.offset, block.length)),
+                  key=lambda msg: msg.id)
+    cached = ([msg.id for msg in rows], rows)
+    with _block_lock:
+        _segment_cache[segment_id] = cached
+        while len(_segment_cache) > 2:
+            _segment_cache.popitem(last=False)
+    return cached
+
+
+def archived_rows_by_id(after_id: int, to_id: int, limit: int) -> list:
+    """Mensajes archivados con after_id < id <= to_id, en orden de id (para auditar la cadena)"""
+    found = []
+    with engine.connect() as conn:
+        segments = conn.execute(
+            select(ArchiveSegment.id).where(ArchiveSegment.last_id > after_id, ArchiveSegment.first_id <= to_id)
+            .order_by(ArchiveSegment.first_id)
+        ).scalars().all()
+        for segment_id in segments:
+            ids, rows = _segment_by_id(conn, segment_id)
+            start, end = bisect.bisect_right(ids, after_id), bisect.bisect_right(ids, to_id)
+            found.extend(rows[start:min(end, start + limit)])
+    # Los segmentos de días distintos pueden intercalar ids en los bordes
+    return sorted(found, key=lambda msg: msg.id)[:limit]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Archiva en segmentos comprimidos los días fríos")
+    parser.add_argument("--keep-days", type=int, default=ARCHIVE_AFTER_DAYS or 30)
+    args = parser.parse_args()
+    init_db()
+    started = time.perf_counter()
+    total = archive_cold_days(args.keep_days)
+    print(f"✅ {total} mensajes archivados en {time.perf_counter() - started:.1f}s")
@@ -0,0 +1,293 @@
+import asyncio
+import json
+import os
+import time
+from collections import deque
+import metrics
+from broker import make_broker
+from ring_buffer import RecentFrames
+from rooms import can_see, DEFAULT_ROOM
+from frames import pack, message_frame, join_frames, COALESCE_MS, MAX_COALESCE
+from tracing import tracer
+
+# Tamaño de la cola de salida de cada conexión y qué hacer cuando se llena:
+#   "drop"       -> se descarta el mensaje sólo para ese cliente lento
+#   "disconnect" -> se cierra la conexión del cliente lento
+SEND_QUEUE_SIZE = int(os.getenv("CHAT_SEND_QUEUE_SIZE", "256"))
+OVERFLOW_POLICY = os.getenv("CHAT_OVERFLOW_POLICY", "drop")
+
+# Heartbeats: a la conexión que lleva CHAT_HEARTBEAT_S sin mandar nada se le envía
+# {"ping": n} y tiene que contestar {"op": "pong"} (cualquier frame vale). La que pasa
+# CHAT_IDLE_TIMEOUT_S callada se da por muerta (p. ej. TCP medio abierto) y se cierra,
+# así el reparto no sigue escribiendo en ella. 0 desactiva los heartbeats.
+# Sólo con proto json/msgpack: un cliente de texto plano no sabe contestar {"ping"}
+# (lo vería como un mensaje más); sus sockets muertos los detecta el ping del propio
+# protocolo WebSocket de uvicorn (--ws-ping-interval/--ws-ping-timeout, 20 s por defecto).
+HEARTBEAT_S = float(os.getenv("CHAT_HEARTBEAT_S", "20"))
+IDLE_TIMEOUT_S = float(os.getenv("CHAT_IDLE_TIMEOUT_S", "60"))
+# Sesiones abiertas a la vez por usuario (pestañas, dispositivos); al pasarse se cierra la más vieja
+MAX_SESSIONS = int(os.getenv("CHAT_MAX_SESSIONS", "5"))
+# Lo que se espera al cierre de un socket que quizá ya no contesta
+CLOSE_TIMEOUT_S = 5
+
+# Códigos de cierre WebSocket: 1013 "Try Again Later", 1001 "Going Away", 1008 "Policy Violation",
+# 1011 "Internal Error"
+SLOW_CONSUMER_CLOSE_CODE = 1013
+IDLE_CLOSE_CODE = 1001
+SESSION_LIMIT_CLOSE_CODE = 1008
+REVOKED_CLOSE_CODE = 1008
+SEND_ERROR_CLOSE_CODE = 1011
+
+QUEUE_FULL = metrics.send_failures.labels("queue_full")
+SEND_ERROR = metrics.send_failures.labels("error")
+
+
+class ClientConnection:
+    """Conexión de un usuario: lo mínimo por socket, que con 50k sockets callados todo cuenta
+
+    No guarda sesión de DB (el writer de persistence agrupa las escrituras) y la cola
+    de salida y la tarea escritora sólo existen mientras hay algo que enviar.
+    """
+    __slots__ = ("username", "user_id", "jti", "websocket", "proto", "broadcaster", "pending", "writer",
+                 "dropped", "rooms", "connected_at", "last_seen")
+
+    def __init__(self, username: str, websocket, broadcaster: "Broadcaster", proto: str = "text",
+                 user_id: int = None, jti: str = None):
+        self.username = username
+        self.user_id = user_id
+        # Token con el que se abrió (al revocarlo se cierra el socket)
+        self.jti = jti
+        self.websocket = websocket
+        # Protocolo de salida negociado al conectar (ver frames.py)
+        self.proto = proto
+        self.broadcaster = broadcaster
+        self.pending = None
+        self.writer = None
+        self.dropped = 0
+        self.rooms = set()
+        # Último frame recibido del cliente (para heartbeats y reaping)
+        self.connected_at = self.last_seen = time.monotonic()
+
+    async def _drain(self):
+        """Envía en orden lo pendiente y termina; un fallo sólo afecta a este cliente"""
+        send = self.websocket.send_bytes if self.proto == "msgpack" else self.websocket.send_text
+        try:
+            while self.pending:
+                frame = self.pending.popleft()
+                if self.proto != "text":
+                    frame = await self._coalesce(frame)
+                await send(frame)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            SEND_ERROR.inc()
+            # El socket ya no acepta datos: lo sacamos del reparto y se cierra,
+            # así el bucle de lectura de la conexión también termina
+            self.broadcaster.drop(self, SEND_ERROR_CLOSE_CODE)
+        finally:
+            self.writer = None
+            if not self.pending:
+                self.pending = None
+
+    async def _coalesce(self, first):
+        """Junta con first lo que llegue dentro de la ventana: un frame y un send por ráfaga"""
+        if COALESCE_MS > 0 and not self.pending:
+            await asyncio.sleep(COALESCE_MS / 1000)
+        frames = [first]
+        while len(frames) < MAX_COALESCE and self.pending:
+            frames.append(self.pending.popleft())
+        metrics.coalesced_messages.observe(len(frames))
+        return first if len(frames) == 1 else join_frames(self.proto, frames)
+
+    def enqueue(self, frame) -> bool:
+        if self.pending is None:
+            self.pending = deque()
+        elif len(self.pending) >= self.broadcaster.queue_size:
+            self.dropped += 1
+            QUEUE_FULL.inc()
+            return False
+        self.pending.append(frame)
+        if self.writer is None:
+            self.writer = asyncio.create_task(self._drain())
+        return True
+
+    def send_event(self, event: dict) -> bool:
+        """Encola un evento de control (replay, ok, error) en el protocolo de la conexión"""
+        return self.enqueue(pack("json" if self.proto == "text" else self.proto, event))
+
+    async def close(self, code: int):
+        try:
+            await asyncio.wait_for(self.websocket.close(code=code), CLOSE_TIMEOUT_S)
+        except Exception:
+            pass
+
+
+class Broadcaster:
+    """Reparte cada mensaje encolándolo en las conexiones de su sala, sin esperar envíos
+
+    Los mensajes pasan por el broker: con varios workers cada uno publica una
+    vez y entrega sólo a los sockets que tiene abiertos. El índice sala ->
+    conexiones hace que el reparto sólo toque a los miembros de la sala, y el
+    de presencia usuario -> sesiones, a los sockets vivos de cada usuario.
+    """
+
+    def __init__(self, queue_size: int = SEND_QUEUE_SIZE, policy: str = OVERFLOW_POLICY, broker=None):
+        if policy not in ("drop", "disconnect"):
+            raise ValueError(f"Política de desbordamiento desconocida: {policy}")
+        self.queue_size = queue_size
+        self.policy = policy
+        self.broker = broker if broker is not None else make_broker()
+        # Presencia: usuario -> tupla de sus sesiones abiertas en este proceso (son pocas,
+        # MAX_SESSIONS: una tupla pesa menos que un set y se recorre igual)
+        self.connections = {}
+        self.sessions = 0
+        self.rooms = {}
+        self.recent = RecentFrames()
+        self.heartbeat = None
+
+    async def start(self):
+        await self.broker.start(self.deliver)
+        if HEARTBEAT_S > 0:
+            self.heartbeat = asyncio.create_task(self._heartbeat())
+
+    async def stop(self):
+        if self.heartbeat is not None:
+            self.heartbeat.cancel()
+            self.heartbeat = None
+        await self.broker.stop()
+
+    async def _heartbeat(self):
+        """Cada HEARTBEAT_S: ping a las conexiones calladas y cierre de las que no contestan"""
+        while True:
+            await asyncio.sleep(HEARTBEAT_S)
+            now = time.monotonic()
+            for sessions in list(self.connections.values()):
+                for conn in sessions:
+                    if conn.proto == "text":
+                        continue
+                    idle = now - conn.last_seen
+                    if idle >= IDLE_TIMEOUT_S:
+                        metrics.reaped_connections.inc()
+                        self.drop(conn, IDLE_CLOSE_CODE)
+                    elif idle >= HEARTBEAT_S:
+                        conn.send_event({"ping": int(now)})
+
+    def warm(self, frames):
+        """Carga en el buffer frames ya persistidos (p. ej. al arrancar), como (seq, sala, texto)"""
+        for seq, room, text in frames:
+            self.recent.append(seq, (room, text))
+
+    async def resume(self, since: int, load_since, rooms, user_id: int) -> tuple:
+        """(frames, truncated): frames visibles posteriores a since, del buffer o, si hay hueco,
+        de la DB vía load_since; truncated si entre lo leído de la DB y el buffer faltan mensajes"""
+        buffered = self.recent.since(since)
+        truncated = False
+        if buffered is None:
+            # De la DB sólo el tramo anterior al frame más antiguo del buffer
+            until = self.recent.oldest_seq
+            frames, truncated = await load_since(since, rooms, user_id, until)
+            if until is not None and self.recent.oldest_seq > until:
+                # Mientras se leía, el buffer lleno descartó parte de lo que faltaba
+                truncated = True
+            last = frames[-1][0] if frames else since
+            buffered = [(seq, frame) for seq, frame in self.recent.all() if seq > last]
+        else:
+            frames = []
+        return frames + [(seq, room, text) for seq, (room, text) in buffered if can_see(room, rooms, user_id)], truncated
+
+    def connect(self, username: str, websocket, proto: str = "text", replay=None, truncated: bool = False,
+                user_id: int = None, rooms=(DEFAULT_ROOM,), jti: str = None) -> ClientConnection:
+        """Registra el socket en sus salas; si hay replay se encola antes que cualquier mensaje nuevo"""
+        sessions = self.connections.get(username, ())
+        if len(sessions) >= MAX_SESSIONS:
+            # Las sesiones están en orden de llegada: la primera es la más vieja
+            self.drop(sessions[0], SESSION_LIMIT_CLOSE_CODE)
+        conn = ClientConnection(username, websocket, self, proto, user_id, jti)
+        if replay or truncated:
+            event = {"replay": [{"seq": seq, "room": room, "text": text} for seq, room, text in replay]}
+            if truncated:
+                # Faltan mensajes entre el replay y lo nuevo: el cliente los pide a /messages
+                event["truncated"] = True
+            conn.send_event(event)
+        self.connections[username] = self.connections.get(username, ()) + (conn,)
+        self.sessions += 1
+        for room in rooms:
+            self.join(conn, room)
+        return conn
+
+    def disconnect(self, conn: ClientConnection):
+        sessions = self.connections.get(conn.username, ())
+        if conn in sessions:
+            sessions = tuple(session for session in sessions if session is not conn)
+            self.sessions -= 1
+            if sessions:
+                self.connections[conn.username] = sessions
+            else:
+                del self.connections[conn.username]
+        for room in list(conn.rooms):
+            self.leave(conn, room)
+        conn.pending = None
+        if conn.writer is not None and conn.writer is not asyncio.current_task():
+            conn.writer.cancel()
+
+    def drop(self, conn: ClientConnection, code: int):
+        """Saca la conexión del reparto y cierra el socket sin esperar"""
+        self.disconnect(conn)
+        asyncio.create_task(conn.close(code))
+
+    def revoke(self, username: str, jti: str = None):
+        """Cierra las sesiones abiertas con el token jti, o todas las de username si es None"""
+        for conn in self.connections.get(username, ()):
+            if jti is None or conn.jti == jti:
+                self.drop(conn, REVOKED_CLOSE_CODE)
+
+    def presence(self, room: str = None) -> list:
+        """Usuarios con al menos un socket abierto (en room, si se indica)"""
+        if room is None:
+            return list(self.connections)
+        return list({conn.username for conn in self.rooms.get(room, ())})
+
+    def join(self, conn: ClientConnection, room: str):
+        self.rooms.setdefault(room, set()).add(conn)
+        conn.rooms.add(room)
+
+    def leave(self, conn: ClientConnection, room: str):
+        conn.rooms.discard(room)
+        members = self.rooms.get(room)
+        if members is not None:
+            members.discard(conn)
+            if not members:
+                del self.rooms[room]  # salas vacías fuera: el índice no crece sin límite
+
+    def publish(self, seq: int, text: str, room: str = DEFAULT_ROOM, to=None):
+        """Publica el mensaje seq (su id en la DB) en room; to son los usuarios de un mensaje
+        directo (remitente y destinatario)"""
+        event = {"seq": seq, "room": room, "text": text}
+        if to is not None:
+            event["to"] = to
+        self.broker.publish(json.dumps(event).encode())
+
+    def _targets(self, room: str, to):
+        if to is not None:
+            return [conn for username in set(to) for conn in self.connections.get(username, ())]
+        return list(self.rooms.get(room, ()))
+
+    def deliver(self, payload: bytes):
+        """Entrega a los sockets locales de la sala un mensaje recibido del broker"""
+        event = json.loads(payload)
+        seq, room, text = event["seq"], event.get("room", DEFAULT_ROOM), event["text"]
+        self.recent.append(seq, (room, text))
+        targets = self._targets(room, event.get("to"))
+        metrics.fanout_size.observe(len(targets))
+        # Con el broker en memoria es una etapa del mensaje; si llega de otro proceso, una traza propia
+        with tracer.trace("fanout", targets=len(targets)):
+            # Cada protocolo se serializa una sola vez y el frame se comparte entre destinatarios
+            encoded = {}
+            for conn in targets:
+                frame = encoded.get(conn.proto)
+                if frame is None:
+                    frame = encoded[conn.proto] = message_frame(conn.proto, seq, room, text)
+                if conn.enqueue(frame):
+                    continue
+                if self.policy == "disconnect":
+                    self.drop(conn, SLOW_CONSUMER_CLOSE_CODE)
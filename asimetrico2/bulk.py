@@ -0,0 +1,251 @@
+# Exportación e importación masiva del historial (tabla caliente + días archivados).
+#   python bulk.py export historial.jsonl.gz            -> JSON Lines comprimido
+#   python bulk.py export historial.parquet             -> Parquet por columnas (requiere pyarrow)
+#   python bulk.py import historial.jsonl.gz [--create-users]
+# Al exportar los mensajes se leen por tramos con un cursor que no carga la tabla
+# entera y se descifran en un pool de procesos (un tramo por núcleo), escribiendo
+# en orden a medida que vuelven: la memoria no crece con el tamaño del historial.
+# Al importar se cifran con la clave de esta variante y se insertan por lotes con
+# el MessageWriter del servidor, así que sirve también para pasar de una variante a otra.
+import argparse
+import asyncio
+import gzip
+import json
+import os
+import secrets
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from types import SimpleNamespace
+from sqlalchemy import select
+from database import engine, init_db, SessionLocal, Message, User
+from message_codec import decode_messages, encode_message, prepare_encoding
+from archive import iter_archived
+from persistence import MessageWriter
+from rooms import dm_room, dm_members
+from password_pool import pwd_context, MP_CONTEXT
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet es opcional: sin pyarrow sólo JSON Lines
+    pa = pq = None
+
+try:
+    # Variante sha256: los mensajes importados también entran en la cadena de integridad
+    from integrity import chain_batch
+except ImportError:
+    chain_batch = None
+
+CHUNK = 2000
+WORKERS = os.cpu_count() or 1
+
+messages = Message.__table__
+RECORD_FIELDS = ("id", "timestamp", "room", "user", "to", "text")
+
+
+def _parquet_schema():
+    return pa.schema([("id", pa.int64()), ("timestamp", pa.timestamp("us")), ("room", pa.string()),
+                      ("user", pa.string()), ("to", pa.string()), ("text", pa.string())])
+
+
+# === Exportación ===
+def _columns(row) -> dict:
+    """Columnas del mensaje como dict simple (se manda a otro proceso)"""
+    return {column.name: getattr(row, column.name) for column in messages.columns}
+
+
+def _hot_chunks(chunk_size: int):
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=chunk_size).execute(
+            select(messages).order_by(messages.c.id))
+        for partition in result.partitions():
+            yield [_columns(row) for row in partition]
+
+
+def _archived_chunks(chunk_size: int):
+    chunk = []
+    for msg in iter_archived():
+        chunk.append(_columns(msg))
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _decode_chunk(rows: list) -> list:
+    return decode_messages([SimpleNamespace(**row) for row in rows])
+
+
+def _decoded(chunks, workers: int):
+    """(filas, textos) de cada tramo, en orden; como mucho 2 tramos por proceso en vuelo"""
+    if workers <= 1:
+        for rows in chunks:
+            yield rows, _decode_chunk(rows)
+        return
+    # Procesos nuevos (ver password_pool.MP_CONTEXT): no heredan conexiones ni sockets del padre
+    with ProcessPoolExecutor(max_workers=workers, mp_context=MP_CONTEXT) as pool:
+        pending = deque()
+        for rows in chunks:
+            pending.append((rows, pool.submit(_decode_chunk, rows)))
+            if len(pending) >= workers * 2:
+                rows, future = pending.popleft()
+                yield rows, future.result()
+        while pending:
+            rows, future = pending.popleft()
+            yield rows, future.result()
+
+
+class JsonlWriter:
+    def __init__(self, path: str):
+        self.file = gzip.open(path, "wt", encoding="utf-8") if path.endswith(".gz") else open(path, "w", encoding="utf-8")
+
+    def write(self, records: list):
+        self.file.writelines(
+            json.dumps({**record, "timestamp": record["timestamp"].isoformat()}, ensure_ascii=False) + "\n"
+            for record in records)
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetWriter:
+    """Un row group por tramo, comprimido con zstd"""
+
+    def __init__(self, path: str):
+        self.schema = _parquet_schema()
+        self.writer = pq.ParquetWriter(path, self.schema, compression="zstd")
+
+    def write(self, records: list):
+        self.writer.write_table(pa.Table.from_pylist(records, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+def _is_parquet(path: str) -> bool:
+    if not path.endswith(".parquet"):
+        return False
+    if pa is None:
+        raise SystemExit("Hace falta pyarrow para Parquet (python -m pip install pyarrow)")
+    return True
+
+
+def export_history(path: str, workers: int = WORKERS, chunk_size: int = CHUNK, archived: bool = True) -> dict:
+    with engine.connect() as conn:
+        usernames = dict(conn.execute(select(User.id, User.username)).all())
+    writer = ParquetWriter(path) if _is_parquet(path) else JsonlWriter(path)
+    exported = failed = 0
+    try:
+        sources = ([_archived_chunks(chunk_size)] if archived else []) + [_hot_chunks(chunk_size)]
+        for source in sources:
+            for rows, texts in _decoded(source, workers):
+                records = []
+                for row, text in zip(rows, texts):
+                    if text is None:
+                        failed += 1
+                    records.append({"id": row["id"], "timestamp": row["timestamp"], "room": row["room"],
+                                    "user": usernames.get(row["user_id"]),
+                                    "to": usernames.get(row["recipient_id"]), "text": text})
+                writer.write(records)
+                exported += len(records)
+    finally:
+        writer.close()
+    return {"exported": exported, "undecryptable": failed}
+
+
+# === Importación ===
+def _read_records(path: str, chunk_size: int):
+    """Tramos de registros del fichero, sin leerlo entero"""
+    if _is_parquet(path):
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size):
+            yield batch.to_pylist()
+        return
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        chunk = []
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                record["timestamp"] = datetime.fromisoformat(record["timestamp"])
+                chunk.append(record)
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+def _user_ids(records: list, user_ids: dict, create: bool):
+    """Completa user_ids con los usuarios nuevos del tramo (creándolos si create)"""
+    names = {name for record in records for name in (record["user"], record["to"]) if name}
+    missing = names - user_ids.keys()
+    if not missing:
+        return
+    with SessionLocal() as db:
+        user_ids.update(db.execute(select(User.username, User.id).where(User.username.in_(missing))).all())
+        if create:
+            # Contraseña aleatoria que nadie conoce: el usuario tendrá que restablecerla
+            new_users = [User(username=name, password=pwd_context.hash(secrets.token_urlsafe(16)))
+                         for name in missing - user_ids.keys()]
+            if new_users:
+                db.add_all(new_users)
+                db.commit()
+                user_ids.update((user.username, user.id) for user in new_users)
+
+
+async def import_history(path: str, chunk_size: int = CHUNK, create_users: bool = False) -> dict:
+    prepare_encoding()
+    writer = MessageWriter(batch_size=chunk_size, max_delay=0, durability="enqueue", queue_size=chunk_size * 2)
+    if chain_batch is not None:
+        writer.hooks.append(chain_batch)
+    await writer.start()
+    user_ids = {}
+    skipped = 0
+    try:
+        for records in _read_records(path, chunk_size):
+            _user_ids(records, user_ids, create_users)
+            for record in records:
+                user_id = user_ids.get(record["user"])
+                recipient_id = user_ids.get(record["to"]) if record["to"] else None
+                if record["text"] is None or user_id is None or (record["to"] and recipient_id is None):
+                    skipped += 1
+                    continue
+                if record["to"]:
+                    # Los ids de esta DB no son los del origen: la sala "dm:" se rehace con ellos
+                    room = dm_room(user_id, recipient_id)
+                elif dm_members(record["room"]) is not None:
+                    # Directo sin destinatario conocido: copiar la sala se lo daría a otro usuario
+                    skipped += 1
+                    continue
+                else:
+                    room = record["room"]
+                await writer.submit(Message(**encode_message(record["text"]), user_id=user_id, room=room,
+                                            recipient_id=recipient_id, timestamp=record["timestamp"]))
+    finally:
+        await writer.stop()
+    return {"imported": writer.rows_written, "failed": writer.failed_rows, "skipped": skipped}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Exportación e importación masiva del historial")
+    parser.add_argument("command", choices=("export", "import"))
+    parser.add_argument("path", help=".jsonl, .jsonl.gz o .parquet")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="procesos que descifran al exportar")
+    parser.add_argument("--chunk", type=int, default=CHUNK, help="mensajes por tramo / por lote")
+    parser.add_argument("--no-archive", action="store_true", help="exportar sólo la tabla, sin los días archivados")
+    parser.add_argument("--create-users", action="store_true",
+                        help="al importar, crear los usuarios que falten (si no, sus mensajes se saltan)")
+    args = parser.parse_args()
+    init_db()
+    started = time.perf_counter()
+    if args.command == "export":
+        result = export_history(args.path, args.workers, args.chunk, not args.no_archive)
+        total = result["exported"]
+    else:
+        result = asyncio.run(import_history(args.path, args.chunk, args.create_users))
+        total = result["imported"]
+    elapsed = time.perf_counter() - started
+    print(f"✅ {result} en {elapsed:.1f}s ({total / elapsed if elapsed else 0:.0f} mensajes/s)")
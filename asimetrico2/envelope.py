@@ -0,0 +1,129 @@
+import asyncio
+import os
+import threading
+from datetime import datetime, timedelta
+from Crypto.Cipher import AES, PKCS1_OAEP
+from Crypto.Random import get_random_bytes
+from sqlalchemy import select
+from database import SessionLocal, DataKey
+
+# Cifrado "sobre" (envelope): cada mensaje va con AES-256-GCM usando una clave
+# de datos; esa clave se guarda envuelta con RSA una sola vez y se rota.
+#   CHAT_DATA_KEY_MAX_AGE_S    -> antigüedad máxima de la clave activa
+#   CHAT_DATA_KEY_MAX_MESSAGES -> mensajes máximos por clave (nonces aleatorios de 96 bits)
+DATA_KEY_MAX_AGE = timedelta(seconds=int(os.getenv("CHAT_DATA_KEY_MAX_AGE_S", "86400")))
+DATA_KEY_MAX_MESSAGES = int(os.getenv("CHAT_DATA_KEY_MAX_MESSAGES", "1000000"))
+ROTATION_CHECK_INTERVAL = 60
+
+NONCE_SIZE = 12
+TAG_SIZE = 16
+
+
+class EnvelopeKeyring:
+    """Claves de datos AES: la activa para cifrar y las viejas (desenvueltas bajo demanda) para descifrar"""
+
+    def __init__(self, private_key, public_key):
+        # Un solo cipher RSA por proceso (no uno por llamada)
+        self._unwrap = PKCS1_OAEP.new(private_key)
+        self._wrap = PKCS1_OAEP.new(public_key)
+        self._keys = {}  # key_id -> clave AES en claro
+        # Se descifra desde hilos (historial), así que el acceso a _keys va con lock
+        self._lock = threading.Lock()
+        self.current_id = None
+        self.current_created = None
+        self.current_uses = 0
+
+    # === Gestión de claves (toca la DB: llamar fuera del event loop) ===
+    def load_or_create(self):
+        """Activa la clave más reciente o crea una si no hay o ya caducó"""
+        db = SessionLocal()
+        try:
+            latest = db.execute(select(DataKey).order_by(DataKey.id.desc()).limit(1)).scalar()
+        finally:
+            db.close()
+        if latest is None or datetime.utcnow() - latest.created_at >= DATA_KEY_MAX_AGE:
+            self.rotate()
+        else:
+            self._activate(latest.id, self._unwrap.decrypt(latest.wrapped_key), latest.created_at)
+
+    def rotate(self):
+        key = get_random_bytes(32)
+        data_key = DataKey(wrapped_key=self._wrap.encrypt(key), created_at=datetime.utcnow())
+        db = SessionLocal()
+        try:
+            db.add(data_key)
+            db.commit()
+            key_id = data_key.id
+        finally:
+            db.close()
+        self._activate(key_id, key, data_key.created_at)
+        print(f"🔑 Nueva clave de datos activa: {key_id}")
+
+    def needs_rotation(self) -> bool:
+        return (self.current_id is None
+                or self.current_uses >= DATA_KEY_MAX_MESSAGES
+                or datetime.utcnow() - self.current_created >= DATA_KEY_MAX_AGE)
+
+    async def rotation_loop(self):
+        """Tarea de fondo que rota la clave activa según antigüedad/uso"""
+        while True:
+            await asyncio.sleep(ROTATION_CHECK_INTERVAL)
+            if self.needs_rotation():
+                await asyncio.to_thread(self.rotate)
+
+    def _activate(self, key_id, key, created_at):
+        with self._lock:
+            self._keys[key_id] = key
+        self.current_id = key_id
+        self.current_created = created_at
+        self.current_uses = 0
+
+    def _key(self, key_id):
+        with self._lock:
+            key = self._keys.get(key_id)
+        if key is None:
+            db = SessionLocal()
+            try:
+                wrapped = db.execute(select(DataKey.wrapped_key).where(DataKey.id == key_id)).scalar()
+            finally:
+                db.close()
+            if wrapped is None:
+                return None
+            key = self._unwrap.decrypt(wrapped)
+            with self._lock:
+                self._keys[key_id] = key
+        return key
+
+    # === Cifrado de mensajes ===
+    def encrypt(self, message: str):
+        """Devuelve (key_id, nonce + texto cifrado + tag)"""
+        if self.current_id is None:
+            raise RuntimeError("No hay clave de datos activa: llama a load_or_create()")
+        key_id = self.current_id
+        nonce = get_random_bytes(NONCE_SIZE)
+        cipher = AES.new(self._keys[key_id], AES.MODE_GCM, nonce=nonce)
+        ciphertext, tag = cipher.encrypt_and_digest(message.encode())
+        self.current_uses += 1
+        return key_id, nonce + ciphertext + tag
+
+    def decrypt(self, key_id: int, blob: bytes) -> str:
+        key = self._key(key_id)
+        if key is None:
+            raise ValueError(f"Clave de datos desconocida: {key_id}")
+        nonce, ciphertext, tag = blob[:NONCE_SIZE], blob[NONCE_SIZE:-TAG_SIZE], blob[-TAG_SIZE:]
+        cipher = AES.new(key, AES.MODE_GCM, nonce=nonce)
+        return cipher.decrypt_and_verify(ciphertext, tag).decode()
+
+    def decrypt_many(self, messages) -> list:
+        """Descifra un lote de Message; cada clave se desenvuelve una sola vez (None si falla)"""
+        texts = []
+        for m in messages:
+            try:
+                if m.key_id is not None:
+                    texts.append(self.decrypt(m.key_id, m.ciphertext))
+                else:
+                    # Mensajes anteriores al envelope: RSA-OAEP directo en hex
+                    texts.append(self._unwrap.decrypt(bytes.fromhex(m.content)).decode())
+            except (ValueError, TypeError):
+                texts.append(None)
+        return texts
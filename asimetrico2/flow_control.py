@@ -0,0 +1,154 @@
+import asyncio
+import os
+import time
+from collections import namedtuple
+import metrics
+
+# Control de entrada del WebSocket, para que un cliente que inunda no frene a los demás:
+#   CHAT_RATE_PER_S       -> mensajes por segundo que puede mandar cada usuario...
+#   CHAT_RATE_BURST       -> ...con ráfagas de hasta este tamaño (token bucket)
+#   CHAT_MAX_FRAME_BYTES  -> tamaño máximo de un frame entrante
+#   CHAT_MAX_IN_FLIGHT    -> mensajes procesándose a la vez (cifrado + DB + reparto) en el proceso
+#   CHAT_FLOW_POLICY      -> qué hacer al pasarse:
+#       "throttle"   -> dejar de leer el socket hasta que haya hueco (TCP frena al cliente)
+#       "reject"     -> descartar el frame y responder {"error": ...}
+#       "disconnect" -> cerrar el socket
+# Un frame demasiado grande no se puede frenar: con "throttle" se rechaza.
+# Para no llegar a recibirlo entero, arranca uvicorn con --ws-max-size del mismo tamaño.
+RATE_PER_S = float(os.getenv("CHAT_RATE_PER_S", "20"))
+RATE_BURST = int(os.getenv("CHAT_RATE_BURST", "40"))
+MAX_FRAME_BYTES = int(os.getenv("CHAT_MAX_FRAME_BYTES", str(16 * 1024)))
+MAX_IN_FLIGHT = int(os.getenv("CHAT_MAX_IN_FLIGHT", "1000"))
+FLOW_POLICY = os.getenv("CHAT_FLOW_POLICY", "throttle")
+
+# Códigos de cierre WebSocket según el motivo
+MESSAGE_TOO_BIG_CLOSE_CODE = 1009
+POLICY_VIOLATION_CLOSE_CODE = 1008
+TRY_AGAIN_LATER_CLOSE_CODE = 1013
+
+# Un frame no admitido: error para el cliente y, si hay que cerrar, con qué código
+Rejection = namedtuple("Rejection", ("reason", "error", "close_code", "retry_after"))
+
+
+class TokenBucket:
+    """RATE_PER_S fichas por segundo hasta un máximo de RATE_BURST; cada mensaje gasta una"""
+    __slots__ = ("rate", "burst", "tokens", "updated", "connections")
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.connections = 0
+
+    def take(self) -> float:
+        """Gasta una ficha; devuelve 0 si la había o los segundos que faltan para la siguiente"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+def frame_size(data: str, limit: int = MAX_FRAME_BYTES) -> int:
+    """Bytes UTF-8 del frame, sin codificarlo cuando el número de caracteres ya decide si pasa de limit"""
+    if len(data) * 4 <= limit or len(data) > limit:
+        return len(data)
+    return len(data.encode())
+
+
+class FlowControl:
+    """Admisión de frames entrantes: límite por usuario, tamaño máximo y presupuesto global"""
+
+    def __init__(self, rate: float = RATE_PER_S, burst: int = RATE_BURST, max_frame: int = MAX_FRAME_BYTES,
+                 max_in_flight: int = MAX_IN_FLIGHT, policy: str = FLOW_POLICY):
+        if policy not in ("throttle", "reject", "disconnect"):
+            raise ValueError(f"Política de control de flujo desconocida: {policy}")
+        self.rate = rate
+        self.burst = burst
+        self.max_frame = max_frame
+        self.max_in_flight = max_in_flight
+        self.policy = policy
+        # Un bucket por usuario (compartido por todas sus conexiones en este proceso)
+        self.buckets = {}
+        self.slots = asyncio.Semaphore(max_in_flight)
+        self.in_flight = 0
+        # Estadísticas
+        self.throttled = 0
+        self.rejected = 0
+        self.disconnected = 0
+
+    def open(self, user_id: int):
+        bucket = self.buckets.get(user_id)
+        if bucket is None:
+            bucket = self.buckets[user_id] = TokenBucket(self.rate, self.burst)
+        bucket.connections += 1
+
+    def close(self, user_id: int):
+        bucket = self.buckets.get(user_id)
+        if bucket is not None:
+            bucket.connections -= 1
+            if bucket.connections <= 0:
+                del self.buckets[user_id]
+
+    def _reject(self, reason: str, error: str, close_code: int, retry_after: float = 0.0,
+                policy: str = None) -> Rejection:
+        policy = policy or self.policy
+        if policy == "disconnect":
+            self.disconnected += 1
+        else:
+            self.rejected += 1
+            close_code = None
+        metrics.flow_limited.labels(reason, policy).inc()
+        return Rejection(reason, error, close_code, round(retry_after, 3))
+
+    async def admit(self, user_id: int, data: str):
+        """Espera turno para procesar data; devuelve None si entra (hay que llamar a release) o un Rejection"""
+        if frame_size(data, self.max_frame) > self.max_frame:
+            return self._reject("size", f"Mensaje demasiado grande (máximo {self.max_frame} bytes)",
+                                MESSAGE_TOO_BIG_CLOSE_CODE,
+                                policy="reject" if self.policy == "throttle" else None)
+
+        bucket = self.buckets[user_id]
+        wait = bucket.take()
+        if wait:
+            if self.policy != "throttle":
+                return self._reject("rate", "Demasiados mensajes", POLICY_VIOLATION_CLOSE_CODE, wait)
+            self.throttled += 1
+            metrics.flow_limited.labels("rate", "throttle").inc()
+            # No se lee el socket mientras tanto: el cliente nota la presión por TCP
+            while wait:
+                await asyncio.sleep(wait)
+                wait = bucket.take()
+
+        if self.slots.locked():
+            if self.policy != "throttle":
+                return self._reject("busy", "Servidor ocupado, intenta de nuevo", TRY_AGAIN_LATER_CLOSE_CODE)
+            self.throttled += 1
+            metrics.flow_limited.labels("busy", "throttle").inc()
+        await self.slots.acquire()
+        self.in_flight += 1
+        return None
+
+    def release(self):
+        self.in_flight -= 1
+        self.slots.release()
+
+    def stats(self) -> dict:
+        return {
+            "policy": self.policy,
+            "rate_per_s": self.rate,
+            "burst": self.burst,
+            "max_frame_bytes": self.max_frame,
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "throttled": self.throttled,
+            "rejected": self.rejected,
+            "disconnected": self.disconnected,
+        }
+
+
+flow_control = FlowControl()
+metrics.in_flight.set_function(lambda: flow_control.in_flight)
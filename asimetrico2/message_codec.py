@@ -0,0 +1,29 @@
+from rsa_utils import load_keys
+from envelope import EnvelopeKeyring
+from blind_index import blind_tokens, blind_token, words
+
+# Cómo se guarda el texto de un mensaje en esta variante: AES-GCM con una clave
+# de datos envuelta con RSA (ver envelope.py)
+private_key, public_key = load_keys()  # 🔑 Cargamos las claves RSA
+keyring = EnvelopeKeyring(private_key, public_key)
+
+def encode_message(text: str) -> dict:
+    """Devuelve las columnas de Message que guardan el texto"""
+    key_id, ciphertext = keyring.encrypt(text)
+    return {"key_id": key_id, "ciphertext": ciphertext, "search_tokens": blind_tokens(text)}
+
+def prepare_encoding():
+    """Deja listo encode_message fuera del servidor (p. ej. en bulk.py): activa la clave de datos"""
+    keyring.load_or_create()
+
+def decode_messages(messages) -> list:
+    """Devuelve el texto de cada mensaje, en el mismo orden (None si no se puede descifrar)"""
+    return keyring.decrypt_many(messages)
+
+def index_text(text: str) -> str:
+    """Lo que se indexa para buscar (ver search.py): tokens ciegos, nunca el texto"""
+    return blind_tokens(text)
+
+def query_terms(query: str) -> list:
+    """Términos de búsqueda convertidos a tokens ciegos, como se indexaron"""
+    return [blind_token(word) for word in words(query)]
@@ -0,0 +1,117 @@
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from fastapi import HTTPException, status
+from passlib.context import CryptContext
+import metrics
+
+# Pool dedicado a bcrypt, separado del threadpool de Starlette:
+#   CHAT_BCRYPT_POOL    -> "process" (usa todos los núcleos) o "thread"
+#   CHAT_BCRYPT_WORKERS -> procesos/hilos del pool
+#   CHAT_BCRYPT_QUEUE   -> peticiones que pueden esperar turno antes de rechazar
+POOL_KIND = os.getenv("CHAT_BCRYPT_POOL", "process")
+POOL_WORKERS = int(os.getenv("CHAT_BCRYPT_WORKERS", str(os.cpu_count() or 2)))
+POOL_QUEUE = int(os.getenv("CHAT_BCRYPT_QUEUE", "64"))
+RETRY_AFTER_SECONDS = 1
+# Los procesos del pool no salen de un fork del servidor: se crean al primer bcrypt, con
+# uvicorn ya escuchando, y heredarían el socket de escucha y los de los clientes (un
+# socket que el servidor cierra seguiría abierto en el hijo y el puerto quedaría ocupado)
+MP_CONTEXT = multiprocessing.get_context(
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn")
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
+# Funciones de módulo para que el pool de procesos pueda serializarlas;
+# devuelven también cuánto tardó bcrypt, sin contar la espera en cola
+def _hash(password: str):
+    start = time.perf_counter()
+    return pwd_context.hash(password), (time.perf_counter() - start) * 1000
+
+
+def _verify(password: str, hashed: str):
+    start = time.perf_counter()
+    return pwd_context.verify(password, hashed), (time.perf_counter() - start) * 1000
+
+
+class PasswordPool:
+    """Ejecuta bcrypt en un pool acotado y rechaza rápido (503) cuando está saturado"""
+
+    def __init__(self, kind: str = POOL_KIND, workers: int = POOL_WORKERS, queue_size: int = POOL_QUEUE):
+        if kind not in ("process", "thread"):
+            raise ValueError(f"Tipo de pool desconocido: {kind}")
+        self.kind = kind
+        self.workers = workers
+        self.capacity = workers + queue_size
+        self.executor = None
+        # Métricas
+        self.in_flight = 0
+        self.rejected = 0
+        self.completed = 0
+        self.hash_ms_total = 0.0
+        self.hash_ms_max = 0.0
+        self.wait_ms_total = 0.0
+
+    def start(self):
+        if self.kind == "process":
+            self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=MP_CONTEXT)
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+
+    def stop(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    async def hash(self, password: str) -> str:
+        return await self._run(_hash, password)
+
+    async def verify(self, password: str, hashed: str) -> bool:
+        return await self._run(_verify, password, hashed)
+
+    async def _run(self, func, *args):
+        # Admisión: si ya hay trabajo de sobra en cola, mejor rechazar que hacer esperar a todos
+        if self.in_flight >= self.capacity:
+            self.rejected += 1
+            metrics.bcrypt_rejected.inc()
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                                detail="Servidor ocupado, intenta de nuevo",
+                                headers={"Retry-After": str(RETRY_AFTER_SECONDS)})
+        if self.executor is None:
+            self.start()
+        self.in_flight += 1
+        start = time.perf_counter()
+        try:
+            result, hash_ms = await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+        finally:
+            self.in_flight -= 1
+        total_ms = (time.perf_counter() - start) * 1000
+        self.completed += 1
+        self.hash_ms_total += hash_ms
+        self.hash_ms_max = max(self.hash_ms_max, hash_ms)
+        self.wait_ms_total += max(0.0, total_ms - hash_ms)
+        metrics.bcrypt_seconds.labels(func.__name__.lstrip("_")).observe(hash_ms / 1000)
+        return result
+
+    @property
+    def queue_depth(self) -> int:
+        return max(0, self.in_flight - self.workers)
+
+    def stats(self) -> dict:
+        return {
+            "kind": self.kind,
+            "workers": self.workers,
+            "in_flight": self.in_flight,
+            "queue_depth": self.queue_depth,
+            "rejected": self.rejected,
+            "completed": self.completed,
+            "avg_hash_ms": round(self.hash_ms_total / self.completed, 3) if self.completed else 0.0,
+            "max_hash_ms": round(self.hash_ms_max, 3),
+            "avg_wait_ms": round(self.wait_ms_total / self.completed, 3) if self.completed else 0.0,
+        }
+
+
+password_pool = PasswordPool()
+metrics.bcrypt_in_flight.set_function(lambda: password_pool.in_flight)
@@ -1,5 +1,4 @@
 from Crypto.PublicKey import RSA
-from Crypto.Cipher import PKCS1_OAEP
 
 # === Generar claves RSA si no existen ===
 def generate_keys():
@@ -18,13 +17,3 @@ def load_keys():
     with open("public.pem", "rb") as f:
         public_key = RSA.import_key(f.read())
     return private_key, public_key
-
-# === Cifrar con clave pública ===
-def encrypt_rsa(message: str, public_key) -> bytes:
-    cipher = PKCS1_OAEP.new(public_key)
-    return cipher.encrypt(message.encode())
-
-# === Descifrar con clave privada ===
-def decrypt_rsa(cipher_text: bytes, private_key) -> str:
-    cipher = PKCS1_OAEP.new(private_key)
-    return cipher.decrypt(cipher_text).decode()
@@ -0,0 +1,30 @@
+import multiprocessing
+import os
+
+
+def _init_db(directory, barrier, results):
+    os.chdir(directory)
+    import database
+    # La conexión heredada apunta a la DB del padre: este worker abre la suya
+    database.engine.dispose(close=False)
+    barrier.wait()
+    try:
+        database.init_db()
+        results.put("ok")
+    except Exception as exc:
+        results.put(repr(exc))
+
+
+def test_init_db_survives_workers_starting_together(tmp_path):
+    context = multiprocessing.get_context("fork")
+    for round_ in range(3):
+        directory = tmp_path / str(round_)
+        directory.mkdir()
+        barrier, results = context.Barrier(4), context.Queue()
+        workers = [context.Process(target=_init_db, args=(str(directory), barrier, results)) for _ in range(4)]
+        for worker in workers:
+            worker.start()
+        outcomes = [results.get(timeout=30) for _ in workers]
+        for worker in workers:
+            worker.join()
+        assert outcomes == ["ok"] * 4
@@ -0,0 +1,100 @@
+from datetime import timedelta
+import pytest
+from Crypto.Cipher import PKCS1_OAEP
+from Crypto.PublicKey import RSA
+from database import Message
+from rsa_utils import load_keys
+import envelope
+from envelope import EnvelopeKeyring
+
+
+class CountingUnwrap:
+    """Envuelve el cipher RSA para contar cuántas claves se desenvuelven"""
+
+    def __init__(self, cipher):
+        self.cipher = cipher
+        self.calls = 0
+
+    def decrypt(self, data):
+        self.calls += 1
+        return self.cipher.decrypt(data)
+
+
+@pytest.fixture
+def keyring(db):
+    keyring = EnvelopeKeyring(*load_keys())
+    keyring.load_or_create()
+    return keyring
+
+
+def test_round_trip(keyring):
+    key_id, blob = keyring.encrypt("hola ñandú 😀")
+    assert key_id == keyring.current_id
+    assert b"hola" not in blob
+    assert keyring.decrypt(key_id, blob) == "hola ñandú 😀"
+    # Nonce aleatorio: el mismo texto no da el mismo cifrado
+    assert keyring.encrypt("hola ñandú 😀")[1] != blob
+
+
+def test_decrypt_many_mixes_legacy_rsa_and_envelope_rows(keyring):
+    _, public_key = load_keys()
+    legacy = Message(content=PKCS1_OAEP.new(public_key).encrypt("de antes".encode()).hex())
+    key_id, blob = keyring.encrypt("de ahora")
+    current = Message(key_id=key_id, ciphertext=blob)
+    broken = Message(content="no es hex")
+    assert keyring.decrypt_many([legacy, current, broken, current]) == ["de antes", "de ahora", None, "de ahora"]
+
+
+def test_rotation_keeps_old_rows_readable(keyring, monkeypatch):
+    old_id, old_blob = keyring.encrypt("vieja")
+    monkeypatch.setattr(envelope, "DATA_KEY_MAX_MESSAGES", keyring.current_uses)
+    assert keyring.needs_rotation()
+    keyring.rotate()
+    assert keyring.current_id != old_id and not keyring.needs_rotation()
+    new_id, new_blob = keyring.encrypt("nueva")
+    assert new_id == keyring.current_id
+
+    # Otro proceso arranca con la clave más reciente y lee las dos
+    restarted = EnvelopeKeyring(*load_keys())
+    restarted.load_or_create()
+    assert restarted.current_id == new_id
+    assert restarted.decrypt(old_id, old_blob) == "vieja"
+    assert restarted.decrypt(new_id, new_blob) == "nueva"
+
+    # Con la clave caducada, arrancar crea otra
+    monkeypatch.setattr(envelope, "DATA_KEY_MAX_AGE", timedelta(0))
+    restarted.load_or_create()
+    assert restarted.current_id not in (old_id, new_id)
+
+
+def test_each_data_key_is_unwrapped_once(keyring):
+    first = [Message(key_id=key_id, ciphertext=blob) for key_id, blob in
+             (keyring.encrypt(f"uno {i}") for i in range(5))]
+    keyring.rotate()
+    second = [Message(key_id=key_id, ciphertext=blob) for key_id, blob in
+              (keyring.encrypt(f"dos {i}") for i in range(5))]
+
+    reader = EnvelopeKeyring(*load_keys())
+    reader._unwrap = CountingUnwrap(reader._unwrap)
+    assert reader.decrypt_many(first + second) == [f"uno {i}" for i in range(5)] + [f"dos {i}" for i in range(5)]
+    assert reader.decrypt_many(first + second)[0] == "uno 0"
+    assert reader._unwrap.calls == 2
+
+
+def test_tampered_or_foreign_ciphertext_raises(keyring):
+    key_id, blob = keyring.encrypt("secreto")
+    corrupted_tag = blob[:-1] + bytes([blob[-1] ^ 1])
+    corrupted_body = blob[:envelope.NONCE_SIZE] + bytes([blob[envelope.NONCE_SIZE] ^ 1]) + blob[envelope.NONCE_SIZE + 1:]
+    for bad in (corrupted_tag, corrupted_body, blob[:envelope.TAG_SIZE]):
+        with pytest.raises(ValueError):
+            keyring.decrypt(key_id, bad)
+    with pytest.raises(ValueError, match="desconocida"):
+        keyring.decrypt(key_id + 1000, blob)
+
+    # Con otro par RSA la clave de datos no se puede desenvolver
+    other = RSA.generate(2048)
+    stranger = EnvelopeKeyring(other, other.publickey())
+    with pytest.raises(ValueError):
+        stranger.decrypt(key_id, blob)
+    assert stranger.decrypt_many([Message(key_id=key_id, ciphertext=blob)]) == [None]
+    assert keyring.decrypt_many([Message(key_id=key_id, ciphertext=corrupted_tag)]) == [None]
@@ -0,0 +1,112 @@
+import asyncio
+import pytest
+import flow_control
+from flow_control import FlowControl, TokenBucket, frame_size
+
+
+def admit(flow, *frames):
+    """Resultado de admit para cada frame, soltando el hueco de los que entran"""
+    async def scenario():
+        results = []
+        for data in frames:
+            result = await flow.admit(1, data)
+            if result is None:
+                flow.release()
+            results.append(result)
+        return results
+    return asyncio.run(scenario())
+
+
+def test_size_limit_counts_utf8_bytes():
+    assert frame_size("😀" * 30, 100) == 120
+    assert frame_size("😀" * 25, 100) <= 100
+    assert frame_size("a" * 101, 100) > 100
+
+    flow = FlowControl(max_frame=100, policy="reject")
+    flow.open(1)
+    too_big, fits, ascii_fits = admit(flow, "😀" * 30, "😀" * 25, "a" * 100)
+    assert too_big.reason == "size" and too_big.close_code is None
+    assert fits is None and ascii_fits is None
+
+
+def test_oversized_frame_is_rejected_even_when_throttling():
+    flow = FlowControl(max_frame=10, policy="throttle")
+    flow.open(1)
+    [rejection] = admit(flow, "ñ" * 6)
+    assert rejection.reason == "size" and rejection.close_code is None
+    disconnect = FlowControl(max_frame=10, policy="disconnect")
+    disconnect.open(1)
+    [rejection] = admit(disconnect, "ñ" * 6)
+    assert rejection.close_code == flow_control.MESSAGE_TOO_BIG_CLOSE_CODE
+
+
+def test_token_bucket_refills_at_rate(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(flow_control.time, "monotonic", lambda: now[0])
+    bucket = TokenBucket(rate=10, burst=2)
+    assert bucket.take() == 0 and bucket.take() == 0
+    assert bucket.take() == pytest.approx(0.1)
+    now[0] += 0.05
+    assert bucket.take() == pytest.approx(0.05)
+    now[0] += 0.06
+    assert bucket.take() == 0
+    # Nunca acumula más de burst
+    now[0] += 60
+    assert [bucket.take() for _ in range(3)] == [0, 0, pytest.approx(0.1)]
+
+
+@pytest.mark.parametrize("policy, close_code", [
+    ("reject", None), ("disconnect", flow_control.POLICY_VIOLATION_CLOSE_CODE)])
+def test_rate_limit_rejects_or_disconnects(policy, close_code):
+    flow = FlowControl(rate=1, burst=2, policy=policy)
+    flow.open(1)
+    first, second, third = admit(flow, "a", "b", "c")
+    assert first is None and second is None
+    assert third.reason == "rate" and third.close_code == close_code and third.retry_after > 0
+
+
+def test_rate_limit_throttles_without_dropping():
+    flow = FlowControl(rate=50, burst=1, policy="throttle")
+    flow.open(1)
+
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        for data in ("a", "b", "c"):
+            assert await flow.admit(1, data) is None
+            flow.release()
+        return loop.time() - started
+
+    # Dos esperas de 1/50 s: el frame no se pierde, sólo llega más tarde
+    assert asyncio.run(scenario()) >= 0.03
+    assert flow.throttled == 2 and flow.rejected == 0
+
+
+@pytest.mark.parametrize("policy, close_code", [
+    ("reject", None), ("disconnect", flow_control.TRY_AGAIN_LATER_CLOSE_CODE)])
+def test_busy_server_rejects_or_disconnects(policy, close_code):
+    flow = FlowControl(max_in_flight=1, policy=policy)
+    flow.open(1)
+
+    async def scenario():
+        assert await flow.admit(1, "a") is None
+        return await flow.admit(1, "b")
+
+    rejection = asyncio.run(scenario())
+    assert rejection.reason == "busy" and rejection.close_code == close_code
+
+
+def test_busy_server_throttles_until_release():
+    flow = FlowControl(max_in_flight=1, policy="throttle")
+    flow.open(1)
+
+    async def scenario():
+        assert await flow.admit(1, "a") is None
+        waiting = asyncio.create_task(flow.admit(1, "b"))
+        await asyncio.sleep(0.01)
+        assert not waiting.done()
+        flow.release()
+        return await waiting
+
+    assert asyncio.run(scenario()) is None
+    assert flow.in_flight == 1 and flow.throttled == 1
@@ -0,0 +1,87 @@
+from datetime import datetime, date, timedelta
+import pytest
+from sqlalchemy import select
+import archive
+from database import Message, User
+from message_codec import encode_message, prepare_encoding
+from conftest import login
+
+
+def add(db, user_id: int, room: str, text: str, timestamp: datetime) -> int:
+    msg = Message(**encode_message(text), user_id=user_id, room=room, timestamp=timestamp)
+    db.add(msg)
+    db.commit()
+    return msg.id
+
+
+def pages(client, token: str, room: str, limit: int) -> list:
+    """Contenido de todas las páginas del historial de la sala, siguiendo el cursor"""
+    seen, cursor = [], None
+    while True:
+        params = {"room": room, "limit": limit, **({"cursor": cursor} if cursor else {})}
+        page = client.get("/messages", params=params, headers={"Authorization": f"Bearer {token}"}).json()
+        seen += [msg["content"] for msg in page["messages"]]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return seen
+
+
+@pytest.fixture
+def manual_archive(monkeypatch):
+    """El archivador del servidor no arranca y se archiva sin esperar a los checkpoints (sha256)
+
+    Va antes que client: el archivador corre al arrancar el servidor.
+    """
+    monkeypatch.setattr(archive, "ARCHIVE_AFTER_DAYS", 0)
+    monkeypatch.setattr(archive, "id_ceiling", None)
+
+
+def test_late_import_is_merged_with_archived_day(manual_archive, client, db):
+    prepare_encoding()
+    token = login(client, "historian")
+    user_id = db.execute(select(User.id).where(User.username == "historian")).scalar_one()
+    room, day = "tardia", date(2022, 5, 1)
+
+    def at(hour, minute=0):
+        return datetime.combine(day, datetime.min.time()) + timedelta(hours=hour, minutes=minute)
+
+    add(db, user_id, room, "archivado 12:00", at(12))
+    add(db, user_id, room, "archivado 13:00", at(13))
+    add(db, user_id, room, "hoy", datetime.utcnow())
+    assert archive.archive_day(day) == 2
+    # Importados después: ids mayores que los archivados, horas intercaladas
+    add(db, user_id, room, "importado 10:00", at(10))
+    add(db, user_id, room, "importado 12:30", at(12, 30))
+
+    expected = ["hoy", "archivado 13:00", "importado 12:30", "archivado 12:00", "importado 10:00"]
+    for limit in (1, 2, 3, 5):
+        assert pages(client, token, room, limit) == expected
+
+
+def test_history_and_search_page_across_archive(manual_archive, client, db):
+    prepare_encoding()
+    token = login(client, "archivist")
+    user_id = db.execute(select(User.id).where(User.username == "archivist")).scalar_one()
+    room, day = "mudanza", date(2022, 6, 1)
+    start = datetime.combine(day, datetime.min.time())
+    archived = [f"capibara viejo {n}" for n in range(5)]
+    hot = [f"capibara nuevo {n}" for n in range(4)]
+    for n, text in enumerate(archived):
+        add(db, user_id, room, text, start + timedelta(minutes=n))
+    for text in hot:
+        add(db, user_id, room, text, datetime.utcnow())
+    assert archive.archive_day(day) == len(archived)
+
+    expected = list(reversed(archived + hot))
+    for limit in (2, 4, 9):
+        assert pages(client, token, room, limit) == expected
+
+    found, cursor = [], None
+    while True:
+        params = {"q": "capibara", "room": room, "limit": 2, **({"cursor": cursor} if cursor else {})}
+        page = client.get("/messages/search", params=params, headers={"Authorization": f"Bearer {token}"}).json()
+        found += [msg["content"] for msg in page["messages"]]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert sorted(found) == sorted(archived + hot)
@@ -0,0 +1,27 @@
+import asyncio
+import socket
+from password_pool import PasswordPool
+
+
+def test_pool_workers_do_not_hold_server_sockets():
+    # Un "servidor" con un cliente conectado antes de que exista el pool
+    listener = socket.create_server(("127.0.0.1", 0))
+    client = socket.create_connection(listener.getsockname())
+    served, _ = listener.accept()
+    pool = PasswordPool(kind="process", workers=1)
+
+    async def scenario():
+        pool.start()
+        # El primer bcrypt crea el proceso del pool
+        return await pool.verify("clave", await pool.hash("clave"))
+
+    try:
+        assert asyncio.run(scenario())
+        # El servidor cierra su lado: si el hijo heredó el socket, el FIN no sale
+        served.close()
+        client.settimeout(5)
+        assert client.recv(1) == b""
+    finally:
+        pool.stop()
+        client.close()
+        listener.close()
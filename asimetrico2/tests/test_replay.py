@@ -0,0 +1,41 @@
+import json
+from chat import broadcaster
+from ring_buffer import RecentFrames
+from conftest import login
+
+
+def test_live_and_db_replay_agree_on_seq(client):
+    token = login(client, "replay")
+    with client.websocket_connect(f"/ws/{token}?proto=json") as ws:
+        ws.send_text("hola")
+        live = json.loads(ws.receive_text())
+
+    # Sin buffer el replay sale de la DB: la secuencia tiene que ser la misma
+    broadcaster.recent = RecentFrames(broadcaster.recent.size)
+    with client.websocket_connect(f"/ws/{token}?since={live['seq'] - 1}") as ws:
+        replay = json.loads(ws.receive_text())["replay"]
+    assert [(frame["seq"], frame["text"]) for frame in replay] == [(live["seq"], live["text"])]
+
+
+def test_replay_flags_gap_between_db_limit_and_buffer(client, monkeypatch):
+    import history
+    monkeypatch.setattr(history, "REPLAY_DB_LIMIT", 2)
+    broadcaster.recent = RecentFrames(2)
+    token = login(client, "gap")
+    with client.websocket_connect(f"/ws/{token}?proto=json") as ws:
+        seqs = []
+        for n in range(6):
+            ws.send_text(str(n))
+            seqs.append(json.loads(ws.receive_text())["seq"])
+
+    # La DB devuelve 2 y el buffer sólo tiene los 2 últimos: faltan los del medio
+    with client.websocket_connect(f"/ws/{token}?since={seqs[0] - 1}") as ws:
+        event = json.loads(ws.receive_text())
+    assert event["truncated"] is True
+    assert [frame["seq"] for frame in event["replay"]] == seqs[:2] + seqs[-2:]
+
+    # Si el buffer empieza justo donde acaba lo leído, no hay hueco
+    with client.websocket_connect(f"/ws/{token}?since={seqs[1]}") as ws:
+        event = json.loads(ws.receive_text())
+    assert "truncated" not in event
+    assert [frame["seq"] for frame in event["replay"]] == seqs[2:]
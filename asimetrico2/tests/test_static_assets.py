@@ -0,0 +1,47 @@
+import gzip
+from starlette.requests import Request
+from static_assets import StaticAssets
+
+
+def request(**headers) -> Request:
+    return Request({"type": "http", "method": "GET", "path": "/",
+                    "headers": [(name.replace("_", "-").encode(), value.encode()) for name, value in headers.items()]})
+
+
+def make_assets(tmp_path) -> StaticAssets:
+    index = tmp_path / "index.html"
+    index.write_text("<html>" + "<p>hola</p>" * 200 + "</html>", encoding="utf-8")
+    (tmp_path / "static").mkdir()
+    (tmp_path / "static" / "app.js").write_text("console.log('chat');" * 50, encoding="utf-8")
+    assets = StaticAssets(str(index), str(tmp_path / "static"))
+    assets.load()
+    return assets
+
+
+def test_gzip_is_negotiated(tmp_path):
+    assets = make_assets(tmp_path)
+    plain = assets.response(request(), "index.html")
+    assert "content-encoding" not in plain.headers
+    assert plain.headers["content-type"] == "text/html; charset=utf-8"
+
+    zipped = assets.response(request(accept_encoding="deflate, gzip;q=0.8"), "index.html")
+    assert zipped.headers["content-encoding"] == "gzip"
+    assert zipped.headers["vary"] == "Accept-Encoding"
+    assert gzip.decompress(zipped.body) == plain.body
+    assert len(zipped.body) < len(plain.body)
+    # Cada codificación tiene su ETag: una caché no mezcla cuerpos
+    assert zipped.headers["etag"] != plain.headers["etag"]
+
+
+def test_matching_etag_gets_304(tmp_path):
+    assets = make_assets(tmp_path)
+    first = assets.response(request(accept_encoding="gzip"), "static/app.js")
+    assert first.status_code == 200 and first.headers["cache-control"] == "no-cache"
+
+    again = assets.response(request(accept_encoding="gzip", if_none_match=first.headers["etag"]), "static/app.js")
+    assert again.status_code == 304 and again.body == b""
+    assert again.headers["etag"] == first.headers["etag"]
+
+    stale = assets.response(request(accept_encoding="gzip", if_none_match='"otra-gzip"'), "static/app.js")
+    assert stale.status_code == 200
+    assert assets.response(request(), "static/nada.js").status_code == 404
@@ -0,0 +1,192 @@
+import asyncio
+import contextlib
+import contextvars
+import itertools
+import json
+import os
+import random
+import time
+from collections import deque
+from datetime import datetime
+from typing import Optional
+from fastapi import APIRouter, Depends
+from pydantic import BaseModel, Field
+from admin import require_admin
+
+# Trazas por etapa (opt-in) en formato Chrome trace-event: se abren en ui.perfetto.dev
+# o chrome://tracing. Cada petición/mensaje muestreado es una fila con sus etapas.
+#   CHAT_TRACE_SAMPLE   -> fracción de conexiones, mensajes y logins que se trazan (0 = apagado)
+#   CHAT_TRACE_DIR      -> carpeta de los ficheros trace-<pid>-<fecha>.json
+#   CHAT_TRACE_BUFFER   -> eventos en memoria entre volcados (al llenarse se pierden los más viejos)
+#   CHAT_TRACE_FLUSH_S  -> cada cuánto se vuelca el buffer a disco
+# /admin/tracing (ver admin.py) cambia el muestreo en caliente, en el worker que atiende la petición.
+SAMPLE_RATE = float(os.getenv("CHAT_TRACE_SAMPLE", "0"))
+TRACE_DIR = os.getenv("CHAT_TRACE_DIR", "traces")
+BUFFER_SIZE = int(os.getenv("CHAT_TRACE_BUFFER", "100000"))
+FLUSH_S = float(os.getenv("CHAT_TRACE_FLUSH_S", "10"))
+
+router = APIRouter(prefix="/admin", tags=["admin"])
+
+# Traza en curso en esta tarea (su id, que es también la fila del fichero)
+_current = contextvars.ContextVar("chat_trace", default=None)
+# Lo que devuelven trace/span cuando no se traza: sin medir ni reservar nada
+_NOOP = contextlib.nullcontext()
+
+
+class _Span:
+    """Una etapa medida: al salir se guarda como evento "X" (inicio + duración)"""
+    __slots__ = ("tracer", "trace_id", "name", "args", "root", "start", "token")
+
+    def __init__(self, tracer: "Tracer", trace_id: int, name: str, args: dict, root: bool):
+        self.tracer = tracer
+        self.trace_id = trace_id
+        self.name = name
+        self.args = args
+        self.root = root
+
+    def __enter__(self):
+        self.token = _current.set(self.trace_id) if self.root else None
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter()
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+        self.tracer.record(self.trace_id, self.name, self.start, end, self.args)
+        if self.token is not None:
+            _current.reset(self.token)
+        return False
+
+
+class Tracer:
+    """Muestrea trazas, guarda sus etapas en memoria y las vuelca a disco cada FLUSH_S"""
+
+    def __init__(self, sample_rate: float = SAMPLE_RATE, directory: str = TRACE_DIR,
+                 buffer_size: int = BUFFER_SIZE, flush_interval: float = FLUSH_S):
+        if not 0 <= sample_rate <= 1:
+            raise ValueError(f"Tasa de muestreo inválida: {sample_rate}")
+        self.sample_rate = sample_rate
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.events = deque(maxlen=buffer_size)
+        self.pid = os.getpid()
+        self._ids = itertools.count(1)
+        self.task = None
+        # Estadísticas
+        self.sampled = 0
+        self.dropped_events = 0
+        self.files_written = 0
+        self.last_file = None
+
+    def trace(self, name: str, **args):
+        """Empieza una traza si toca muestrear; dentro de otra traza es una etapa más"""
+        trace_id = _current.get()
+        if trace_id is not None:
+            return _Span(self, trace_id, name, args, False)
+        if not self.sample_rate or random.random() >= self.sample_rate:
+            return _NOOP
+        trace_id = next(self._ids)
+        self.sampled += 1
+        # Nombre de la fila en el visor
+        self._append({"name": "thread_name", "ph": "M", "pid": self.pid, "tid": trace_id,
+                      "args": {"name": f"{name} #{trace_id}"}})
+        return _Span(self, trace_id, name, args, True)
+
+    def span(self, name: str, **args):
+        """Etapa de la traza en curso; sin traza no hace nada"""
+        trace_id = _current.get()
+        if trace_id is None:
+            return _NOOP
+        return _Span(self, trace_id, name, args, False)
+
+    def record(self, trace_id: int, name: str, start: float, end: float, args: dict):
+        event = {"name": name, "cat": "chat", "ph": "X", "pid": self.pid, "tid": trace_id,
+                 "ts": round(start * 1e6, 1), "dur": round((end - start) * 1e6, 1)}
+        if args:
+            event["args"] = args
+        self._append(event)
+
+    def _append(self, event: dict):
+        if len(self.events) == self.events.maxlen:
+            self.dropped_events += 1
+        self.events.append(event)
+
+    def set_sample_rate(self, sample_rate: float):
+        if not 0 <= sample_rate <= 1:
+            raise ValueError(f"Tasa de muestreo inválida: {sample_rate}")
+        self.sample_rate = sample_rate
+
+    # === Volcado a disco ===
+    def _write(self, events: list) -> str:
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"trace-{self.pid}-{datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')}.json")
+        process = {"name": "process_name", "ph": "M", "pid": self.pid, "args": {"name": f"chat {self.pid}"}}
+        # Se escribe aparte y se renombra: nadie abre un fichero a medias
+        with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": [process] + events, "displayTimeUnit": "ms"}, f)
+        os.replace(f"{path}.tmp", path)
+        return path
+
+    async def flush(self) -> Optional[str]:
+        """Vuelca lo que haya en el buffer a un fichero nuevo; devuelve su ruta"""
+        if not self.events:
+            return None
+        events = list(self.events)
+        self.events.clear()
+        path = await asyncio.to_thread(self._write, events)
+        self.files_written += 1
+        self.last_file = path
+        return path
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except OSError as exc:
+                print(f"Error volcando trazas: {exc}")
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "sample_rate": self.sample_rate,
+            "buffered_events": len(self.events),
+            "sampled_traces": self.sampled,
+            "dropped_events": self.dropped_events,
+            "files_written": self.files_written,
+            "last_file": self.last_file,
+            "directory": os.path.abspath(self.directory),
+        }
+
+
+tracer = Tracer()
+
+
+# === Administración ===
+class TracingSettings(BaseModel):
+    sample_rate: Optional[float] = Field(None, ge=0, le=1)
+    flush: bool = False
+
+
+@router.get("/tracing", dependencies=[Depends(require_admin)])
+async def tracing_stats():
+    return tracer.stats()
+
+
+@router.post("/tracing", dependencies=[Depends(require_admin)])
+async def configure_tracing(settings: TracingSettings):
+    """Cambia el muestreo en caliente ({"sample_rate": 0.01}) y/o vuelca ya el buffer ({"flush": true})"""
+    if settings.sample_rate is not None:
+        tracer.set_sample_rate(settings.sample_rate)
+        print(f"🔎 Muestreo de trazas: {settings.sample_rate}")
+    written = await tracer.flush() if settings.flush else None
+    return {**tracer.stats(), "written": written}
@@ -0,0 +1,76 @@
+import os
+import threading
+from collections import OrderedDict
+from sqlalchemy import select
+from database import AsyncSessionLocal, User
+
+USER_CACHE_SIZE = int(os.getenv("CHAT_USER_CACHE_SIZE", "10000"))
+
+
+class UserCache:
+    """Caché LRU username -> id compartida por todas las conexiones"""
+
+    def __init__(self, max_size: int = USER_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        # Puede tocarse desde hilos del threadpool además del event loop
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, username: str):
+        with self._lock:
+            user_id = self._entries.get(username)
+            if user_id is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(username)
+            self.hits += 1
+            return user_id
+
+    def put(self, username: str, user_id: int):
+        with self._lock:
+            self._entries[username] = user_id
+            self._entries.move_to_end(username)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, username: str):
+        with self._lock:
+            self._entries.pop(username, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    async def resolve(self, username: str):
+        """Devuelve el id del usuario, yendo a la DB sólo si no está en caché"""
+        user_id = self.get(username)
+        if user_id is None:
+            user_id = await self._load(username)
+            if user_id is not None:
+                self.put(username, user_id)
+        return user_id
+
+    async def _load(self, username: str):
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(select(User.id).where(User.username == username))
+            return result.scalar()
+
+
+class ConnectionContext:
+    """Identidad del remitente, resuelta una sola vez al aceptar el socket"""
+
+    def __init__(self, username: str, user_id: int):
+        self.username = username
+        self.user_id = user_id
+
+
+user_cache = UserCache()
+
+
+async def build_context(username: str):
+    user_id = await user_cache.resolve(username)
+    if user_id is None:
+        return None
+    return ConnectionContext(username, user_id)
@@ -0,0 +1,134 @@
+# Banco de memoria: cuántos bytes cuesta en el servidor cada socket abierto y callado.
+#   python benchmark/mem_bench.py --variant normal --connections 10000
+#   python benchmark/mem_bench.py --variant all --connections 5000 --ws wsproto
+# Se abren N sockets repartidos entre unos pocos usuarios (varias sesiones cada uno,
+# para no pagar N bcrypt) y se mide el RSS del servidor antes y después. El objetivo
+# es 50k sockets por worker; cada proceso necesita N descriptores (ulimit -n).
+import argparse
+import asyncio
+import json
+import math
+import os
+import resource
+import shutil
+import subprocess
+import sys
+from datetime import datetime
+
+import websockets
+
+from run_bench import VARIANTS, RESULTS_DIR, prepare_workdir, wait_ready, login_users, psutil
+
+TARGET_CONNECTIONS = 50_000
+
+
+def rss(pid) -> int:
+    return psutil.Process(pid).memory_info().rss
+
+
+async def settle(pid, seconds=2.0) -> int:
+    """RSS una vez que deja de moverse (el allocator tarda un poco en devolver/pedir)"""
+    await asyncio.sleep(seconds)
+    return rss(pid)
+
+
+async def open_idle(ws_url, tokens, count, proto, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with semaphore:
+            return await websockets.connect(f"{ws_url}/ws/{tokens[i % len(tokens)]}?proto={proto}",
+                                            max_queue=None, ping_interval=None, open_timeout=None)
+
+    return await asyncio.gather(*(one(i) for i in range(count)))
+
+
+async def bench_variant(variant, args):
+    workdir = prepare_workdir(variant)
+    port = args.port
+    base_url = f"http://127.0.0.1:{port}"
+    sessions = math.ceil(args.connections / args.users)
+    env = dict(os.environ, CHAT_MAX_SESSIONS=str(sessions), CHAT_HEARTBEAT_S="0")
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:app", "--port", str(port), "--log-level", "warning",
+         "--ws", args.ws, "--backlog", "4096", "--ws-per-message-deflate", str(args.deflate).lower()],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    sockets = []
+    try:
+        await wait_ready(base_url)
+        print(f"[{variant}] registrando {args.users} usuarios...")
+        tokens = await login_users(base_url, args.users, args.login_concurrency)
+        # Un primer socket para que lo que se crea una sola vez no cuente por conexión
+        sockets += await open_idle(f"ws://127.0.0.1:{port}", tokens, 1, args.proto, 1)
+        before = await settle(server.pid)
+        print(f"[{variant}] abriendo {args.connections} sockets ({sessions} por usuario)...")
+        sockets += await open_idle(f"ws://127.0.0.1:{port}", tokens, args.connections, args.proto,
+                                   args.connect_concurrency)
+        after = await settle(server.pid, 5.0)
+    finally:
+        await asyncio.gather(*(ws.close() for ws in sockets), return_exceptions=True)
+        server.terminate()
+        try:
+            server.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+            server.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    per_connection = (after - before) / args.connections
+    return {
+        "variant": variant,
+        "ws": args.ws,
+        "deflate": args.deflate,
+        "proto": args.proto,
+        "connections": args.connections,
+        "users": args.users,
+        "rss_before_mb": round(before / 2 ** 20, 1),
+        "rss_after_mb": round(after / 2 ** 20, 1),
+        "bytes_per_connection": round(per_connection),
+        f"projected_rss_{TARGET_CONNECTIONS // 1000}k_mb": round((before + per_connection * TARGET_CONNECTIONS) / 2 ** 20),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memoria por socket inactivo del chat")
+    parser.add_argument("--variant", choices=list(VARIANTS) + ["all"], default="normal")
+    parser.add_argument("--connections", type=int, default=5000)
+    parser.add_argument("--users", type=int, default=100, help="usuarios entre los que se reparten los sockets")
+    parser.add_argument("--proto", choices=("text", "json", "msgpack"), default="json")
+    parser.add_argument("--ws", choices=("websockets", "wsproto"), default="websockets",
+                        help="implementación WebSocket de uvicorn")
+    parser.add_argument("--deflate", action=argparse.BooleanOptionalAction, default=True,
+                        help="permessage-deflate en uvicorn (cada socket guarda su estado zlib)")
+    parser.add_argument("--login-concurrency", type=int, default=16)
+    parser.add_argument("--connect-concurrency", type=int, default=50)
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--out", default=RESULTS_DIR)
+    args = parser.parse_args()
+    if psutil is None:
+        raise SystemExit("Hace falta psutil para medir el RSS del servidor")
+
+    # Cada socket es un descriptor en este proceso (y otro en el servidor)
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < args.connections + 100:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(hard, args.connections + 1000), hard))
+
+    variants = list(VARIANTS) if args.variant == "all" else [args.variant]
+    results = []
+    for variant in variants:
+        result = asyncio.run(bench_variant(variant, args))
+        results.append(result)
+        print(f"[{variant}] {result['bytes_per_connection']} bytes/socket "
+              f"(RSS {result['rss_before_mb']} -> {result['rss_after_mb']} MB), "
+              f"~{result[f'projected_rss_{TARGET_CONNECTIONS // 1000}k_mb']} MB con {TARGET_CONNECTIONS} sockets")
+
+    os.makedirs(args.out, exist_ok=True)
+    path = os.path.join(args.out, f"{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}-mem-{args.variant}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"created_at": datetime.utcnow().isoformat(), "args": vars(args), "results": results}, f, indent=2)
+    print(f"Resultados guardados en {path}")
+
+
+if __name__ == "__main__":
+    main()
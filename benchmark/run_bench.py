@@ -0,0 +1,339 @@
+# Banco de carga por WebSocket para las cuatro variantes del chat.
+#   python benchmark/run_bench.py --variant all --users 50 --rate 2 --duration 20
+#   python benchmark/run_bench.py --variant simatrico --baseline benchmark/results/<archivo>.json
+#   python benchmark/run_bench.py --variant normal --flooders 2   -> con clientes abusivos
+# Cada variante se copia a un directorio temporal con DB vacía, se levanta con
+# uvicorn y se mide: latencia de entrega (p50/p95/p99), mensajes/s, filas/s en
+# la DB, CPU y RSS del servidor. Los resultados se guardan en JSON.
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import httpx
+import websockets
+
+try:
+    import psutil
+except ImportError:  # sin psutil no hay CPU/RSS, el resto funciona igual
+    psutil = None
+
+try:
+    import msgpack
+except ImportError:  # sólo hace falta con --proto msgpack
+    msgpack = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+VARIANTS = {
+    "normal": "chat.db",
+    "sha256": "sha256.db",
+    "simatrico": "simetrico.db",
+    "asimetrico2": "asimetrico.db",
+}
+RESULTS_DIR = os.path.join(ROOT, "benchmark", "results")
+MARK = "bench|"
+# Los mensajes de los clientes abusivos no cuentan en la latencia ni en las entregas
+FLOOD_MARK = "flood|"
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))
+    return round(sorted_values[index], 3)
+
+
+def frame_texts(frame, proto):
+    """Textos de los mensajes que trae un frame (json/msgpack pueden traer varios)"""
+    if proto == "text":
+        return [frame]
+    data = msgpack.unpackb(frame) if proto == "msgpack" else json.loads(frame)
+    items = data if isinstance(data, list) else [data]
+    return [item["text"] for item in items if "text" in item]
+
+
+def count_rows(db_path):
+    if not os.path.exists(db_path):
+        return 0
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def prepare_workdir(variant):
+    """Copia la variante a un directorio temporal con la DB vacía"""
+    workdir = tempfile.mkdtemp(prefix=f"bench-{variant}-")
+    src = os.path.join(ROOT, variant)
+    for name in os.listdir(src):
+        path = os.path.join(src, name)
+        if os.path.isfile(path) and not name.endswith((".db", ".db-wal", ".db-shm")):
+            shutil.copy(path, workdir)
+    return workdir
+
+
+async def wait_ready(base_url, timeout=30):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get("/")).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"El servidor no respondió en {base_url}")
+
+
+async def login_users(base_url, count, concurrency):
+    """Registra e inicia sesión de count usuarios; devuelve sus tokens"""
+    semaphore = asyncio.Semaphore(concurrency)
+    run_id = datetime.utcnow().strftime("%H%M%S")
+
+    async def one(client, i):
+        username, password = f"bench{run_id}_{i}", "bench"
+        async with semaphore:
+            await client.post("/auth/register", json={"username": username, "password": password})
+            response = await client.post("/auth/login", json={"username": username, "password": password})
+            response.raise_for_status()
+            return response.json()["access_token"]
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=120) as client:
+        return await asyncio.gather(*(one(client, i) for i in range(count)))
+
+
+class Sampler:
+    """Muestrea CPU y RSS del proceso del servidor"""
+
+    def __init__(self, pid, interval=0.5):
+        self.process = psutil.Process(pid) if psutil else None
+        self.interval = interval
+        self.cpu = []
+        self.rss = []
+
+    async def run(self):
+        if self.process is None:
+            return
+        self.process.cpu_percent(None)
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.cpu.append(self.process.cpu_percent(None))
+                self.rss.append(self.process.memory_info().rss)
+            except psutil.Error:
+                return
+
+    def summary(self):
+        if not self.cpu:
+            return {"cpu_avg_percent": None, "cpu_max_percent": None, "rss_max_mb": None}
+        return {
+            "cpu_avg_percent": round(sum(self.cpu) / len(self.cpu), 1),
+            "cpu_max_percent": round(max(self.cpu), 1),
+            "rss_max_mb": round(max(self.rss) / 2 ** 20, 1),
+        }
+
+
+async def drive_load(ws_url, tokens, rate, duration, receivers, proto="text", flooders=()):
+    """Abre un socket por usuario, envía a rate msgs/s cada uno y mide la entrega
+
+    flooders son tokens de clientes que mandan todo lo rápido que el servidor les deja.
+    """
+    latencies = []
+    sent = 0
+    flood_sent = 0
+    received = 0
+    frames = 0
+    wire_bytes = 0
+    stop_at = None
+
+    async def receive(ws, measure):
+        nonlocal received, frames, wire_bytes
+        async for frame in ws:
+            now = time.perf_counter_ns()
+            frames += 1
+            wire_bytes += len(frame)
+            for text in frame_texts(frame, proto):
+                _, _, body = text.partition(": ")
+                if not body.startswith(MARK):
+                    continue
+                received += 1
+                if measure:
+                    latencies.append((now - int(body.split("|")[3])) / 1e6)
+
+    async def send(ws, index):
+        nonlocal sent
+        interval = 1 / rate
+        n = 0
+        next_at = time.perf_counter()
+        while time.perf_counter() < stop_at:
+            await ws.send(f"{MARK}{index}|{n}|{time.perf_counter_ns()}")
+            sent += 1
+            n += 1
+            next_at += interval
+            await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+
+    async def flood(ws):
+        nonlocal flood_sent
+        try:
+            while time.perf_counter() < stop_at:
+                await ws.send(f"{FLOOD_MARK}{flood_sent}")
+                flood_sent += 1
+                await asyncio.sleep(0)
+        except websockets.ConnectionClosed:
+            pass  # con CHAT_FLOW_POLICY=disconnect el servidor lo echa
+
+    async def drain(ws):
+        try:
+            async for _ in ws:
+                pass
+        except websockets.ConnectionClosed:
+            pass
+
+    sockets = []
+    for token in tokens:
+        sockets.append(await websockets.connect(f"{ws_url}/ws/{token}?proto={proto}", max_queue=None))
+    flood_sockets = [await websockets.connect(f"{ws_url}/ws/{token}?proto={proto}", max_queue=None)
+                     for token in flooders]
+    # Sólo algunos receptores miden latencia para no saturar al propio banco
+    readers = [asyncio.create_task(receive(ws, i < receivers)) for i, ws in enumerate(sockets)]
+    readers += [asyncio.create_task(drain(ws)) for ws in flood_sockets]
+    stop_at = time.perf_counter() + duration
+    started = time.perf_counter()
+    await asyncio.gather(*(send(ws, i) for i, ws in enumerate(sockets)), *(flood(ws) for ws in flood_sockets))
+    await asyncio.sleep(2)  # margen para que terminen de llegar
+    elapsed = time.perf_counter() - started
+    for task in readers:
+        task.cancel()
+    for ws in sockets + flood_sockets:
+        await ws.close()
+    return {"sent": sent, "received": received, "frames": frames, "wire_bytes": wire_bytes,
+            "flood_sent": flood_sent, "latencies": sorted(latencies), "elapsed": elapsed}
+
+
+async def bench_variant(variant, args):
+    workdir = prepare_workdir(variant)
+    port = args.port
+    base_url = f"http://127.0.0.1:{port}"
+    env = dict(os.environ, CHAT_BCRYPT_POOL=os.environ.get("CHAT_BCRYPT_POOL", "process"))
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:app", "--port", str(port), "--log-level", "warning"],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        await wait_ready(base_url)
+        print(f"[{variant}] registrando {args.users} usuarios...")
+        tokens = await login_users(base_url, args.users + args.flooders, args.login_concurrency)
+        tokens, flooders = tokens[:args.users], tokens[args.users:]
+        db_path = os.path.join(workdir, VARIANTS[variant])
+        rows_before = count_rows(db_path)
+        sampler = Sampler(server.pid)
+        sampling = asyncio.create_task(sampler.run())
+        print(f"[{variant}] {args.users} sockets x {args.rate} msgs/s durante {args.duration}s...")
+        load = await drive_load(f"ws://127.0.0.1:{port}", tokens, args.rate, args.duration,
+                                min(args.receivers, len(tokens)), args.proto, flooders)
+        sampling.cancel()
+        rows = count_rows(db_path) - rows_before
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            server.kill()  # p. ej. todavía vaciando la cola de un cliente abusivo
+            server.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    latencies, elapsed = load["latencies"], load["elapsed"]
+    return {
+        "variant": variant,
+        "proto": args.proto,
+        "users": args.users,
+        "rate_per_user": args.rate,
+        "duration_s": args.duration,
+        "flooders": args.flooders,
+        "flood_sent": load["flood_sent"],
+        "sent": load["sent"],
+        "received": load["received"],
+        "frames": load["frames"],
+        "wire_bytes": load["wire_bytes"],
+        "sent_per_s": round(load["sent"] / elapsed, 1),
+        "delivered_per_s": round(load["received"] / elapsed, 1),
+        "frames_per_s": round(load["frames"] / elapsed, 1),
+        "db_rows_per_s": round(rows / elapsed, 1),
+        "latency_ms": {
+            "samples": len(latencies),
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "max": round(latencies[-1], 3) if latencies else None,
+        },
+        **sampler.summary(),
+    }
+
+
+def compare(result, baseline):
+    """Imprime la diferencia con una ejecución anterior de la misma variante"""
+    previous = next((r for r in baseline["results"] if r["variant"] == result["variant"]), None)
+    if previous is None:
+        return
+    for key in ("p50", "p95", "p99"):
+        old, new = previous["latency_ms"][key], result["latency_ms"][key]
+        if old and new:
+            print(f"    {key}: {old:.2f} -> {new:.2f} ms ({(new - old) / old * 100:+.1f}%)")
+    for key in ("delivered_per_s", "frames_per_s", "db_rows_per_s"):
+        old, new = previous.get(key), result[key]
+        if old:
+            print(f"    {key}: {old} -> {new} ({(new - old) / old * 100:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Banco de carga WebSocket del chat")
+    parser.add_argument("--variant", choices=list(VARIANTS) + ["all"], default="all")
+    parser.add_argument("--users", type=int, default=50, help="usuarios/sockets concurrentes")
+    parser.add_argument("--rate", type=float, default=1.0, help="mensajes por segundo de cada usuario")
+    parser.add_argument("--duration", type=float, default=15.0, help="segundos de carga")
+    parser.add_argument("--receivers", type=int, default=20, help="sockets que miden latencia")
+    parser.add_argument("--proto", choices=("text", "json", "msgpack"), default="text",
+                        help="protocolo de salida que piden los sockets")
+    parser.add_argument("--flooders", type=int, default=0,
+                        help="clientes extra que mandan sin pausa (para probar el control de flujo)")
+    parser.add_argument("--login-concurrency", type=int, default=16)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--out", default=RESULTS_DIR)
+    parser.add_argument("--baseline", help="JSON de una ejecución anterior para comparar")
+    args = parser.parse_args()
+
+    variants = list(VARIANTS) if args.variant == "all" else [args.variant]
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    results = []
+    for variant in variants:
+        result = asyncio.run(bench_variant(variant, args))
+        results.append(result)
+        latency = result["latency_ms"]
+        print(f"[{variant}] p50={latency['p50']} p95={latency['p95']} p99={latency['p99']} ms, "
+              f"{result['delivered_per_s']} entregas/s en {result['frames_per_s']} frames/s, "
+              f"{result['db_rows_per_s']} filas/s, "
+              f"CPU {result['cpu_avg_percent']}%, RSS {result['rss_max_mb']} MB")
+        if baseline:
+            compare(result, baseline)
+
+    os.makedirs(args.out, exist_ok=True)
+    path = os.path.join(args.out, f"{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}-{args.variant}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"created_at": datetime.utcnow().isoformat(), "args": vars(args), "results": results}, f, indent=2)
+    print(f"Resultados guardados en {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,16 @@
 from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel
-from sqlalchemy.orm import Session
-from passlib.context import CryptContext
-from jose import jwt, JWTError
-from datetime import datetime, timedelta
-from database import User, SessionLocal
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import User, get_async_db
+from user_cache import user_cache
+from password_pool import password_pool
+from tracing import tracer
+from tokens import token_service, TokenError, Claims
 
 router = APIRouter(prefix="/auth", tags=["auth"])
-SECRET_KEY = "clave_super_secreta"
-ALGORITHM = "HS256"
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+bearer = HTTPBearer()
 
 class UserCreate(BaseModel):
     username: str
@@ -19,26 +20,46 @@ class UserLogin(BaseModel):
     username: str
     password: str
 
-def get_db():
-    db = SessionLocal()
+async def get_current_claims(credentials: HTTPAuthorizationCredentials = Depends(bearer)) -> Claims:
+    # async: la verificación casi siempre sale de la caché, no merece un hilo del threadpool
     try:
-        yield db
-    finally:
-        db.close()
+        return token_service.verify(credentials.credentials)
+    except TokenError as exc:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=str(exc))
 
 @router.post("/register")
-def register(user: UserCreate, db: Session = Depends(get_db)):
-    hashed = pwd_context.hash(user.password)
-    db_user = User(username=user.username, password=hashed)
-    db.add(db_user)
-    db.commit()
+async def register(user: UserCreate, db: AsyncSession = Depends(get_async_db)):
+    with tracer.trace("auth.register"):
+        # bcrypt es CPU puro: va a su propio pool (503 si está saturado)
+        with tracer.span("bcrypt.hash"):
+            hashed = await password_pool.hash(user.password)
+        db_user = User(username=user.username, password=hashed)
+        db.add(db_user)
+        with tracer.span("db.commit"):
+            await db.commit()
+        user_cache.invalidate(user.username)
     return {"msg": "Usuario registrado con éxito"}
 
 @router.post("/login")
-def login(user: UserLogin, db: Session = Depends(get_db)):
-    db_user = db.query(User).filter(User.username == user.username).first()
-    if not db_user or not pwd_context.verify(user.password, db_user.password):
-        raise HTTPException(status_code=400, detail="Credenciales inválidas")
-    token_data = {"sub": db_user.username, "exp": datetime.utcnow() + timedelta(hours=1)}
-    token = jwt.encode(token_data, SECRET_KEY, algorithm=ALGORITHM)
+async def login(user: UserLogin, db: AsyncSession = Depends(get_async_db)):
+    with tracer.trace("auth.login"):
+        with tracer.span("user.lookup"):
+            result = await db.execute(select(User).where(User.username == user.username))
+            db_user = result.scalars().first()
+        with tracer.span("bcrypt.verify"):
+            valid = db_user is not None and await password_pool.verify(user.password, db_user.password)
+        if not valid:
+            raise HTTPException(status_code=400, detail="Credenciales inválidas")
+        with tracer.span("token.issue"):
+            token = token_service.issue(db_user.username)
     return {"access_token": token, "token_type": "bearer"}
+
+@router.post("/logout")
+async def logout(claims: Claims = Depends(get_current_claims)):
+    # Deja de valer en todos los workers y se cierran los sockets abiertos con él
+    await token_service.revoke(claims)
+    return {"msg": "Sesión cerrada"}
+
+async def get_current_username(claims: Claims = Depends(get_current_claims)) -> str:
+    """Dependencia para rutas HTTP que exigen el token de /auth/login"""
+    return claims.username
@@ -0,0 +1,45 @@
+import json
+import os
+
+try:
+    import msgpack
+except ImportError:  # sin msgpack sólo se ofrecen "text" y "json"
+    msgpack = None
+
+# Protocolos de salida que el cliente elige al conectar con ?proto=:
+#   "text"    -> un frame de texto "usuario: mensaje" por mensaje (el de siempre)
+#   "json"    -> {"seq", "room", "text"}; varios mensajes seguidos van en un array JSON
+#   "msgpack" -> lo mismo en MessagePack, en frames binarios
+PROTOCOLS = ("text", "json", "msgpack") if msgpack is not None else ("text", "json")
+
+# Ventana para juntar en un solo frame los mensajes que llegan casi a la vez
+# (sólo json/msgpack); 0 = juntar sólo lo que ya esté en cola, sin esperar
+COALESCE_MS = float(os.getenv("CHAT_COALESCE_MS", "1"))
+MAX_COALESCE = int(os.getenv("CHAT_MAX_COALESCE", "256"))
+
+# permessage-deflate lo negocia uvicorn si el cliente lo ofrece (--ws-per-message-deflate,
+# activo por defecto). En salas grandes los arrays juntados comprimen muy bien; con
+# mensajes sueltos y muchos sockets puede convenir desactivarlo para ahorrar CPU y
+# memoria: cada socket guarda su estado zlib, ~90 KB de los ~135 KB que cuesta uno
+# callado (python benchmark/mem_bench.py --no-deflate para comparar).
+
+
+def pack(proto: str, event: dict):
+    """Serializa un evento (mensaje, replay, ok/error) en el protocolo de la conexión"""
+    if proto == "msgpack":
+        return msgpack.packb(event)
+    return json.dumps(event, ensure_ascii=False)
+
+
+def message_frame(proto: str, seq: int, room: str, text: str):
+    if proto == "text":
+        return text
+    return pack(proto, {"seq": seq, "room": room, "text": text})
+
+
+def join_frames(proto: str, frames: list):
+    """Une frames ya serializados en un array sin volver a serializar cada mensaje"""
+    if proto == "msgpack":
+        packer = msgpack.Packer()
+        return packer.pack_array_header(len(frames)) + b"".join(frames)
+    return "[" + ",".join(frames) + "]"
@@ -0,0 +1,91 @@
+import json
+import os
+import tempfile
+import time
+
+# Archivos de claves que comparten todos los workers (tokens, Fernet, índice ciego):
+# se crean una sola vez aunque arranquen varios a la vez, se reemplazan enteros
+# (nadie lee uno a medias) y cada proceso recoge los cambios de los demás por la
+# fecha de modificación.
+
+# Cada cuánto se mira si otro proceso cambió el archivo (p. ej. tras rotar)
+RELOAD_INTERVAL = 5.0
+
+
+def _write_tmp(path: str, data: bytes) -> str:
+    """Temporal 0600 junto al destino, para poder enlazarlo o reemplazarlo de golpe"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.chmod(tmp_path, 0o600)
+    return tmp_path
+
+
+def create(path: str, data: bytes, label: str) -> bool:
+    """Crea el archivo con data si aún no existe; devuelve si lo creó este proceso"""
+    tmp_path = _write_tmp(path, data)
+    try:
+        # link falla si otro worker ya creó el archivo: gana el primero
+        os.link(tmp_path, path)
+        print(f"🔐 {label} creado: {path}")
+        return True
+    except FileExistsError:
+        return False
+    finally:
+        os.unlink(tmp_path)
+
+
+def replace(path: str, data: bytes):
+    os.replace(_write_tmp(path, data), path)
+
+
+class KeyFile:
+    """Archivo JSON de claves que se relee cuando otro proceso lo cambia
+
+    Las subclases dan el contenido inicial (initial) y aplican lo leído (load).
+    """
+
+    label = "Archivo de claves"
+
+    def __init__(self, path: str):
+        self.path = path
+        self._mtime = None
+        self._checked = 0.0
+
+    def initial(self) -> dict:
+        raise NotImplementedError
+
+    def load(self, data: dict):
+        raise NotImplementedError
+
+    def reload(self):
+        if not os.path.exists(self.path):
+            create(self.path, self._dump(self.initial()), self.label)
+        # La fecha se toma antes de leer: si cambia mientras tanto, se vuelve a leer
+        mtime = os.path.getmtime(self.path)
+        self.load(self._read())
+        self._mtime = mtime
+        self._checked = time.monotonic()
+
+    def _read(self) -> dict:
+        with open(self.path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _save(self, data: dict):
+        replace(self.path, self._dump(data))
+        self.reload()
+
+    @staticmethod
+    def _dump(data: dict) -> bytes:
+        return json.dumps(data, indent=2).encode()
+
+    def _maybe_reload(self, force: bool = False):
+        """Relee el archivo si cambió; se mira como mucho cada RELOAD_INTERVAL (salvo force)"""
+        if not force and time.monotonic() - self._checked < RELOAD_INTERVAL:
+            return
+        self._checked = time.monotonic()
+        try:
+            if os.path.getmtime(self.path) != self._mtime:
+                self.reload()
+        except OSError:
+            pass
@@ -0,0 +1,22 @@
+import re
+
+# Cómo se guarda el texto de un mensaje en esta variante: en claro
+
+def encode_message(text: str) -> dict:
+    """Devuelve las columnas de Message que guardan el texto"""
+    return {"content": text}
+
+def prepare_encoding():
+    """Deja listo encode_message fuera del servidor (p. ej. en bulk.py): en claro no hace falta nada"""
+
+def decode_messages(messages) -> list:
+    """Devuelve el texto de cada mensaje, en el mismo orden"""
+    return [m.content for m in messages]
+
+def index_text(text: str) -> str:
+    """Lo que se indexa para buscar (ver search.py): el propio texto"""
+    return text
+
+def query_terms(query: str) -> list:
+    """Términos de búsqueda; FTS5 los normaliza igual que al indexar"""
+    return re.findall(r"\w+", query)
@@ -0,0 +1,170 @@
+import asyncio
+import os
+import time
+from sqlalchemy.orm import make_transient
+import metrics
+from database import AsyncSessionLocal
+from tracing import tracer
+
+# Parámetros del "group commit":
+#   CHAT_DB_BATCH_SIZE   -> máximo de mensajes por transacción
+#   CHAT_DB_MAX_DELAY_MS -> cuánto espera el lote a llenarse antes de escribir
+#   CHAT_DB_DURABILITY   -> "commit": el handler espera al commit
+#                           "enqueue": el handler sigue en cuanto el mensaje está en cola
+# En los dos modos on_commit(msg) corre tras el commit, ya con el id asignado.
+BATCH_SIZE = int(os.getenv("CHAT_DB_BATCH_SIZE", "500"))
+MAX_DELAY = float(os.getenv("CHAT_DB_MAX_DELAY_MS", "10")) / 1000
+DURABILITY = os.getenv("CHAT_DB_DURABILITY", "commit")
+QUEUE_SIZE = int(os.getenv("CHAT_DB_QUEUE_SIZE", "10000"))
+# Intentos por lote: un fallo pasajero (p. ej. "database is locked") se reintenta una vez
+WRITE_ATTEMPTS = 2
+
+_STOP = object()
+
+
+class WriteError(Exception):
+    """El lote del mensaje no se pudo guardar (ni reintentándolo)"""
+
+
+class MessageWriter:
+    """Escritor único que persiste los mensajes en lotes, sin bloquear el event loop"""
+
+    def __init__(self, batch_size: int = BATCH_SIZE, max_delay: float = MAX_DELAY,
+                 durability: str = DURABILITY, queue_size: int = QUEUE_SIZE):
+        if durability not in ("commit", "enqueue"):
+            raise ValueError(f"Modo de durabilidad desconocido: {durability}")
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.durability = durability
+        self.queue_size = queue_size
+        self.queue = None
+        self.task = None
+        # Corrutinas hook(db, messages) que corren dentro de la transacción de
+        # cada lote, con los mensajes ya añadidos a la sesión y antes del commit
+        self.hooks = []
+        # Estadísticas de vaciado
+        self.flushes = 0
+        self.rows_written = 0
+        self.failed_rows = 0
+        self.retries = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+
+    async def start(self):
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Escribe lo pendiente y detiene el escritor"""
+        if self.task is None:
+            return
+        await self.queue.put(_STOP)
+        await self.task
+        self.task = None
+
+    async def submit(self, msg, on_commit=None):
+        """Encola un Message; en modo "commit" vuelve cuando la transacción terminó
+        (WriteError si no se pudo guardar)
+
+        on_commit(msg) se llama cuando su lote se confirma, en el orden de los ids.
+        """
+        future = None
+        if self.durability == "commit":
+            future = asyncio.get_running_loop().create_future()
+        await self.queue.put((msg, future, on_commit))
+        if future is not None:
+            await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self.queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            deadline = loop.time() + self.max_delay
+            while len(batch) < self.batch_size:
+                try:
+                    item = self.queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self.queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+
+    async def _flush(self, batch):
+        messages = [msg for msg, _, _ in batch]
+        start = time.perf_counter()
+        for attempt in range(1, WRITE_ATTEMPTS + 1):
+            try:
+                await self._commit(messages)
+                break
+            except Exception as exc:
+                if attempt < WRITE_ATTEMPTS:
+                    self.retries += 1
+                    print(f"Error guardando {len(batch)} mensajes, reintentando: {exc}")
+                    # La transacción fallida pudo asignarles id: se insertan otra vez desde cero
+                    for msg in messages:
+                        make_transient(msg)
+                        msg.id = None
+                    continue
+                self.failed_rows += len(batch)
+                print(f"Error guardando {len(batch)} mensajes: {exc}")
+                for _, future, _ in batch:
+                    if future is not None and not future.done():
+                        future.set_exception(WriteError(str(exc)))
+                return
+        elapsed = time.perf_counter() - start
+        metrics.db_commit_seconds.observe(elapsed)
+        metrics.db_batch_rows.observe(len(batch))
+        elapsed_ms = elapsed * 1000
+        self.flushes += 1
+        self.rows_written += len(batch)
+        self.last_flush_ms = elapsed_ms
+        self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+        self.total_flush_ms += elapsed_ms
+        for msg, future, on_commit in batch:
+            if on_commit is not None:
+                try:
+                    on_commit(msg)
+                except Exception as exc:
+                    print(f"Error tras guardar el mensaje {msg.id}: {exc}")
+            if future is not None and not future.done():
+                future.set_result(None)
+
+    async def _commit(self, messages):
+        # Una sola transacción (y un solo fsync) para todo el lote
+        with tracer.trace("db.flush", rows=len(messages)):
+            async with AsyncSessionLocal() as db:
+                db.add_all(messages)
+                for hook in self.hooks:
+                    await hook(db, messages)
+                with tracer.span("db.commit"):
+                    await db.commit()
+
+    def stats(self) -> dict:
+        return {
+            "durability": self.durability,
+            "pending": self.queue.qsize() if self.queue is not None else 0,
+            "flushes": self.flushes,
+            "rows_written": self.rows_written,
+            "failed_rows": self.failed_rows,
+            "retries": self.retries,
+            "last_flush_ms": round(self.last_flush_ms, 3),
+            "max_flush_ms": round(self.max_flush_ms, 3),
+            "avg_flush_ms": round(self.total_flush_ms / self.flushes, 3) if self.flushes else 0.0,
+        }
+
+
+message_writer = MessageWriter()
+metrics.db_pending.set_function(lambda: message_writer.stats()["pending"])
@@ -0,0 +1,62 @@
+# Hub local de PUBLISH/SUBSCRIBE que habla el protocolo de Redis (RESP).
+# Sustituye a Redis en desarrollo o pruebas para correr varios workers:
+#   python pubsub_hub.py --unix /tmp/chat-hub.sock
+#   CHAT_BROKER_URL=unix:///tmp/chat-hub.sock python -m uvicorn server:app --workers 4
+import argparse
+import asyncio
+from broker import encode_bulk, encode_command, read_reply, BrokerError
+
+subscribers = {}  # canal -> set de writers suscritos
+
+
+async def handle_client(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    channels = set()
+    try:
+        while True:
+            command = await read_reply(reader)
+            if not isinstance(command, list) or not command:
+                raise BrokerError("Se esperaba un comando RESP")
+            name = command[0].upper()
+            if name == b"SUBSCRIBE":
+                for channel in command[1:]:
+                    subscribers.setdefault(channel, set()).add(writer)
+                    channels.add(channel)
+                    writer.write(b"*3\r\n" + encode_bulk(b"subscribe") + encode_bulk(channel)
+                                 + b":%d\r\n" % len(channels))
+            elif name == b"PUBLISH":
+                channel, payload = command[1], command[2]
+                targets = subscribers.get(channel, ())
+                frame = encode_command(b"message", channel, payload)
+                for target in targets:
+                    target.write(frame)
+                writer.write(b":%d\r\n" % len(targets))
+            elif name == b"PING":
+                writer.write(b"+PONG\r\n")
+            else:
+                writer.write(b"-ERR comando no soportado\r\n")
+            await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError, BrokerError):
+        pass
+    finally:
+        for channel in channels:
+            subscribers.get(channel, set()).discard(writer)
+        writer.close()
+
+
+async def main(args):
+    if args.unix:
+        server = await asyncio.start_unix_server(handle_client, path=args.unix)
+        print(f"Hub escuchando en unix://{args.unix}")
+    else:
+        server = await asyncio.start_server(handle_client, args.host, args.port)
+        print(f"Hub escuchando en redis://{args.host}:{args.port}")
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Hub pub/sub local compatible con Redis")
+    parser.add_argument("--unix", help="ruta del socket Unix")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6379)
+    asyncio.run(main(parser.parse_args()))
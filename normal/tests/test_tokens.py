@@ -0,0 +1,49 @@
+import asyncio
+import pytest
+from database import async_engine
+from tokens import TokenService, TokenError
+
+
+def test_revocations_reach_other_workers(db, tmp_path):
+    # Dos workers: mismo archivo de claves, misma DB, memoria distinta
+    path = str(tmp_path / "token_keys.json")
+    first, second = TokenService(path), TokenService(path)
+    closed = []
+    second.revoke_hooks.append(lambda username, jti: closed.append((username, jti)))
+
+    async def scenario():
+        await second.sync()
+        token, other = first.issue("alice"), first.issue("alice")
+        claims = second.verify(token)
+
+        # Logout en el primero: el segundo lo ve al sincronizar y cierra los sockets de ese token
+        await first.revoke(first.verify(token))
+        with pytest.raises(TokenError):
+            first.verify(token)
+        await second.sync()
+        with pytest.raises(TokenError):
+            second.verify(token)
+        assert closed == [("alice", claims.jti)]
+        assert second.verify(other).username == "alice"
+
+        # Revocar al usuario entero llega igual; un worker que arranca después también la ve
+        await first.revoke_user("alice")
+        await second.sync()
+        with pytest.raises(TokenError):
+            second.verify(other)
+        assert closed[-1] == ("alice", None)
+        late = TokenService(path)
+        await late.sync()
+        for revoked in (token, other):
+            with pytest.raises(TokenError):
+                late.verify(revoked)
+        assert late.verify(first.issue("bob")).username == "bob"
+        await async_engine.dispose()
+
+    asyncio.run(scenario())
+
+
+def test_public_stats_hide_token_keys_and_tracing(client):
+    stats = client.get("/stats").json()
+    assert "tokens" not in stats and "tracing" not in stats
+    assert client.get("/admin/tokens").status_code == 403
@@ -0,0 +1,177 @@
+import asyncio
+import os
+from urllib.parse import urlparse
+
+# Dónde se publican los mensajes del chat:
+#   memory://                -> sólo este proceso (por defecto)
+#   redis://host:6379        -> servidor Redis (o cualquiera que hable RESP)
+#   unix:///tmp/chat-hub.sock -> lo mismo por socket Unix (p. ej. pubsub_hub.py)
+BROKER_URL = os.getenv("CHAT_BROKER_URL", "memory://")
+BROKER_CHANNEL = os.getenv("CHAT_BROKER_CHANNEL", "chat:broadcast")
+RECONNECT_DELAY = 1.0
+# Bytes sin enviar al broker a partir de los cuales se deja de escribirle (broker lento o
+# colgado): publish no puede esperar a drain(), así que el buffer se limita aquí
+MAX_PUBLISH_BUFFER = int(os.getenv("CHAT_BROKER_MAX_BUFFER", str(8 * 1024 * 1024)))
+
+
+class BrokerError(Exception):
+    pass
+
+
+# === Protocolo RESP (el de Redis), sólo lo necesario para PUBLISH/SUBSCRIBE ===
+def encode_bulk(part) -> bytes:
+    if isinstance(part, str):
+        part = part.encode()
+    return b"$%d\r\n%s\r\n" % (len(part), part)
+
+
+def encode_command(*parts) -> bytes:
+    return b"*%d\r\n" % len(parts) + b"".join(encode_bulk(part) for part in parts)
+
+
+async def read_reply(reader: asyncio.StreamReader):
+    line = await reader.readline()
+    if not line.endswith(b"\r\n"):
+        raise ConnectionError("Conexión con el broker cerrada")
+    kind, rest = line[:1], line[1:-2]
+    if kind == b"+":
+        return rest
+    if kind == b"-":
+        raise BrokerError(rest.decode())
+    if kind == b":":
+        return int(rest)
+    if kind == b"$":
+        size = int(rest)
+        if size < 0:
+            return None
+        return (await reader.readexactly(size + 2))[:-2]
+    if kind == b"*":
+        size = int(rest)
+        if size < 0:
+            return None
+        return [await read_reply(reader) for _ in range(size)]
+    raise BrokerError(f"Respuesta RESP desconocida: {line!r}")
+
+
+async def open_stream(url: str):
+    parsed = urlparse(url)
+    if parsed.scheme == "unix":
+        return await asyncio.open_unix_connection(parsed.path)
+    return await asyncio.open_connection(parsed.hostname or "localhost", parsed.port or 6379)
+
+
+class InMemoryBroker:
+    """Broker de un solo proceso: publicar es entregar"""
+
+    def __init__(self):
+        self.handler = None
+
+    async def start(self, handler):
+        self.handler = handler
+
+    async def stop(self):
+        self.handler = None
+
+    def publish(self, payload: bytes):
+        self.handler(payload)
+
+
+class RespBroker:
+    """Broker entre procesos/hosts sobre PUBLISH/SUBSCRIBE de Redis
+
+    Cada worker publica una vez y recibe por su suscripción todo lo publicado
+    (incluido lo suyo), que entrega sólo a sus propios sockets.
+    """
+
+    def __init__(self, url: str, channel: str = BROKER_CHANNEL, max_buffer: int = MAX_PUBLISH_BUFFER):
+        self.url = url
+        self.channel = channel
+        self.max_buffer = max_buffer
+        self.handler = None
+        self.task = None
+        self._pub_writer = None
+        self.published = 0
+        self.local_fallbacks = 0
+        self.buffer_overflows = 0
+        self.handler_errors = 0
+
+    async def start(self, handler):
+        self.handler = handler
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    def publish(self, payload: bytes):
+        writer = self._pub_writer
+        if writer is not None and writer.transport.get_write_buffer_size() < self.max_buffer:
+            writer.write(encode_command(b"PUBLISH", self.channel, payload))
+            self.published += 1
+            return
+        if writer is not None:
+            # El broker no lee al ritmo al que se publica: no se acumula más en memoria
+            self.buffer_overflows += 1
+        # Sin broker (o con él atascado) al menos los sockets de este proceso reciben el mensaje
+        self.local_fallbacks += 1
+        self.handler(payload)
+
+    async def _run(self):
+        while True:
+            writers = []
+            try:
+                pub_reader, pub_writer = await open_stream(self.url)
+                sub_reader, sub_writer = await open_stream(self.url)
+                writers = [pub_writer, sub_writer]
+                sub_writer.write(encode_command(b"SUBSCRIBE", self.channel))
+                await sub_writer.drain()
+                await read_reply(sub_reader)  # confirmación de la suscripción
+                self._pub_writer = pub_writer
+                print(f"Broker conectado: {self.url}")
+                # Si cualquiera de las dos conexiones cae, se reconecta todo
+                listeners = [asyncio.create_task(self._listen(sub_reader)),
+                             asyncio.create_task(self._discard_replies(pub_reader))]
+                try:
+                    done, _ = await asyncio.wait(listeners, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        task.result()
+                finally:
+                    for task in listeners:
+                        task.cancel()
+            except (OSError, ConnectionError, BrokerError, asyncio.IncompleteReadError) as exc:
+                print(f"Broker no disponible ({exc}), reintentando...")
+            finally:
+                self._pub_writer = None
+                for writer in writers:
+                    writer.close()
+            await asyncio.sleep(RECONNECT_DELAY)
+
+    async def _listen(self, reader):
+        while True:
+            reply = await read_reply(reader)
+            if isinstance(reply, list) and len(reply) == 3 and reply[0] == b"message":
+                try:
+                    self.handler(reply[2])
+                except Exception as exc:
+                    # Un payload malo se descarta; la suscripción sigue para los demás
+                    self.handler_errors += 1
+                    print(f"Error entregando un mensaje del broker: {exc!r}")
+
+    async def _discard_replies(self, reader):
+        # PUBLISH responde con el número de suscriptores; no lo necesitamos
+        while True:
+            await read_reply(reader)
+
+
+def make_broker(url: str = BROKER_URL):
+    scheme = urlparse(url).scheme
+    if scheme == "memory":
+        return InMemoryBroker()
+    if scheme in ("redis", "unix"):
+        return RespBroker(url)
+    raise ValueError(f"URL de broker no soportada: {url}")
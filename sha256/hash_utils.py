@@ -1,23 +1,45 @@
 import hashlib
+import os
+from Crypto.Hash import SHA256
 from Crypto.Signature import pkcs1_15
 from Crypto.PublicKey import RSA
 
-def sha256_hash(data: str) -> str:
-    """Devuelve el hash SHA-256 en hexadecimal"""
-    return hashlib.sha256(data.encode()).hexdigest()
+SIGNING_KEY_PATH = os.getenv("CHAT_SIGNING_KEY_PATH", "signing_key.pem")
+
+def chain_hash(prev_hash: str, data: str) -> str:
+    """Hash encadenado: SHA-256 del hash anterior junto con los datos nuevos"""
+    return hashlib.sha256(f"{prev_hash}|{data}".encode()).hexdigest()
+
+def merkle_root(hashes: list) -> str:
+    """Raíz Merkle (SHA-256) de una lista de hashes hex; el último se duplica si el nivel es impar"""
+    if not hashes:
+        return hashlib.sha256(b"").hexdigest()
+    level = [bytes.fromhex(h) for h in hashes]
+    while len(level) > 1:
+        if len(level) % 2:
+            level.append(level[-1])
+        level = [hashlib.sha256(level[i] + level[i + 1]).digest() for i in range(0, len(level), 2)]
+    return level[0].hex()
+
+def load_signing_key(path: str = SIGNING_KEY_PATH) -> RSA.RsaKey:
+    """Carga la clave RSA de firma (la genera la primera vez)"""
+    if not os.path.exists(path):
+        with open(path, "wb") as f:
+            f.write(RSA.generate(2048).export_key())
+        print(f"🔐 Clave de firma generada: {path}")
+    with open(path, "rb") as f:
+        return RSA.import_key(f.read())
 
 def sign_message(message: str, private_key: RSA.RsaKey) -> bytes:
     """Firma el hash del mensaje con la clave privada RSA"""
-    h = hashlib.sha256(message.encode()).digest()
-    signer = pkcs1_15.new(private_key)
-    signature = signer.sign(RSA.import_key(private_key.export_key()))
-    return signature
+    h = SHA256.new(message.encode())
+    return pkcs1_15.new(private_key).sign(h)
 
 def verify_signature(message: str, signature: bytes, public_key: RSA.RsaKey) -> bool:
     """Verifica la firma de un mensaje con la clave pública RSA"""
     try:
-        h = hashlib.sha256(message.encode()).digest()
-        pkcs1_15.new(public_key).verify(RSA.import_key(public_key.export_key()), h)
+        h = SHA256.new(message.encode())
+        pkcs1_15.new(public_key).verify(h, signature)
         return True
     except (ValueError, TypeError):
         return False
@@ -0,0 +1,210 @@
+import asyncio
+import base64
+import itertools
+import json
+import os
+import time
+from collections import deque
+from datetime import datetime
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select, tuple_, or_, and_
+from sqlalchemy.orm import aliased
+from database import AsyncSessionLocal, Message, User, DEFAULT_ROOM
+from auth import get_current_username
+from user_cache import user_cache
+from rooms import dm_room, dm_members, frame_text, valid_room, DM_PREFIX
+from message_codec import decode_messages
+from archive import archived_page
+import metrics
+
+router = APIRouter(prefix="/messages", tags=["messages"])
+
+MAX_PAGE_SIZE = 1000
+# Máximo de mensajes que se reenvían desde la DB al reanudar un socket
+REPLAY_DB_LIMIT = int(os.getenv("CHAT_REPLAY_DB_LIMIT", "1000"))
+# Filas que se leen, descifran y envían de una vez mientras se transmite la página
+STREAM_CHUNK = 200
+
+DECODE_SECONDS = metrics.codec_seconds.labels("decode")
+
+
+async def decode_rows(messages) -> list:
+    """Descifra un lote fuera del event loop (Fernet/RSA pueden ser caros)"""
+    start = time.perf_counter()
+    texts = await asyncio.to_thread(decode_messages, messages)
+    DECODE_SECONDS.observe(time.perf_counter() - start)
+    return texts
+
+
+def encode_cursor(timestamp: datetime, message_id: int) -> str:
+    raw = f"{timestamp.isoformat()}|{message_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        timestamp, message_id = raw.split("|")
+        return datetime.fromisoformat(timestamp), int(message_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
+
+Recipient = aliased(User)
+
+
+def messages_query():
+    """Mensaje con el nombre del remitente y, si es directo, el del destinatario"""
+    return (select(Message, User.username, Recipient.username)
+            .join(User, Message.user_id == User.id)
+            .outerjoin(Recipient, Message.recipient_id == Recipient.id))
+
+
+def page_query(position, limit: int, user_id: Optional[int] = None, room: Optional[str] = DEFAULT_ROOM):
+    """Página de mensajes de una sala, del más nuevo al más viejo, a partir de (timestamp, id)"""
+    stmt = messages_query()
+    if room is not None:
+        # Índice (room, timestamp, id): cada sala se pagina sin tocar las demás
+        stmt = stmt.where(Message.room == room)
+    if user_id is not None:
+        stmt = stmt.where(Message.user_id == user_id)
+    if position is not None:
+        # Keyset: se salta directo a la posición por el índice, cueste lo mismo en cualquier página
+        stmt = stmt.where(tuple_(Message.timestamp, Message.id) < tuple_(*position))
+    return stmt.order_by(Message.timestamp.desc(), Message.id.desc()).limit(limit)
+
+
+def message_json(msg, username: str, recipient, text) -> str:
+    return json.dumps({
+        "id": msg.id,
+        "user_id": msg.user_id,
+        "username": username,
+        "room": msg.room,
+        "recipient": recipient,
+        "content": text,
+        "timestamp": msg.timestamp.isoformat(),
+    }, ensure_ascii=False)
+
+
+async def render_rows(rows) -> str:
+    """Descifra y serializa filas (msg, usuario, destinatario) como trozo del array JSON"""
+    texts = await decode_rows([row[0] for row in rows])
+    return ",".join(message_json(msg, username, recipient, text)
+                    for (msg, username, recipient), text in zip(rows, texts))
+
+
+async def named_rows(db, messages) -> list:
+    """Mensajes sueltos (p. ej. archivados) como filas (msg, usuario, destinatario)"""
+    ids = {msg.user_id for msg in messages} | {msg.recipient_id for msg in messages if msg.recipient_id}
+    names = dict((await db.execute(select(User.id, User.username).where(User.id.in_(ids)))).all()) if ids else {}
+    return [(msg, names.get(msg.user_id), names.get(msg.recipient_id)) for msg in messages]
+
+
+def row_position(row) -> tuple:
+    return row[0].timestamp, row[0].id
+
+
+async def archived_rows(db, room: str, position, limit: int, user_id: Optional[int]) -> list:
+    """La misma página sobre los segmentos archivados"""
+    return await named_rows(db, await asyncio.to_thread(archived_page, room, position, limit, user_id))
+
+
+async def stream_page(position, limit: int, user_id: Optional[int], room: str):
+    """Genera el JSON de la página por trozos, sin armarla entera en memoria
+
+    La tabla caliente y los días archivados se intercalan por (timestamp, id): una
+    importación tardía deja en la tabla filas más viejas que otras ya archivadas.
+    """
+    yield '{"messages":['
+    count = 0
+    last = None
+    async with AsyncSessionLocal() as db:
+        archived = deque(await archived_rows(db, room, position, limit, user_id))
+        result = await db.stream(page_query(position, limit, user_id, room))
+        async for rows in result.partitions(STREAM_CHUNK):
+            chunk = []
+            for row in rows:
+                while archived and row_position(archived[0]) > row_position(row):
+                    chunk.append(archived.popleft())
+                chunk.append(row)
+            chunk = chunk[:limit - count]
+            if chunk:
+                yield ("," if count else "") + await render_rows(chunk)
+                count += len(chunk)
+                last = chunk[-1][0]
+        rows = list(itertools.islice(archived, limit - count))
+        if rows:
+            yield ("," if count else "") + await render_rows(rows)
+            count += len(rows)
+            last = rows[-1][0]
+    next_cursor = encode_cursor(last.timestamp, last.id) if count == limit else None
+    yield '],"next_cursor":' + json.dumps(next_cursor) + "}"
+
+
+async def resolve_room(username: str, room: Optional[str], dm: Optional[str]) -> str:
+    """Sala pedida; las conversaciones directas sólo las pueden leer sus dos participantes"""
+    if dm is not None:
+        me, other = await user_cache.resolve(username), await user_cache.resolve(dm)
+        if other is None:
+            raise HTTPException(status_code=404, detail="Usuario no encontrado")
+        return dm_room(me, other)
+    if room is None:
+        return DEFAULT_ROOM
+    if room.startswith(DM_PREFIX):
+        members = dm_members(room)
+        if members is None or await user_cache.resolve(username) not in members:
+            raise HTTPException(status_code=403, detail="Conversación ajena")
+        return room
+    if not valid_room(room):
+        raise HTTPException(status_code=400, detail="Sala inválida")
+    return room
+
+
+@router.get("")
+async def list_messages(cursor: Optional[str] = None,
+                        limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE),
+                        user_id: Optional[int] = None,
+                        room: Optional[str] = None,
+                        dm: Optional[str] = Query(None, description="usuario de la conversación directa"),
+                        username: str = Depends(get_current_username)):
+    position = decode_cursor(cursor) if cursor else None
+    room = await resolve_room(username, room, dm)
+    return StreamingResponse(stream_page(position, limit, user_id, room), media_type="application/json")
+
+
+async def rows_to_frames(rows) -> list:
+    """Filas (msg, usuario, destinatario) como (seq, sala, texto), los que se reparten por el socket"""
+    texts = await decode_rows([row[0] for row in rows])
+    return [(msg.id, msg.room, frame_text(msg.room, username, text, recipient))
+            for (msg, username, recipient), text in zip(rows, texts) if text is not None]
+
+
+async def load_frames(stmt) -> list:
+    async with AsyncSessionLocal() as db:
+        rows = (await db.execute(stmt)).all()
+    return await rows_to_frames(rows)
+
+
+async def frames_since(since: int, rooms, user_id: int, until: Optional[int] = None) -> tuple:
+    """Mensajes visibles entre las secuencias since y until (sin incluir), cuando el buffer no
+    alcanza, y si quedaron más sin leer por REPLAY_DB_LIMIT"""
+    stmt = messages_query().where(Message.id > since)
+    if until is not None:
+        stmt = stmt.where(Message.id < until)
+    stmt = (stmt.where(or_(Message.room.in_(rooms),
+                           and_(Message.recipient_id.isnot(None),
+                                or_(Message.user_id == user_id, Message.recipient_id == user_id))))
+            .order_by(Message.id)
+            .limit(REPLAY_DB_LIMIT + 1))
+    async with AsyncSessionLocal() as db:
+        rows = (await db.execute(stmt)).all()
+    # La fila de más sólo dice si el límite dejó mensajes fuera
+    return await rows_to_frames(rows[:REPLAY_DB_LIMIT]), len(rows) > REPLAY_DB_LIMIT
+
+
+async def latest_frames(limit: int) -> list:
+    """Los últimos mensajes de todas las salas en orden de secuencia, para precargar el buffer"""
+    stmt = messages_query().order_by(Message.id.desc()).limit(limit)
+    return list(reversed(await load_frames(stmt)))
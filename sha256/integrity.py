@@ -0,0 +1,155 @@
+import asyncio
+import os
+import time
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import select, update, func
+from database import AsyncSessionLocal, Message, Checkpoint, ChainHead, ArchiveSegment, GENESIS_HASH, DEFAULT_ROOM
+from auth import get_current_username
+from hash_utils import chain_hash, merkle_root, load_signing_key, sign_message, verify_signature
+import archive
+import metrics
+
+# Cada cuántos mensajes se firma un checkpoint: una firma RSA por tramo, no por mensaje
+CHECKPOINT_EVERY = int(os.getenv("CHAT_CHECKPOINT_EVERY", "1000"))
+# Mensajes que se leen de una vez al verificar un rango
+VERIFY_CHUNK = 1000
+
+CHAIN_SECONDS = metrics.codec_seconds.labels("chain")
+SIGN_SECONDS = metrics.codec_seconds.labels("sign")
+
+router = APIRouter(prefix="/messages", tags=["messages"])
+
+signing_key = load_signing_key()
+verify_key = signing_key.publickey()
+
+
+def message_data(msg) -> str:
+    """Representación canónica que entra en la cadena"""
+    data = f"{msg.id}|{msg.user_id}|{msg.timestamp.isoformat()}|{msg.content}"
+    # La sala y el destinatario sólo entran si no son los de siempre, así las
+    # filas anteriores a las salas siguen dando el mismo hash
+    if msg.room != DEFAULT_ROOM or msg.recipient_id is not None:
+        data += f"|{msg.room}|{msg.recipient_id}"
+    return data
+
+
+def checkpoint_ceiling(conn) -> int:
+    """Sólo se archiva lo que ya cubre un checkpoint: el siguiente se calcula sobre la tabla"""
+    return conn.execute(select(ChainHead.checkpoint_message_id).where(ChainHead.id == 1)).scalar() or 0
+
+
+archive.id_ceiling = checkpoint_ceiling
+
+
+def checkpoint_payload(first_id: int, last_id: int, root: str, head: str) -> str:
+    return f"{first_id}|{last_id}|{root}|{head}"
+
+
+def checkpoint_is_signed(checkpoint) -> bool:
+    payload = checkpoint_payload(checkpoint.first_message_id, checkpoint.last_message_id,
+                                 checkpoint.merkle_root, checkpoint.chain_hash)
+    return verify_signature(payload, checkpoint.signature, verify_key)
+
+
+async def chain_batch(db, messages):
+    """Hook del MessageWriter: encadena el lote y firma un checkpoint cuando toca"""
+    # Escritura sin efecto para tomar ya el lock de escritura de SQLite: así
+    # ningún otro worker puede mover la cabeza mientras encadenamos este lote
+    await db.execute(update(ChainHead).where(ChainHead.id == 1).values(id=1))
+    head = (await db.execute(select(ChainHead).where(ChainHead.id == 1))).scalar_one()
+    next_id = (await db.execute(select(func.max(Message.id)))).scalar() or 0
+
+    prev = head.head_hash
+    start = time.perf_counter()
+    for msg in messages:
+        next_id += 1
+        msg.id = next_id  # el id forma parte del hash, así que se asigna aquí
+        msg.chain_hash = prev = chain_hash(prev, message_data(msg))
+    CHAIN_SECONDS.observe(time.perf_counter() - start)
+    head.head_hash = prev
+    head.last_message_id = next_id
+    head.pending += len(messages)
+
+    if head.pending >= CHECKPOINT_EVERY:
+        await db.flush()
+        hashes = (await db.execute(
+            select(Message.chain_hash)
+            .where(Message.id > head.checkpoint_message_id, Message.chain_hash.isnot(None))
+            .order_by(Message.id)
+        )).scalars().all()
+        first_id = head.checkpoint_message_id + 1
+        root = merkle_root(hashes)
+        payload = checkpoint_payload(first_id, next_id, root, prev)
+        start = time.perf_counter()
+        signature = await asyncio.to_thread(sign_message, payload, signing_key)
+        SIGN_SECONDS.observe(time.perf_counter() - start)
+        db.add(Checkpoint(first_message_id=first_id, last_message_id=next_id,
+                          merkle_root=root, chain_hash=prev, signature=signature))
+        head.checkpoint_message_id = next_id
+        head.pending = 0
+
+
+@router.get("/verify", dependencies=[Depends(get_current_username)])
+async def verify(from_id: int = Query(1, ge=1), to_id: Optional[int] = Query(None, ge=1)):
+    """Verifica [from_id, to_id] recalculando la cadena desde el checkpoint firmado más cercano"""
+    async with AsyncSessionLocal() as db:
+        if to_id is None:
+            to_id = max((await db.execute(select(func.max(Message.id)))).scalar() or 0,
+                        (await db.execute(select(func.max(ArchiveSegment.last_id)))).scalar() or 0)
+        if to_id < from_id:
+            raise HTTPException(status_code=400, detail="Rango inválido")
+
+        anchor = (await db.execute(
+            select(Checkpoint).where(Checkpoint.last_message_id < from_id)
+            .order_by(Checkpoint.last_message_id.desc()).limit(1)
+        )).scalar()
+        if anchor is not None and not checkpoint_is_signed(anchor):
+            return {"ok": False, "error": "Firma de checkpoint inválida", "checkpoint_id": anchor.id}
+        prev = anchor.chain_hash if anchor else GENESIS_HASH
+        last_id = anchor.last_message_id if anchor else 0
+
+        checkpoints = (await db.execute(
+            select(Checkpoint).where(Checkpoint.last_message_id > last_id, Checkpoint.last_message_id <= to_id)
+            .order_by(Checkpoint.last_message_id)
+        )).scalars().all()
+        pending_checkpoints = list(reversed(checkpoints))
+        window = []
+        checked = 0
+
+        while True:
+            rows = (await db.execute(
+                select(Message.id, Message.user_id, Message.timestamp, Message.content,
+                       Message.room, Message.recipient_id, Message.chain_hash)
+                .where(Message.id > last_id, Message.id <= to_id, Message.chain_hash.isnot(None))
+                .order_by(Message.id).limit(VERIFY_CHUNK)
+            )).all()
+            # Los días archivados siguen en la cadena: se intercalan por id con la tabla
+            archived = await asyncio.to_thread(archive.archived_rows_by_id, last_id, to_id, VERIFY_CHUNK)
+            if archived:
+                rows = sorted(rows + [msg for msg in archived if msg.chain_hash is not None],
+                              key=lambda msg: msg.id)[:VERIFY_CHUNK]
+            if not rows:
+                break
+            for msg in rows:
+                prev = chain_hash(prev, message_data(msg))
+                if prev != msg.chain_hash:
+                    return {"ok": False, "error": "Cadena rota", "message_id": msg.id}
+                window.append(prev)
+                checked += 1
+                if pending_checkpoints and pending_checkpoints[-1].last_message_id == msg.id:
+                    checkpoint = pending_checkpoints.pop()
+                    if (checkpoint.chain_hash != prev or checkpoint.merkle_root != merkle_root(window)
+                            or not checkpoint_is_signed(checkpoint)):
+                        return {"ok": False, "error": "Checkpoint no coincide", "checkpoint_id": checkpoint.id}
+                    window = []
+            last_id = rows[-1].id
+
+    return {
+        "ok": True,
+        "from_id": from_id,
+        "to_id": to_id,
+        "anchor_checkpoint_id": anchor.id if anchor else None,
+        "checked_messages": checked,
+        "checked_checkpoints": len(checkpoints),
+    }
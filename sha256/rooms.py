@@ -0,0 +1,64 @@
+import re
+from sqlalchemy import select, delete, insert
+from database import AsyncSessionLocal, RoomMember, DEFAULT_ROOM
+
+# Nombres de sala válidos; ":" queda fuera para no chocar con las salas "dm:"
+ROOM_NAME = re.compile(r"^[\w-]{1,64}$")
+DM_PREFIX = "dm:"
+
+
+def valid_room(room) -> bool:
+    return isinstance(room, str) and ROOM_NAME.match(room) is not None
+
+
+def dm_room(user_a: int, user_b: int) -> str:
+    """Sala de una conversación directa: la misma sea quien sea el remitente"""
+    low, high = sorted((user_a, user_b))
+    return f"{DM_PREFIX}{low}:{high}"
+
+
+def dm_members(room: str):
+    """Ids de los dos participantes de una sala "dm:", o None si no es directa"""
+    if not room.startswith(DM_PREFIX):
+        return None
+    try:
+        low, high = room[len(DM_PREFIX):].split(":")
+        return int(low), int(high)
+    except ValueError:
+        return None
+
+
+def can_see(room: str, rooms, user_id: int) -> bool:
+    """Si un usuario unido a rooms debe recibir los mensajes de room"""
+    if room in rooms:
+        return True
+    members = dm_members(room)
+    return members is not None and user_id in members
+
+
+def frame_text(room: str, username: str, text: str, recipient=None) -> str:
+    """Texto que se reparte por el socket (y se reenvía al reconectar)"""
+    if recipient is not None:
+        return f"[dm] {username} → {recipient}: {text}"
+    if room == DEFAULT_ROOM:
+        return f"{username}: {text}"
+    return f"[{room}] {username}: {text}"
+
+
+# === Membresía persistida: sobrevive a reconexiones y vale en cualquier worker ===
+async def load_rooms(user_id: int) -> set:
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(select(RoomMember.room).where(RoomMember.user_id == user_id))
+        return {DEFAULT_ROOM, *result.scalars()}
+
+
+async def join_room(user_id: int, room: str):
+    async with AsyncSessionLocal() as db:
+        await db.execute(insert(RoomMember).prefix_with("OR IGNORE").values(user_id=user_id, room=room))
+        await db.commit()
+
+
+async def leave_room(user_id: int, room: str):
+    async with AsyncSessionLocal() as db:
+        await db.execute(delete(RoomMember).where(RoomMember.user_id == user_id, RoomMember.room == room))
+        await db.commit()
@@ -0,0 +1,153 @@
+# Búsqueda en el historial con el índice FTS5 messages_fts (ver database.create_search_index).
+# El trigger lo mantiene al insertar; cada variante decide qué se indexa con
+# message_codec.index_text/query_terms: el texto en claro o tokens ciegos (HMAC).
+#   python search.py --rebuild   -> rehace el índice (tabla caliente + días archivados)
+import argparse
+import asyncio
+import base64
+import itertools
+import json
+import time
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import Response
+from sqlalchemy import select, text, or_, and_, table, column, Integer, String, Float
+from database import engine, init_db, AsyncSessionLocal, Message
+from auth import get_current_username
+from user_cache import user_cache
+from rooms import load_rooms, DM_PREFIX
+from message_codec import decode_messages, index_text, query_terms
+from history import messages_query, named_rows, render_rows, resolve_room
+from archive import archived_by_ids, iter_archived
+import metrics
+
+router = APIRouter(prefix="/messages", tags=["messages"])
+
+MAX_SEARCH_PAGE = 100
+MAX_SEARCH_TERMS = 16
+REBUILD_CHUNK = 1000
+
+messages_fts = table("messages_fts", column("rowid", Integer), column("body", String),
+                     column("room", String), column("rank", Float))
+
+
+def encode_search_cursor(rank: float, message_id: int) -> str:
+    raw = f"{rank!r}|{message_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_search_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        rank, message_id = raw.split("|")
+        return float(rank), int(message_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
+
+def match_expression(terms: list) -> str:
+    """Cualquiera de los términos (OR): bm25 pone primero lo que tiene más y más raros"""
+    return " OR ".join('"' + term.replace('"', '""') + '"' for term in terms)
+
+
+def search_query(match: str, rooms, dm_user_id: Optional[int], position, limit: int):
+    """Aciertos (id, sala, rank) ordenados por relevancia y luego del más nuevo al más viejo"""
+    fts = messages_fts.c
+    visible = [fts.room.in_(rooms)]
+    if dm_user_id is not None:
+        # Salas "dm:<menor>:<mayor>" en las que participa el usuario
+        visible += [fts.room.like(f"{DM_PREFIX}{dm_user_id}:%"), fts.room.like(f"{DM_PREFIX}%:{dm_user_id}")]
+    stmt = (select(fts.rowid, fts.room, fts.rank)
+            .where(text("messages_fts MATCH :match").bindparams(match=match))
+            .where(or_(*visible)))
+    if position is not None:
+        # Keyset sobre (rank, id), como el cursor del historial
+        rank, message_id = position
+        stmt = stmt.where(or_(fts.rank > rank, and_(fts.rank == rank, fts.rowid < message_id)))
+    return stmt.order_by(fts.rank, fts.rowid.desc()).limit(limit)
+
+
+async def hit_rows(db, hits) -> list:
+    """Filas (msg, usuario, destinatario) de los aciertos, en su orden; busca en la tabla y en el archivo"""
+    ids = [hit.rowid for hit in hits]
+    rows = {row[0].id: row for row in (await db.execute(messages_query().where(Message.id.in_(ids)))).all()}
+    missing = [(hit.rowid, hit.room) for hit in hits if hit.rowid not in rows]
+    if missing:
+        archived = await asyncio.to_thread(archived_by_ids, missing)
+        rows.update((row[0].id, row) for row in await named_rows(db, archived))
+    return [rows[message_id] for message_id in ids if message_id in rows]
+
+
+@router.get("/search")
+async def search_messages(q: str = Query(..., min_length=1, max_length=500),
+                          cursor: Optional[str] = None,
+                          limit: int = Query(20, ge=1, le=MAX_SEARCH_PAGE),
+                          room: Optional[str] = None,
+                          dm: Optional[str] = Query(None, description="usuario de la conversación directa"),
+                          username: str = Depends(get_current_username)):
+    """Mensajes que contienen alguno de los términos de q, los más relevantes primero
+
+    Sin room ni dm busca en todas las salas del usuario y en sus conversaciones directas.
+    """
+    started = time.perf_counter()
+    terms = list(dict.fromkeys(query_terms(q)))[:MAX_SEARCH_TERMS]
+    if not terms:
+        raise HTTPException(status_code=400, detail="Búsqueda vacía")
+    position = decode_search_cursor(cursor) if cursor else None
+    if room is None and dm is None:
+        user_id = await user_cache.resolve(username)
+        rooms, dm_user_id = await load_rooms(user_id), user_id
+    else:
+        rooms, dm_user_id = [await resolve_room(username, room, dm)], None
+
+    async with AsyncSessionLocal() as db:
+        hits = (await db.execute(search_query(match_expression(terms), rooms, dm_user_id, position, limit))).all()
+        rows = await hit_rows(db, hits)
+    body = await render_rows(rows) if rows else ""
+    next_cursor = encode_search_cursor(hits[-1].rank, hits[-1].rowid) if len(hits) == limit else None
+    metrics.search_seconds.observe(time.perf_counter() - started)
+    return Response('{"messages":[' + body + '],"next_cursor":' + json.dumps(next_cursor) + "}",
+                    media_type="application/json")
+
+
+# === Reconstrucción (p. ej. tras cambiar la clave del índice ciego) ===
+def _index_chunk(conn, messages) -> int:
+    rows = [{"rowid": msg.id, "body": index_text(plain), "room": msg.room}
+            for msg, plain in zip(messages, decode_messages(messages)) if plain is not None]
+    if rows:
+        # OR REPLACE: el trigger pudo indexar ya algún mensaje nuevo mientras tanto
+        conn.execute(messages_fts.insert().prefix_with("OR REPLACE"), rows)
+    return len(rows)
+
+
+def rebuild_index() -> int:
+    with engine.begin() as conn:
+        conn.execute(messages_fts.delete())
+    total = 0
+    archived = iter_archived()
+    while chunk := list(itertools.islice(archived, REBUILD_CHUNK)):
+        with engine.begin() as conn:
+            total += _index_chunk(conn, chunk)
+    last_id = 0
+    while True:
+        with engine.begin() as conn:
+            chunk = conn.execute(select(Message.__table__).where(Message.id > last_id)
+                                 .order_by(Message.id).limit(REBUILD_CHUNK)).all()
+            if not chunk:
+                break
+            total += _index_chunk(conn, chunk)
+        last_id = chunk[-1].id
+    return total
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Índice de búsqueda del historial")
+    parser.add_argument("--rebuild", action="store_true", help="vacía y vuelve a llenar el índice")
+    args = parser.parse_args()
+    init_db()
+    if args.rebuild:
+        started = time.perf_counter()
+        total = rebuild_index()
+        print(f"✅ {total} mensajes indexados en {time.perf_counter() - started:.1f}s")
+    else:
+        parser.print_help()
@@ -1,17 +1,73 @@
-from fastapi import FastAPI
-from fastapi.responses import HTMLResponse
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
+from fastapi.responses import PlainTextResponse
 from database import init_db
 from auth import router as auth_router
-from chat import router as chat_router
+from chat import router as chat_router, broadcaster
+from history import router as history_router, latest_frames
+from search import router as search_router
+from persistence import message_writer
+from password_pool import password_pool
+from flow_control import flow_control
+from tracing import router as tracing_router, tracer
+from tokens import router as tokens_router, token_service
+import metrics
+from static_assets import assets
+from archive import archiver_loop
+from integrity import router as integrity_router, chain_batch
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    password_pool.start()
+    # 🔎 Trazas muestreadas, volcadas a CHAT_TRACE_DIR (ver tracing.py)
+    tracer.start()
+    # Archivos estáticos leídos y comprimidos una vez, no en cada GET /
+    assets.load()
+    # 🔗 Cada lote persistido se encadena con SHA-256 (ver integrity.py)
+    message_writer.hooks.append(chain_batch)
+    await message_writer.start()
+    await broadcaster.start()
+    # 🎫 Revocaciones de tokens hechas en cualquier worker (ver tokens.py)
+    await token_service.start()
+    # Precargar el buffer de reenvío para que una ola de reconexiones no vaya a la DB
+    broadcaster.warm(await latest_frames(broadcaster.recent.size))
+    # 🗄️ Los días fríos pasan a segmentos comprimidos (ver archive.py)
+    archiver = asyncio.create_task(archiver_loop())
+    yield
+    archiver.cancel()
+    await token_service.stop()
+    await broadcaster.stop()
+    # Vaciar los mensajes pendientes antes de apagar
+    await message_writer.stop()
+    password_pool.stop()
+    await tracer.stop()
+
+app = FastAPI(lifespan=lifespan)
 
 init_db()
 
 app.include_router(auth_router)
 app.include_router(chat_router)
+app.include_router(history_router)
+app.include_router(search_router)
+app.include_router(tracing_router)
+app.include_router(tokens_router)
+app.include_router(integrity_router)
+
+@app.get("/stats")
+async def stats():
+    # Trazas y claves de tokens sólo por /admin/tracing y /admin/tokens
+    return {"persistence": message_writer.stats(), "bcrypt": password_pool.stats(), "flow": flow_control.stats()}
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
 @app.get("/")
-async def root():
-    with open("index.html", "r", encoding="utf-8") as f:
-        return HTMLResponse(f.read())
+async def root(request: Request):
+    return assets.response(request, "index.html")
+
+@app.get("/static/{name}")
+async def static(name: str, request: Request):
+    return assets.response(request, f"static/{name}")
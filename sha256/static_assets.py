@@ -0,0 +1,118 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import threading
+import time
+from fastapi import Request
+from fastapi.responses import Response
+
+try:
+    import brotli
+except ImportError:  # sin brotli se sirve gzip o sin comprimir
+    brotli = None
+
+# Archivos servidos desde memoria: index.html en "/" y lo que haya en static/
+# en "/static/<nombre>". Se leen y comprimen una vez; el disco sólo se mira
+# (un stat por archivo) cada STATIC_RELOAD_S segundos por si cambiaron.
+STATIC_DIR = os.getenv("CHAT_STATIC_DIR", "static")
+STATIC_RELOAD_S = float(os.getenv("CHAT_STATIC_RELOAD_S", "2"))
+# Se revalidan siempre con If-None-Match (un 304 sin cuerpo si no cambió)
+REVALIDATE_CACHE = "no-cache"
+
+
+class Asset:
+    """Un archivo en memoria con sus variantes comprimidas y su ETag"""
+
+    def __init__(self, path: str, mtime: float, body: bytes):
+        self.path = path
+        self.mtime = mtime
+        self.content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        if self.content_type.startswith("text/") or self.content_type.endswith(("javascript", "json")):
+            self.content_type += "; charset=utf-8"
+        self.version = hashlib.sha256(body).hexdigest()[:16]
+        # Sólo se guarda la variante comprimida si de verdad ocupa menos
+        self.bodies = {"identity": body}
+        compressed = gzip.compress(body, compresslevel=9, mtime=0)
+        if len(compressed) < len(body):
+            self.bodies["gzip"] = compressed
+        if brotli is not None:
+            compressed = brotli.compress(body, quality=11)
+            if len(compressed) < len(body):
+                self.bodies["br"] = compressed
+
+    def etag(self, encoding: str) -> str:
+        return f'"{self.version}-{encoding}"'
+
+    def matches(self, if_none_match: str) -> bool:
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return "*" in tags or any(self.etag(encoding) in tags for encoding in self.bodies)
+
+    def pick_encoding(self, accept_encoding: str) -> str:
+        accepted = {part.split(";")[0].strip() for part in accept_encoding.lower().split(",")}
+        for encoding in ("br", "gzip"):
+            if encoding in self.bodies and encoding in accepted:
+                return encoding
+        return "identity"
+
+
+class StaticAssets:
+    """Caché de archivos estáticos compartida por todas las peticiones"""
+
+    def __init__(self, index_path: str = "index.html", static_dir: str = STATIC_DIR):
+        self.index_path = index_path
+        self.static_dir = static_dir
+        self._lock = threading.Lock()
+        self._assets = {}
+        self._checked = 0.0
+
+    def _paths(self) -> dict:
+        paths = {"index.html": self.index_path}
+        if os.path.isdir(self.static_dir):
+            for name in os.listdir(self.static_dir):
+                path = os.path.join(self.static_dir, name)
+                if os.path.isfile(path):
+                    paths[f"static/{name}"] = path
+        return paths
+
+    def load(self):
+        """Lee (o vuelve a leer) los archivos nuevos o modificados"""
+        assets = {}
+        for key, path in self._paths().items():
+            try:
+                mtime = os.path.getmtime(path)
+                current = self._assets.get(key)
+                if current is not None and current.mtime == mtime:
+                    assets[key] = current
+                    continue
+                with open(path, "rb") as f:
+                    assets[key] = Asset(path, mtime, f.read())
+            except OSError:
+                continue  # borrado entre el listado y la lectura
+        with self._lock:
+            self._assets = assets
+            self._checked = time.monotonic()
+
+    def get(self, key: str):
+        if time.monotonic() - self._checked >= STATIC_RELOAD_S:
+            self.load()
+        return self._assets.get(key)
+
+    def response(self, request: Request, key: str) -> Response:
+        asset = self.get(key)
+        if asset is None:
+            return Response(status_code=404)
+        encoding = asset.pick_encoding(request.headers.get("accept-encoding", ""))
+        headers = {
+            "ETag": asset.etag(encoding),
+            "Cache-Control": REVALIDATE_CACHE,
+            "Vary": "Accept-Encoding",
+        }
+        if asset.matches(request.headers.get("if-none-match", "")):
+            return Response(status_code=304, headers=headers)
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return Response(asset.bodies[encoding], media_type=asset.content_type, headers=headers)
+
+
+assets = StaticAssets()
@@ -0,0 +1,30 @@
+import os
+import sys
+import tempfile
+import pytest
+
+# Los módulos se importan planos, como cuando se arranca desde la carpeta de la variante
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# chat.db, archivos de claves, etc. se crean en una carpeta temporal y no en la del repo
+os.chdir(tempfile.mkdtemp(prefix="chat-tests-"))
+
+
+@pytest.fixture
+def db():
+    from database import init_db, SessionLocal
+    init_db()
+    with SessionLocal() as session:
+        yield session
+
+
+@pytest.fixture
+def client():
+    import server
+    from fastapi.testclient import TestClient
+    with TestClient(server.app) as client:
+        yield client
+
+
+def login(client, username: str) -> str:
+    client.post("/auth/register", json={"username": username, "password": "p"})
+    return client.post("/auth/login", json={"username": username, "password": "p"}).json()["access_token"]
@@ -0,0 +1,55 @@
+import asyncio
+from broker import RespBroker
+from pubsub_hub import handle_client
+
+
+def test_bad_payload_does_not_kill_the_subscription(tmp_path):
+    path = str(tmp_path / "hub.sock")
+    received = []
+
+    def handler(payload: bytes):
+        if payload == b"malo":
+            raise ValueError("payload inválido")
+        received.append(payload)
+
+    async def scenario():
+        hub = await asyncio.start_unix_server(handle_client, path)
+        broker = RespBroker(f"unix://{path}")
+        await broker.start(handler)
+        while broker._pub_writer is None:
+            await asyncio.sleep(0.01)
+        for payload in (b"uno", b"malo", b"dos"):
+            broker.publish(payload)
+        for _ in range(100):
+            if len(received) == 2:
+                break
+            await asyncio.sleep(0.01)
+        await broker.stop()
+        hub.close()
+        return broker
+
+    broker = asyncio.run(scenario())
+    assert received == [b"uno", b"dos"]
+    assert broker.handler_errors == 1 and broker.local_fallbacks == 0
+
+
+def test_publish_stops_buffering_when_the_broker_is_stuck():
+    received = []
+    broker = RespBroker("unix:///nada", max_buffer=10)
+
+    class StuckTransport:
+        def get_write_buffer_size(self):
+            return 10
+
+    class StuckWriter:
+        transport = StuckTransport()
+
+        def write(self, data):
+            raise AssertionError("no debería escribir más")
+
+    broker.handler = received.append
+    broker._pub_writer = StuckWriter()
+    broker.publish(b"uno")
+    # Los sockets de este proceso lo reciben igual
+    assert received == [b"uno"]
+    assert broker.buffer_overflows == 1 and broker.published == 0
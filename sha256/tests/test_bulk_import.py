@@ -0,0 +1,31 @@
+import asyncio
+import json
+from sqlalchemy import select
+import bulk
+from database import Message, User
+from rooms import dm_room
+
+
+def test_import_rebuilds_dm_rooms_with_target_ids(db, tmp_path):
+    # En esta DB los ids no coinciden con los del origen (allí alice=2, bob=3)
+    db.add_all([User(username=name, password="x") for name in ("carol", "dave", "bob", "alice")])
+    db.commit()
+    ids = dict(db.execute(select(User.username, User.id)).all())
+
+    path = tmp_path / "historial.jsonl"
+    records = [
+        {"id": 1, "timestamp": "2024-01-01T10:00:00", "room": "dm:2:3", "user": "alice", "to": "bob", "text": "hola"},
+        {"id": 2, "timestamp": "2024-01-01T10:01:00", "room": "dm:2:3", "user": "alice", "to": None, "text": "perdido"},
+        {"id": 3, "timestamp": "2024-01-01T10:02:00", "room": "general", "user": "bob", "to": None, "text": "buenas"},
+    ]
+    path.write_text("".join(json.dumps(record) + "\n" for record in records), encoding="utf-8")
+
+    result = asyncio.run(bulk.import_history(str(path)))
+
+    assert result == {"imported": 2, "failed": 0, "skipped": 1}
+    rows = db.execute(select(Message.room, Message.user_id, Message.recipient_id).order_by(Message.id)).all()
+    assert rows[-2:] == [
+        (dm_room(ids["alice"], ids["bob"]), ids["alice"], ids["bob"]),
+        ("general", ids["bob"], None),
+    ]
+    assert dm_room(ids["alice"], ids["bob"]) != "dm:2:3"
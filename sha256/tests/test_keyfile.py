@@ -0,0 +1,30 @@
+import os
+import stat
+import keyfile
+from tokens import TokenService
+
+
+def test_first_creator_wins(tmp_path):
+    path = str(tmp_path / "clave.bin")
+    assert keyfile.create(path, b"primero", "Archivo de prueba")
+    assert not keyfile.create(path, b"segundo", "Archivo de prueba")
+    with open(path, "rb") as f:
+        assert f.read() == b"primero"
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+    # Los temporales no se quedan en la carpeta
+    assert os.listdir(tmp_path) == ["clave.bin"]
+
+
+def test_changes_reach_other_processes_only_when_checked(tmp_path, monkeypatch):
+    path = str(tmp_path / "token_keys.json")
+    first, second = TokenService(path), TokenService(path)
+    assert first.keys == second.keys
+    kid = first.rotate()
+    second._maybe_reload()
+    assert second.current != kid  # aún no toca mirar el archivo
+    second._maybe_reload(force=True)
+    assert second.current == kid
+    monkeypatch.setattr(keyfile, "RELOAD_INTERVAL", 0.0)
+    first.retire("1")
+    second._maybe_reload()
+    assert set(second.keys) == {kid}
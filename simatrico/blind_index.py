@@ -0,0 +1,42 @@
+import hashlib
+import hmac
+import os
+import re
+import secrets
+import unicodedata
+import keyfile
+
+# Índice ciego para buscar sin descifrar: cada palabra se guarda como
+# HMAC-SHA256(clave, palabra normalizada), truncado. Quien sólo ve la DB puede
+# saber qué mensajes comparten una palabra, pero no cuál es.
+# ⚠️ La clave es distinta de la de cifrado; si se pierde o se cambia hay que
+# reconstruir el índice (python search.py --rebuild).
+SEARCH_KEY_PATH = os.getenv("CHAT_SEARCH_KEY_PATH", "search_key.bin")
+TOKEN_BYTES = 12
+WORD = re.compile(r"\w+")
+
+
+def _load_key(path: str = SEARCH_KEY_PATH) -> bytes:
+    if not os.path.exists(path):
+        keyfile.create(path, secrets.token_bytes(32), "Archivo de la clave del índice de búsqueda")
+    with open(path, "rb") as f:
+        return f.read()
+
+
+_key = _load_key()
+
+
+def words(text: str) -> list:
+    """Palabras en minúsculas y sin tildes, como las separa el tokenizer de FTS5"""
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return WORD.findall(text.casefold())
+
+
+def blind_token(word: str) -> str:
+    return hmac.new(_key, word.encode(), hashlib.sha256).digest()[:TOKEN_BYTES].hex()
+
+
+def blind_tokens(text: str) -> str:
+    """Texto que se indexa en lugar del mensaje: un token por palabra (repetidas cuentan para el ranking)"""
+    return " ".join(blind_token(word) for word in words(text))
@@ -1,50 +1,211 @@
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect
-from jose import jwt, JWTError
-from database import SessionLocal, User, Message
+import contextvars
+import json
+import time
+from functools import partial
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, WebSocket, WebSocketDisconnect
+from database import Message, DEFAULT_ROOM
 from datetime import datetime
-from crypto_utils import encrypt_message, decrypt_message  # 👈 Nuevo import
+from broadcaster import Broadcaster
+from persistence import message_writer, WriteError
+from user_cache import build_context, user_cache
+from auth import get_current_username
+from tokens import token_service, TokenError
+from message_codec import encode_message
+from history import frames_since
+from rooms import valid_room, dm_room, frame_text, load_rooms, join_room, leave_room
+from frames import PROTOCOLS
+from flow_control import flow_control
+from tracing import tracer
+import metrics
 
 router = APIRouter()
-SECRET_KEY = "clave_super_secreta"
-ALGORITHM = "HS256"
 
-connections = {}
+# Código de cierre WebSocket 1003: "Unsupported Data" (protocolo pedido desconocido)
+UNSUPPORTED_DATA_CLOSE_CODE = 1003
+
+broadcaster = Broadcaster()
+metrics.connections.set_function(lambda: broadcaster.sessions)
+metrics.online_users.set_function(lambda: len(broadcaster.connections))
+# Al revocar un token (o los de un usuario) se cierran también los sockets abiertos con él
+token_service.revoke_hooks.append(broadcaster.revoke)
+
+# Series resueltas una vez: en el camino de cada mensaje sólo queda observe()
+ENCODE_SECONDS = metrics.codec_seconds.labels("encode")
+PERSIST_SECONDS = metrics.stage_seconds.labels("persist")
+PUBLISH_SECONDS = metrics.stage_seconds.labels("publish")
+TOTAL_SECONDS = metrics.stage_seconds.labels("total")
+
+
+async def send_message(ctx, text: str, room: str = DEFAULT_ROOM, recipient=None):
+    """Persiste y publica un mensaje; recipient es (id, nombre) en los mensajes directos.
+    Devuelve el error a enviar al remitente, o None.
+    """
+    received = time.perf_counter()
+    metrics.messages_received.inc()
+    # 🔒 Guardar mensaje en DB (cada variante decide si cifra el texto)
+    with tracer.span("encode"):
+        msg = Message(**encode_message(text), user_id=ctx.user_id, room=room,
+                      recipient_id=recipient[0] if recipient else None, timestamp=datetime.utcnow())
+    encoded = time.perf_counter()
+    ENCODE_SECONDS.observe(encoded - received)
+    # Se publica cuando su lote se confirma: la secuencia es el id del mensaje en la DB.
+    # El contexto copiado mantiene la etapa "publish" dentro de la traza del mensaje.
+    recipient_name = recipient[1] if recipient else None
+    publish = partial(contextvars.copy_context().run, publish_message,
+                      frame_text(room, ctx.username, text, recipient_name), room,
+                      [ctx.username, recipient_name] if recipient else None, received)
+    with tracer.span("persist", durability=message_writer.durability):
+        try:
+            await message_writer.submit(msg, on_commit=publish)
+        except WriteError:
+            # Sólo se entera este remitente: su socket y el de los demás del lote siguen abiertos
+            return "No se pudo guardar el mensaje, inténtalo de nuevo"
+    PERSIST_SECONDS.observe(time.perf_counter() - encoded)
+    return None
+
+
+def publish_message(text: str, room: str, to, received: float, msg):
+    """Envía el mensaje ya guardado sólo a quien está en la sala (o a los dos del directo)"""
+    start = time.perf_counter()
+    with tracer.span("publish"):
+        broadcaster.publish(msg.id, text, room, to=to)
+    published = time.perf_counter()
+    PUBLISH_SECONDS.observe(published - start)
+    TOTAL_SECONDS.observe(published - received)
+
+
+async def handle_op(conn, ctx, op: dict):
+    """Operaciones JSON del socket:
+      {"op": "join"|"leave", "room": "sala"}
+      {"op": "send", "room": "sala", "text": "..."}
+      {"op": "dm", "to": "usuario", "text": "..."}
+      {"op": "pong"}  (respuesta a {"ping": n}; basta con haberla recibido)
+    Devuelve el error a enviar al cliente, o None.
+    """
+    kind, room, text = op.get("op"), op.get("room"), op.get("text")
+    if kind == "pong":
+        return None
+    if kind in ("join", "leave"):
+        if not valid_room(room) or room == DEFAULT_ROOM:
+            return "Sala inválida"
+        with tracer.span("rooms.update"):
+            if kind == "join":
+                await join_room(ctx.user_id, room)
+                broadcaster.join(conn, room)
+            else:
+                await leave_room(ctx.user_id, room)
+                broadcaster.leave(conn, room)
+        conn.send_event({"ok": kind, "room": room})
+        return None
+    if not isinstance(text, str):
+        return "Falta el texto"
+    if kind == "send":
+        if room not in conn.rooms:
+            return "Únete a la sala antes de escribir en ella"
+        return await send_message(ctx, text, room)
+    if kind == "dm":
+        with tracer.span("user.lookup"):
+            recipient_id = await user_cache.resolve(op.get("to")) if isinstance(op.get("to"), str) else None
+        if recipient_id is None:
+            return "Usuario no encontrado"
+        return await send_message(ctx, text, dm_room(ctx.user_id, recipient_id), (recipient_id, op["to"]))
+    return "Operación desconocida"
+
+
+async def handle_frame(conn, ctx, data: str):
+    # Sólo se intenta leer JSON si lo parece: el texto plano va directo a la sala por defecto
+    if data.startswith("{"):
+        try:
+            op = json.loads(data)
+        except ValueError:
+            op = None
+        if isinstance(op, dict) and "op" in op:
+            error = await handle_op(conn, ctx, op)
+            if error:
+                conn.send_event({"error": error})
+            return
+    error = await send_message(ctx, data)
+    if error:
+        conn.send_event({"error": error})
+
 
 @router.websocket("/ws/{token}")
-async def chat(websocket: WebSocket, token: str):
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username = payload.get("sub")
-        if not username:
+async def chat(websocket: WebSocket, token: str, since: Optional[int] = None, proto: Optional[str] = None):
+    # Sin ?proto=, texto plano; los que reanudan con ?since= reciben JSON con la secuencia
+    proto = proto or ("json" if since is not None else "text")
+    if proto not in PROTOCOLS:
+        await websocket.close(code=UNSUPPORTED_DATA_CLOSE_CODE)
+        return
+    with tracer.trace("ws.connect", proto=proto):
+        # 🎫 Una ola de reconexiones con el mismo token sale de la caché (ver tokens.py)
+        try:
+            with tracer.span("token.verify"):
+                claims = token_service.verify(token)
+        except TokenError:
             await websocket.close()
             return
-    except JWTError:
-        await websocket.close()
-        return
 
-    await websocket.accept()
-    connections[username] = websocket
+        # El remitente se resuelve una vez por conexión, no por mensaje
+        username = claims.username
+        with tracer.span("user.lookup"):
+            ctx = await build_context(username)
+        if ctx is None:
+            await websocket.close()
+            return
+
+        await websocket.accept()
+        with tracer.span("rooms.load"):
+            rooms = await load_rooms(ctx.user_id)
+        # 🔁 Al reconectar con ?since=<seq> se reenvía lo perdido: de memoria o, si no alcanza, de la DB
+        with tracer.span("resume"):
+            replay, truncated = (await broadcaster.resume(since, frames_since, rooms, ctx.user_id)
+                                 if since is not None else (None, False))
+        conn = broadcaster.connect(username, websocket, proto=proto, replay=replay, truncated=truncated,
+                                   user_id=ctx.user_id, rooms=rooms, jti=claims.jti)
+        flow_control.open(ctx.user_id)
 
-    db = SessionLocal()
     print(f"{username} conectado.")
 
     try:
         while True:
             data = await websocket.receive_text()
+            conn.last_seen = time.monotonic()
+            with tracer.trace("ws.message", bytes=len(data)):
+                # 🚦 Límite por usuario, tamaño máximo y presupuesto global (ver flow_control.py)
+                with tracer.span("flow.admit"):
+                    rejection = await flow_control.admit(ctx.user_id, data)
+                if rejection is not None:
+                    if rejection.close_code is not None:
+                        print(f"{username} desconectado por control de flujo ({rejection.reason}).")
+                        await websocket.close(code=rejection.close_code)
+                        break
+                    event = {"error": rejection.error}
+                    if rejection.retry_after:
+                        event["retry_after"] = rejection.retry_after
+                    conn.send_event(event)
+                    continue
+                try:
+                    await handle_frame(conn, ctx, data)
+                finally:
+                    flow_control.release()
+    except WebSocketDisconnect:
+        print(f"{username} desconectado.")
+    finally:
+        flow_control.close(ctx.user_id)
+        broadcaster.disconnect(conn)
 
-            # 🔒 Cifrar el mensaje antes de guardar
-            encrypted_text = encrypt_message(data)
 
-            user = db.query(User).filter(User.username == username).first()
-            msg = Message(content=encrypted_text, user_id=user.id, timestamp=datetime.utcnow())
-            db.add(msg)
-            db.commit()
+@router.get("/presence")
+async def presence(room: Optional[str] = None, users: Optional[str] = None,
+                   username: str = Depends(get_current_username)):
+    """Quién está conectado, desde el índice en memoria (sin tocar la DB)
 
-            # 💬 Enviar mensaje descifrado a todos los conectados
-            for user_ws in connections.values():
-                await user_ws.send_text(f"{username}: {data}")
-    except WebSocketDisconnect:
-        del connections[username]
-        print(f"{username} desconectado.")
-        db.close()
-# 
\ No newline at end of file
+    ?room=<sala> limita a una sala; ?users=a,b devuelve sólo si esos usuarios están conectados.
+    """
+    if room is not None and not valid_room(room):
+        raise HTTPException(status_code=400, detail="Sala inválida")
+    if users is not None:
+        return {"online": {name: name in broadcaster.connections for name in users.split(",") if name}}
+    online = broadcaster.presence(room)
+    return {"count": len(online), "online": online}
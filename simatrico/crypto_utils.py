@@ -1,12 +1,74 @@
-from cryptography.fernet import Fernet
+import os
+import threading
+from cryptography.fernet import Fernet, MultiFernet
+from keyfile import KeyFile
 
-# Clave secreta para cifrar y descifrar mensajes
-# ⚠️ Guárdala en una variable de entorno en producción
-SECRET_FERNET_KEY = Fernet.generate_key()
-fernet = Fernet(SECRET_FERNET_KEY)
+# Claves Fernet persistidas en disco para que todos los workers y reinicios
+# usen las mismas. ⚠️ En producción guarda el archivo fuera del repositorio.
+#   {"primary": 2, "keys": {"1": "<clave>", "2": "<clave>"}}
+KEYRING_PATH = os.getenv("FERNET_KEYRING_PATH", "fernet_keys.json")
 
-def encrypt_message(message: str) -> str:
-    return fernet.encrypt(message.encode()).decode()
 
-def decrypt_message(token: str) -> str:
-    return fernet.decrypt(token.encode()).decode()
+class FernetKeyring(KeyFile):
+    """Clave primaria para cifrar y secundarias para descifrar, cada una con su id"""
+
+    label = "Archivo de claves Fernet"
+
+    def __init__(self, path: str = KEYRING_PATH):
+        super().__init__(path)
+        self._lock = threading.Lock()
+        self.primary_id = None
+        self.fernets = {}
+        self.multi = None
+        self.reload()
+
+    # === Archivo de claves ===
+    def initial(self) -> dict:
+        return {"primary": 1, "keys": {"1": Fernet.generate_key().decode()}}
+
+    def load(self, data: dict):
+        fernets = {int(key_id): Fernet(key) for key_id, key in data["keys"].items()}
+        primary_id = int(data["primary"])
+        with self._lock:
+            self.fernets = fernets
+            self.primary_id = primary_id
+            # MultiFernet prueba primero la primaria y luego el resto
+            others = [f for key_id, f in sorted(fernets.items(), reverse=True) if key_id != primary_id]
+            self.multi = MultiFernet([fernets[primary_id]] + others)
+
+    # === Rotación ===
+    def add_primary_key(self) -> int:
+        """Genera una clave nueva y la vuelve primaria; las anteriores quedan para descifrar"""
+        data = self._read()
+        key_id = max(int(k) for k in data["keys"]) + 1
+        data["keys"][str(key_id)] = Fernet.generate_key().decode()
+        data["primary"] = key_id
+        self._save(data)
+        return key_id
+
+    def retire_key(self, key_id: int):
+        data = self._read()
+        if int(data["primary"]) == key_id:
+            raise ValueError("No se puede retirar la clave primaria")
+        data["keys"].pop(str(key_id), None)
+        self._save(data)
+
+    # === Cifrado ===
+    def encrypt(self, message: str):
+        """Devuelve (key_id, token) cifrado con la clave primaria"""
+        self._maybe_reload()
+        with self._lock:
+            key_id = self.primary_id
+            fernet = self.fernets[key_id]
+        return key_id, fernet.encrypt(message.encode()).decode()
+
+    def decrypt(self, token: str, key_id=None) -> str:
+        """Descifra con la clave indicada; sin key_id (filas antiguas) prueba todas"""
+        if key_id is not None and key_id not in self.fernets:
+            self._maybe_reload(force=True)  # otro proceso pudo rotar (sólo se relee si cambió)
+        if key_id is None or key_id not in self.fernets:
+            return self.multi.decrypt(token.encode()).decode()
+        return self.fernets[key_id].decrypt(token.encode()).decode()
+
+
+keyring = FernetKeyring()
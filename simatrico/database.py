@@ -1,13 +1,43 @@
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, ForeignKey, Text
+import os
+from sqlalchemy import create_engine, event, inspect, text, Index, Column, Integer, String, Float, DateTime, Date, ForeignKey, Text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.schema import CreateIndex
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 from datetime import datetime
 
 DATABASE_URL = "sqlite:///./simetrico.db"
+ASYNC_DATABASE_URL = "sqlite+aiosqlite:///./simetrico.db"
 
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+# Pragmas aplicados a cada conexión nueva: WAL deja leer mientras se escribe
+# y synchronous=NORMAL evita un fsync por commit (seguro con WAL)
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": int(os.getenv("CHAT_DB_BUSY_TIMEOUT_MS", "5000")),
+    "mmap_size": int(os.getenv("CHAT_DB_MMAP_SIZE", str(256 * 1024 * 1024))),
+    "cache_size": int(os.getenv("CHAT_DB_CACHE_SIZE", "-65536")),  # negativo = KiB
+}
+POOL_SIZE = int(os.getenv("CHAT_DB_POOL_SIZE", "5"))
+MAX_OVERFLOW = int(os.getenv("CHAT_DB_MAX_OVERFLOW", "10"))
+
+def _apply_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
+
+engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False},
+                       pool_size=POOL_SIZE, max_overflow=MAX_OVERFLOW)
+event.listen(engine, "connect", _apply_pragmas)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Motor asíncrono (aiosqlite) para las rutas async y el WebSocket
+async_engine = create_async_engine(ASYNC_DATABASE_URL, pool_size=POOL_SIZE, max_overflow=MAX_OVERFLOW)
+event.listen(async_engine.sync_engine, "connect", _apply_pragmas)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
 
 class User(Base):
@@ -15,15 +45,139 @@ class User(Base):
     id = Column(Integer, primary_key=True, index=True)
     username = Column(String, unique=True, index=True)
     password = Column(String)
-    messages = relationship("Message", back_populates="owner")
+    messages = relationship("Message", back_populates="owner", foreign_keys="Message.user_id")
+
+# Sala a la que van los mensajes de texto plano y en la que están todos
+DEFAULT_ROOM = "general"
 
 class Message(Base):
     __tablename__ = "messages"
     id = Column(Integer, primary_key=True, index=True)
-    content = Column(Text)
+    content = Column(Text)  # token Fernet
+    key_id = Column(Integer)  # id de la clave del keyring (NULL en filas antiguas)
+    # Tokens ciegos (HMAC) de cada palabra, para buscar sin descifrar (ver blind_index.py)
+    search_tokens = Column(Text)
     timestamp = Column(DateTime, default=datetime.utcnow)
     user_id = Column(Integer, ForeignKey("users.id"))
-    owner = relationship("User", back_populates="messages")
+    # Sala del mensaje; los directos van a la sala "dm:<id menor>:<id mayor>"
+    room = Column(String(80), nullable=False, default=DEFAULT_ROOM, server_default=DEFAULT_ROOM)
+    recipient_id = Column(Integer, ForeignKey("users.id"))  # sólo en mensajes directos
+    owner = relationship("User", back_populates="messages", foreign_keys=[user_id])
+
+    # Índices para paginar el historial por (timestamp, id) sin OFFSET;
+    # id es el rowid, así que SQLite ya lo incluye en cada índice
+    __table_args__ = (
+        Index("ix_messages_timestamp_id", "timestamp", "id"),
+        Index("ix_messages_user_id_timestamp", "user_id", "timestamp"),
+        Index("ix_messages_room_timestamp_id", "room", "timestamp", "id"),
+    )
+
+class RoomMember(Base):
+    """Salas a las que se unió cada usuario (la sala por defecto no se guarda)"""
+    __tablename__ = "room_members"
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    room = Column(String(80), primary_key=True)
+
+class RevokedToken(Base):
+    """Revocación de tokens que leen todos los workers (ver tokens.py): un token (jti)
+    o, si jti es NULL, todos los de username emitidos antes de issued_before"""
+    __tablename__ = "revoked_tokens"
+    id = Column(Integer, primary_key=True)
+    username = Column(String, nullable=False)
+    jti = Column(String)
+    issued_before = Column(Float)
+    exp = Column(Float, index=True)  # desde entonces ya no queda ningún token al que afecte
+
+class ArchiveSegment(Base):
+    """Un día de mensajes sacado de la tabla caliente a un archivo comprimido (ver archive.py)"""
+    __tablename__ = "archive_segments"
+    id = Column(Integer, primary_key=True)
+    day = Column(Date, index=True)
+    path = Column(String, unique=True)
+    rows = Column(Integer)
+    first_id = Column(Integer)
+    last_id = Column(Integer)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class ArchiveBlock(Base):
+    """Bloque comprimido de un segmento: mensajes seguidos de una sola sala"""
+    __tablename__ = "archive_blocks"
+    id = Column(Integer, primary_key=True)
+    segment_id = Column(Integer, ForeignKey("archive_segments.id"), index=True)
+    room = Column(String(80))
+    offset = Column(Integer)
+    length = Column(Integer)
+    rows = Column(Integer)
+    first_timestamp = Column(DateTime)
+    first_id = Column(Integer)
+    last_timestamp = Column(DateTime)
+    last_id = Column(Integer)
+
+    # El historial de una sala baja por sus bloques del más nuevo al más viejo
+    __table_args__ = (Index("ix_archive_blocks_room_last", "room", "last_timestamp", "last_id"),)
+
+def add_missing_columns(conn, table):
+    """create_all no altera tablas existentes: añade las columnas nuevas que falten"""
+    existing = {column["name"] for column in inspect(conn).get_columns(table.name)}
+    for column in table.columns:
+        if column.name in existing:
+            continue
+        column_type = column.type.compile(dialect=conn.dialect)
+        # Con DEFAULT, SQLite rellena las filas existentes sin reescribir la tabla
+        default = f" DEFAULT '{column.server_default.arg}'" if column.server_default is not None else ""
+        try:
+            conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}{default}"))
+        except OperationalError as exc:
+            # Otro worker pudo añadirla al mismo tiempo
+            if "duplicate column" not in str(exc):
+                raise
+
+# Índice de búsqueda FTS5 (ver search.py): body es sus tokens ciegos, no el texto y room
+# filtra lo que cada usuario puede ver. Lo llena un trigger al insertar; el archivado
+# no lo borra, así que también encuentra mensajes de días archivados.
+SEARCH_COLUMN = "search_tokens"
+
+def create_search_index(conn):
+    exists = conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'messages_fts'")).first()
+    conn.execute(text("CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5("
+                      "body, room UNINDEXED, tokenize = 'unicode61 remove_diacritics 2')"))
+    conn.execute(text(
+        "CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages "
+        f"WHEN NEW.{SEARCH_COLUMN} IS NOT NULL BEGIN "
+        f"INSERT INTO messages_fts(rowid, body, room) VALUES (NEW.id, NEW.{SEARCH_COLUMN}, NEW.room); END"
+    ))
+    if not exists:
+        # Índice nuevo sobre una tabla con datos: se indexa lo que ya había
+        conn.execute(text(f"INSERT INTO messages_fts(rowid, body, room) "
+                          f"SELECT id, {SEARCH_COLUMN}, room FROM messages WHERE {SEARCH_COLUMN} IS NOT NULL"))
+
+# Veces que se repite create_all si otro worker crea las mismas tablas a la vez
+CREATE_ATTEMPTS = 5
+
+def create_tables():
+    """create_all mira qué tablas faltan y después las crea: entre medias otro
+    worker que arranca a la vez puede crearlas ("table ... already exists")"""
+    for attempt in range(CREATE_ATTEMPTS):
+        try:
+            Base.metadata.create_all(bind=engine)
+            return
+        except OperationalError as exc:
+            # Al repetir, create_all ve las que creó el otro y sólo crea las que falten
+            if "already exists" not in str(exc) or attempt == CREATE_ATTEMPTS - 1:
+                raise
 
 def init_db():
-    Base.metadata.create_all(bind=engine)
+    create_tables()
+    with engine.begin() as conn:
+        add_missing_columns(conn, Message.__table__)
+    # create_all no añade índices a tablas que ya existían; IF NOT EXISTS
+    # evita la carrera cuando varios workers arrancan a la vez
+    with engine.begin() as conn:
+        for index in Message.__table__.indexes:
+            conn.execute(CreateIndex(index, if_not_exists=True))
+    with engine.begin() as conn:
+        create_search_index(conn)
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -0,0 +1,32 @@
+from cryptography.fernet import InvalidToken
+from crypto_utils import keyring
+from blind_index import blind_tokens, blind_token, words
+
+# Cómo se guarda el texto de un mensaje en esta variante: cifrado con Fernet,
+# anotando qué clave del keyring se usó
+
+def encode_message(text: str) -> dict:
+    """Devuelve las columnas de Message que guardan el texto"""
+    key_id, token = keyring.encrypt(text)
+    return {"content": token, "key_id": key_id, "search_tokens": blind_tokens(text)}
+
+def prepare_encoding():
+    """Deja listo encode_message fuera del servidor (p. ej. en bulk.py): el keyring ya se carga al importar"""
+
+def decode_messages(messages) -> list:
+    """Devuelve el texto de cada mensaje, en el mismo orden (None si no se puede descifrar)"""
+    texts = []
+    for m in messages:
+        try:
+            texts.append(keyring.decrypt(m.content, m.key_id))
+        except InvalidToken:
+            texts.append(None)
+    return texts
+
+def index_text(text: str) -> str:
+    """Lo que se indexa para buscar (ver search.py): tokens ciegos, nunca el texto"""
+    return blind_tokens(text)
+
+def query_terms(query: str) -> list:
+    """Términos de búsqueda convertidos a tokens ciegos, como se indexaron"""
+    return [blind_token(word) for word in words(query)]
@@ -0,0 +1,191 @@
+import bisect
+import math
+
+# Métricas en memoria, expuestas en /metrics con el formato de texto de Prometheus.
+# Todo se actualiza desde el event loop (un solo hilo), así que no hay locks:
+# observar un valor es una búsqueda binaria y dos sumas.
+
+# Segundos: de 100 µs a 10 s
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Cantidades (destinatarios por mensaje, filas por lote...)
+SIZE_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+_registry = []
+
+
+def _format_labels(names, values) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{value}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _format_value(value) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _CounterValue:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self, name, labels):
+        return [f"{name}{labels} {_format_value(self.value)}"]
+
+
+class _GaugeValue:
+    __slots__ = ("value", "function")
+
+    def __init__(self):
+        self.value = 0
+        self.function = None
+
+    def set(self, value):
+        self.value = value
+
+    def set_function(self, function):
+        """El valor se calcula al leer /metrics, sin coste por evento"""
+        self.function = function
+
+    def samples(self, name, labels):
+        value = self.function() if self.function is not None else self.value
+        return [f"{name}{labels} {_format_value(value)}"]
+
+
+class _HistogramValue:
+    __slots__ = ("buckets", "counts", "sum")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def samples(self, name, labels):
+        inner = labels[1:-1] + "," if labels else ""
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf,), self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{inner}le="{_format_value(bound)}"}} {cumulative}')
+        lines.append(f"{name}_sum{labels} {_format_value(self.sum)}")
+        lines.append(f"{name}_count{labels} {cumulative}")
+        return lines
+
+
+class _Metric:
+    """Métrica con nombre; sin etiquetas delega en un único valor, con etiquetas usa labels()"""
+
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._children = {}
+        if not self.label_names:
+            self._children[()] = self._new_value()
+        _registry.append(self)
+
+    def labels(self, *values):
+        """Serie para esos valores de etiqueta; se crea una vez y se reutiliza"""
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._new_value()
+        return child
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in list(self._children.items()):
+            lines.extend(child.samples(self.name, _format_labels(self.label_names, values)))
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_value(self):
+        return _CounterValue()
+
+    def inc(self, amount=1):
+        self._children[()].inc(amount)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _new_value(self):
+        return _GaugeValue()
+
+    def set(self, value):
+        self._children[()].set(value)
+
+    def set_function(self, function):
+        self._children[()].set_function(function)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels=(), buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(name, help, labels)
+
+    def _new_value(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self._children[()].observe(value)
+
+
+def render() -> str:
+    """Todas las métricas registradas en formato de texto de Prometheus"""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# === Métricas del chat ===
+connections = Gauge("chat_connections", "Sockets abiertos en este proceso")
+online_users = Gauge("chat_online_users", "Usuarios con al menos un socket abierto en este proceso")
+reaped_connections = Counter("chat_reaped_connections_total", "Sockets cerrados por no contestar a los heartbeats")
+messages_received = Counter("chat_messages_received_total", "Mensajes recibidos por WebSocket")
+stage_seconds = Histogram("chat_stage_seconds",
+                          "Latencia de cada etapa de un mensaje recibido (persist, publish, total)",
+                          labels=("stage",))
+codec_seconds = Histogram("chat_codec_seconds",
+                          "Tiempo de cifrado/hash: encode por mensaje; decode, chain y sign por lote",
+                          labels=("op",))
+db_commit_seconds = Histogram("chat_db_commit_seconds", "Duración de cada transacción del escritor")
+db_batch_rows = Histogram("chat_db_batch_rows", "Mensajes por transacción", buckets=SIZE_BUCKETS)
+db_pending = Gauge("chat_db_pending", "Mensajes en cola esperando a la DB")
+bcrypt_seconds = Histogram("chat_bcrypt_seconds", "Tiempo de bcrypt sin contar la espera en cola",
+                           labels=("op",))
+bcrypt_in_flight = Gauge("chat_bcrypt_in_flight", "Operaciones bcrypt en curso o en cola")
+bcrypt_rejected = Counter("chat_bcrypt_rejected_total", "Peticiones rechazadas con 503 por saturación")
+fanout_size = Histogram("chat_fanout_size", "Sockets locales a los que se entrega cada mensaje",
+                        buckets=SIZE_BUCKETS)
+coalesced_messages = Histogram("chat_coalesced_messages", "Mensajes por frame enviado a clientes json/msgpack",
+                                buckets=SIZE_BUCKETS)
+in_flight = Gauge("chat_in_flight", "Mensajes entrantes procesándose ahora (presupuesto global)")
+flow_limited = Counter("chat_flow_limited_total",
+                       "Frames frenados por el control de flujo: reason rate|size|busy, action throttle|reject|disconnect",
+                       labels=("reason", "action"))
+search_seconds = Histogram("chat_search_seconds", "Duración de cada búsqueda: índice, lectura y descifrado")
+send_failures = Counter("chat_send_failures_total",
+                        "Envíos fallidos: queue_full (cliente lento) o error (socket roto)",
+                        labels=("reason",))
+token_verifications = Counter("chat_token_verifications_total",
+                              "Tokens comprobados: cached (sin HMAC), verified o rejected",
+                              labels=("result",))
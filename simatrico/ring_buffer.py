@@ -0,0 +1,83 @@
+import os
+
+# Frames recientes que se guardan en memoria para reenviar al reconectar
+REPLAY_BUFFER_SIZE = int(os.getenv("CHAT_REPLAY_BUFFER_SIZE", "4096"))
+
+# El número de secuencia de un mensaje es su id en la DB: se publica después del
+# commit, así que vale igual en todos los workers y en la DB, y sirve directamente
+# para buscar allí lo que no quepa en el buffer.
+
+class RecentFrames:
+    """Buffer circular de tamaño fijo con los últimos (seq, frame) ordenados por seq
+
+    Del broker llegan en el orden en que cada worker publica, que entre workers no
+    siempre es el de los ids: los que llegan tarde se colocan en su sitio.
+    """
+
+    def __init__(self, size: int = REPLAY_BUFFER_SIZE):
+        self.size = size
+        self._seqs = [0] * size
+        self._frames = [None] * size
+        self._start = 0  # posición del más antiguo
+        self.count = 0
+
+    def append(self, seq: int, frame):
+        if not self.count or seq > self.newest_seq:
+            position = self.count  # lo normal: llega en orden
+        else:
+            position = self._first_after(seq)
+            if position and self._seq_at(position - 1) == seq:
+                return  # ya estaba (p. ej. precargado de la DB y recibido a la vez)
+        if self.count == self.size:
+            if position == 0:
+                return  # más viejo que todo el buffer: ese tramo se sirve de la DB
+            # Se descarta el más antiguo para hacer sitio
+            self._start = (self._start + 1) % self.size
+            self.count -= 1
+            position -= 1
+        # Los posteriores se corren una posición (casi siempre ninguno)
+        for i in range(self.count, position, -1):
+            to, frm = (self._start + i) % self.size, (self._start + i - 1) % self.size
+            self._seqs[to] = self._seqs[frm]
+            self._frames[to] = self._frames[frm]
+        slot = (self._start + position) % self.size
+        self._seqs[slot] = seq
+        self._frames[slot] = frame
+        self.count += 1
+
+    def _seq_at(self, i: int) -> int:
+        return self._seqs[(self._start + i) % self.size]
+
+    def _slice(self, first: int) -> list:
+        return [(self._seq_at(i), self._frames[(self._start + i) % self.size])
+                for i in range(first, self.count)]
+
+    def _first_after(self, seq: int) -> int:
+        """Búsqueda binaria (el buffer está ordenado) del primer seq > pedido"""
+        low, high = 0, self.count
+        while low < high:
+            mid = (low + high) // 2
+            if self._seq_at(mid) <= seq:
+                low = mid + 1
+            else:
+                high = mid
+        return low
+
+    @property
+    def oldest_seq(self):
+        return self._seq_at(0) if self.count else None
+
+    @property
+    def newest_seq(self):
+        return self._seq_at(self.count - 1) if self.count else None
+
+    def all(self) -> list:
+        return self._slice(0)
+
+    def since(self, seq: int):
+        """Frames posteriores a seq, o None si seq es más viejo que el buffer (hay hueco)"""
+        if self.count == 0 or seq < self.oldest_seq:
+            return None
+        if seq >= self.newest_seq:
+            return []
+        return self._slice(self._first_after(seq))
@@ -0,0 +1,89 @@
+# Rotación de claves Fernet con el servidor en marcha:
+#   python rotate_keys.py rotate            -> clave primaria nueva + re-cifrado
+#   python rotate_keys.py reencrypt         -> re-cifra lo que no use la primaria
+#   python rotate_keys.py retire <key_id>   -> quita una clave que ya nadie usa
+# Los workers recogen la clave nueva solos al ver cambiar el archivo del keyring.
+import argparse
+import time
+from cryptography.fernet import InvalidToken
+from sqlalchemy import select, bindparam, or_
+from database import engine, init_db, Message
+from crypto_utils import keyring
+from archive import iter_archived
+
+messages = Message.__table__
+
+
+def reencrypt(batch_size: int, pause: float):
+    """Re-cifra con la clave primaria en lotes cortos, recorriendo por id
+
+    Cada lote se lee, se re-cifra fuera de la transacción y se escribe en una
+    transacción corta; entre lotes se duerme para no acaparar el escritor de
+    SQLite. La memoria usada es la de un lote, sea cual sea el tamaño de la tabla.
+    """
+    update = (messages.update()
+              .where(messages.c.id == bindparam("row_id"))
+              .values(content=bindparam("new_content"), key_id=bindparam("new_key_id")))
+    last_id = 0
+    updated = skipped = 0
+    while True:
+        primary_id = keyring.primary_id
+        with engine.connect() as conn:
+            rows = conn.execute(
+                select(messages.c.id, messages.c.content, messages.c.key_id)
+                .where(messages.c.id > last_id)
+                .where(or_(messages.c.key_id.is_(None), messages.c.key_id != primary_id))
+                .order_by(messages.c.id)
+                .limit(batch_size)
+            ).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        params = []
+        for row in rows:
+            try:
+                text = keyring.decrypt(row.content, row.key_id)
+            except InvalidToken:
+                skipped += 1  # cifrado con una clave que ya no existe
+                continue
+            key_id, token = keyring.encrypt(text)
+            params.append({"row_id": row.id, "new_content": token, "new_key_id": key_id})
+        if params:
+            with engine.begin() as conn:
+                conn.execute(update, params)
+            updated += len(params)
+        print(f"  re-cifrados {updated} (hasta id {last_id}), sin clave {skipped}")
+        time.sleep(pause)
+    print(f"✅ Re-cifrado terminado: {updated} mensajes, {skipped} imposibles de descifrar")
+
+
+def retire(key_id: int):
+    with engine.connect() as conn:
+        in_use = conn.execute(select(messages.c.id).where(messages.c.key_id == key_id).limit(1)).first()
+    if in_use:
+        raise SystemExit(f"La clave {key_id} todavía cifra mensajes: ejecuta 'reencrypt' antes")
+    # Los segmentos archivados no se reescriben: su clave tiene que quedarse
+    if any(msg.key_id == key_id for msg in iter_archived()):
+        raise SystemExit(f"La clave {key_id} cifra mensajes archivados: no se puede retirar")
+    keyring.retire_key(key_id)
+    print(f"🗑️ Clave {key_id} retirada")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rotación de claves Fernet de simatrico")
+    sub = parser.add_subparsers(dest="command", required=True)
+    for name in ("rotate", "reencrypt"):
+        cmd = sub.add_parser(name)
+        cmd.add_argument("--batch-size", type=int, default=500)
+        cmd.add_argument("--pause-ms", type=int, default=50, help="pausa entre lotes")
+    cmd = sub.add_parser("retire")
+    cmd.add_argument("key_id", type=int)
+    args = parser.parse_args()
+
+    init_db()
+    if args.command == "rotate":
+        print(f"🔑 Nueva clave primaria: {keyring.add_primary_key()}")
+    if args.command in ("rotate", "reencrypt"):
+        reencrypt(args.batch_size, args.pause_ms / 1000)
+    elif args.command == "retire":
+        retire(args.key_id)
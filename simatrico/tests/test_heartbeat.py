@@ -0,0 +1,60 @@
+import asyncio
+import broadcaster as broadcaster_module
+from broadcaster import Broadcaster, IDLE_CLOSE_CODE, SEND_ERROR_CLOSE_CODE
+from broker import InMemoryBroker
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+        self.close_code = None
+
+    async def send_text(self, data):
+        self.sent.append(data)
+
+    async def close(self, code):
+        self.close_code = code
+
+
+class BrokenWebSocket(FakeWebSocket):
+    async def send_text(self, data):
+        raise ConnectionResetError("peer gone")
+
+
+def test_failed_send_closes_the_socket():
+    async def scenario():
+        hub = Broadcaster(broker=InMemoryBroker())
+        broken, healthy = BrokenWebSocket(), FakeWebSocket()
+        conn = hub.connect("roto", broken)
+        hub.connect("sano", healthy)
+        conn.enqueue("hola")
+        await asyncio.sleep(0.05)
+        return hub, broken, healthy
+
+    hub, broken, healthy = asyncio.run(scenario())
+    # No basta con sacarlo del reparto: el socket se cierra y su bucle de lectura termina
+    assert broken.close_code == SEND_ERROR_CLOSE_CODE
+    assert list(hub.connections) == ["sano"] and healthy.close_code is None
+
+
+def test_heartbeat_skips_plain_text_clients(monkeypatch):
+    monkeypatch.setattr(broadcaster_module, "HEARTBEAT_S", 0.01)
+    monkeypatch.setattr(broadcaster_module, "IDLE_TIMEOUT_S", 0.05)
+
+    async def scenario():
+        hub = Broadcaster(broker=InMemoryBroker())
+        await hub.start()
+        text, json_ws = FakeWebSocket(), FakeWebSocket()
+        hub.connect("lector", text, proto="text")
+        hub.connect("app", json_ws, proto="json")
+        await asyncio.sleep(0.2)
+        await hub.stop()
+        return hub, text, json_ws
+
+    hub, text, json_ws = asyncio.run(scenario())
+    # El cliente JSON recibió pings y, al no contestar, se cerró
+    assert any('"ping"' in frame for frame in json_ws.sent)
+    assert json_ws.close_code == IDLE_CLOSE_CODE
+    # El de texto plano ni recibe {"ping"} ni se cierra por estar callado
+    assert text.sent == [] and text.close_code is None
+    assert list(hub.connections) == ["lector"]
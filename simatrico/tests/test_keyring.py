@@ -0,0 +1,101 @@
+import pytest
+from cryptography.fernet import InvalidToken
+from sqlalchemy import select, delete, func
+from database import Message
+import keyfile
+import rotate_keys
+from crypto_utils import FernetKeyring
+
+
+@pytest.fixture
+def keyring(db, tmp_path, monkeypatch):
+    """Keyring propio en un archivo aparte; rotate_keys trabaja con él"""
+    keyring = FernetKeyring(str(tmp_path / "fernet_keys.json"))
+    # Se empieza en la clave 2 para no confundirse con las filas de otros tests (clave 1)
+    keyring.add_primary_key()
+    monkeypatch.setattr(rotate_keys, "keyring", keyring)
+    first_id = db.execute(select(func.max(Message.id))).scalar() or 0
+    yield keyring
+    # Las filas de este keyring no las puede leer nadie más
+    db.execute(delete(Message).where(Message.id > first_id))
+    db.commit()
+
+
+def store(db, keyring, texts, legacy=False):
+    rows = []
+    for text in texts:
+        key_id, token = keyring.encrypt(text)
+        rows.append(Message(content=token, key_id=None if legacy else key_id))
+    db.add_all(rows)
+    db.commit()
+    return [row.id for row in rows]
+
+
+def stored(db, ids):
+    return db.execute(select(Message.id, Message.content, Message.key_id)
+                      .where(Message.id.in_(ids)).order_by(Message.id)).all()
+
+
+def test_rotate_keeps_old_rows_readable(db, keyring):
+    old_id = keyring.primary_id
+    ids = store(db, keyring, ["uno", "dos"])
+    legacy_ids = store(db, keyring, ["antiguo"], legacy=True)
+
+    new_id = keyring.add_primary_key()
+    assert new_id == old_id + 1 and keyring.primary_id == new_id
+    assert keyring.encrypt("x")[0] == new_id
+    assert [keyring.decrypt(row.content, row.key_id) for row in stored(db, ids)] == ["uno", "dos"]
+    # Sin key_id se prueba con todas (MultiFernet)
+    assert [keyring.decrypt(row.content, row.key_id) for row in stored(db, legacy_ids)] == ["antiguo"]
+
+
+def test_reencrypt_then_retire(db, keyring):
+    old_id = keyring.primary_id
+    ids = store(db, keyring, ["uno", "dos", "tres"]) + store(db, keyring, ["antiguo"], legacy=True)
+    new_id = keyring.add_primary_key()
+
+    rotate_keys.reencrypt(batch_size=2, pause=0)
+    rows = stored(db, ids)
+    assert {row.key_id for row in rows} == {new_id}
+    assert [keyring.fernets[new_id].decrypt(row.content.encode()).decode() for row in rows] == [
+        "uno", "dos", "tres", "antiguo"]
+
+    rotate_keys.retire(old_id)
+    assert old_id not in keyring.fernets
+    assert [keyring.decrypt(row.content, row.key_id) for row in stored(db, ids)] == ["uno", "dos", "tres", "antiguo"]
+    with pytest.raises(ValueError):
+        keyring.retire_key(new_id)
+
+
+def test_retire_refuses_key_still_in_use(db, keyring):
+    old_id = keyring.primary_id
+    store(db, keyring, ["sin re-cifrar"])
+    keyring.add_primary_key()
+    with pytest.raises(SystemExit):
+        rotate_keys.retire(old_id)
+    assert old_id in keyring.fernets
+
+
+def test_other_process_picks_up_rotation(keyring, monkeypatch):
+    worker = FernetKeyring(keyring.path)
+    old_id = worker.primary_id
+    old_token = worker.encrypt("antes")[1]
+
+    new_id = keyring.add_primary_key()
+    # Hasta que toca volver a mirar el archivo se sigue con la primaria anterior
+    assert worker.encrypt("x")[0] == old_id
+    monkeypatch.setattr(keyfile, "RELOAD_INTERVAL", 0.0)
+    key_id, token = worker.encrypt("después")
+    assert key_id == new_id
+    assert keyring.decrypt(token, key_id) == "después"
+    assert worker.decrypt(old_token, old_id) == "antes"
+
+
+def test_unknown_key_id_reloads_before_failing(keyring):
+    worker = FernetKeyring(keyring.path)
+    new_id = keyring.add_primary_key()
+    _, token = keyring.encrypt("nueva")
+    # Una fila con una clave que el worker aún no conoce fuerza la recarga
+    assert worker.decrypt(token, new_id) == "nueva"
+    with pytest.raises(InvalidToken):
+        worker.decrypt(FernetKeyring(keyring.path + ".otro").encrypt("ajena")[1], new_id)
@@ -0,0 +1,71 @@
+import asyncio
+import json
+import pytest
+from sqlalchemy import select
+from database import Message, User
+from persistence import MessageWriter, WriteError
+from conftest import login
+
+
+def test_failed_batch_is_retried_once(db):
+    db.add(User(username="writer", password="x"))
+    db.commit()
+    user_id = db.execute(select(User.id).where(User.username == "writer")).scalar_one()
+    failures = []
+
+    async def flaky(session, messages):
+        # El primer intento ya tiene ids (flush) y aun así falla
+        await session.flush()
+        if len(failures) < 1:
+            failures.append([msg.id for msg in messages])
+            raise RuntimeError("database is locked")
+
+    async def scenario():
+        writer = MessageWriter(max_delay=0)
+        writer.hooks.append(flaky)
+        await writer.start()
+        committed = []
+        await writer.submit(Message(content="uno", user_id=user_id), on_commit=lambda msg: committed.append(msg.id))
+        await writer.stop()
+        return writer, committed
+
+    writer, committed = asyncio.run(scenario())
+    assert writer.retries == 1 and writer.failed_rows == 0
+    stored = db.execute(select(Message.id).where(Message.content == "uno")).scalars().all()
+    assert stored == committed and len(stored) == 1
+
+
+def test_failed_batch_raises_write_error_without_publishing(db):
+    async def broken(session, messages):
+        raise RuntimeError("disk I/O error")
+
+    async def scenario():
+        writer = MessageWriter(max_delay=0)
+        writer.hooks.append(broken)
+        await writer.start()
+        published = []
+        with pytest.raises(WriteError):
+            await writer.submit(Message(content="x"), on_commit=published.append)
+        await writer.stop()
+        return writer, published
+
+    writer, published = asyncio.run(scenario())
+    assert published == [] and writer.failed_rows == 1
+
+
+def test_write_error_only_reaches_the_sender(client, monkeypatch):
+    from chat import message_writer
+
+    async def broken(session, messages):
+        raise RuntimeError("disk I/O error")
+
+    token = login(client, "unlucky")
+    hooks = message_writer.hooks
+    with client.websocket_connect(f"/ws/{token}?proto=json") as ws:
+        monkeypatch.setattr(message_writer, "hooks", hooks + [broken])
+        ws.send_text("perdido")
+        assert "error" in json.loads(ws.receive_text())
+        # El socket sigue abierto y el siguiente mensaje se guarda y llega
+        monkeypatch.setattr(message_writer, "hooks", hooks)
+        ws.send_text("guardado")
+        assert json.loads(ws.receive_text())["text"].endswith("guardado")
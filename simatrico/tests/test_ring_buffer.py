@@ -0,0 +1,19 @@
+from ring_buffer import RecentFrames
+
+
+def test_out_of_order_frames_are_kept_in_seq_order():
+    recent = RecentFrames(4)
+    # Dos workers: el 3 llega antes que el 2, y el 4 dos veces (precarga + broker)
+    for seq in (1, 3, 2, 4, 4):
+        recent.append(seq, f"m{seq}")
+    assert recent.all() == [(1, "m1"), (2, "m2"), (3, "m3"), (4, "m4")]
+    assert recent.since(1) == [(2, "m2"), (3, "m3"), (4, "m4")]
+
+    # Lleno: uno atrasado pero más nuevo que el más antiguo desplaza a éste...
+    recent.append(6, "m6")
+    recent.append(5, "m5")
+    assert recent.all() == [(3, "m3"), (4, "m4"), (5, "m5"), (6, "m6")]
+    # ...y uno más viejo que todo el buffer no entra: ese tramo se sirve de la DB
+    recent.append(2, "m2")
+    assert recent.oldest_seq == 3
+    assert recent.since(2) is None
@@ -0,0 +1,66 @@
+import json
+from sqlalchemy import text
+from blind_index import blind_token
+from conftest import login
+
+
+def send(client, token: str, frames: list):
+    """Envía cada frame por el socket y espera a que vuelva publicado (ya guardado)"""
+    with client.websocket_connect(f"/ws/{token}?proto=json") as ws:
+        for frame in frames:
+            ws.send_text(frame)
+            assert "seq" in json.loads(ws.receive_text())
+
+
+def search(client, token: str, **params):
+    response = client.get("/messages/search", params=params, headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def test_direct_messages_are_only_found_by_participants(client):
+    alice, bob, carol = (login(client, name) for name in ("alice_s", "bob_s", "carol_s"))
+    send(client, alice, [json.dumps({"op": "dm", "to": "bob_s", "text": "contraseña del armario ornitorrinco"})])
+    send(client, carol, ["el ornitorrinco de la sala general"])
+
+    for token in (alice, bob):
+        found = search(client, token, q="ornitorrinco")["messages"]
+        assert {(msg["room"].startswith("dm:"), msg["content"]) for msg in found} == {
+            (True, "contraseña del armario ornitorrinco"), (False, "el ornitorrinco de la sala general")}
+    found = search(client, carol, q="ornitorrinco")["messages"]
+    assert [msg["content"] for msg in found] == ["el ornitorrinco de la sala general"]
+    # Tampoco pidiendo la sala directa ajena
+    dm_room = next(msg["room"] for msg in search(client, alice, q="armario")["messages"])
+    response = client.get("/messages/search", params={"q": "armario", "room": dm_room},
+                          headers={"Authorization": f"Bearer {carol}"})
+    assert response.status_code == 403
+
+
+def test_pagination_has_no_duplicates(client):
+    token = login(client, "pager_s")
+    # Textos repetidos (mismo rank) y distintos: el cursor desempata por id
+    texts = ["quokka"] * 4 + ["quokka quokka"] * 3 + [f"quokka número {n}" for n in range(4)]
+    send(client, token, texts)
+
+    seen, cursor = [], None
+    while True:
+        page = search(client, token, q="quokka", limit=3, **({"cursor": cursor} if cursor else {}))
+        assert len(page["messages"]) <= 3
+        seen += [msg["id"] for msg in page["messages"]]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert len(seen) == len(set(seen)) == len(texts)
+
+
+def test_blind_index_finds_words_without_storing_them(client, db):
+    token = login(client, "blind_s")
+    send(client, token, ["El Murciélago ciego"])
+
+    found = search(client, token, q="MURCIELAGO")["messages"]
+    assert [msg["content"] for msg in found] == ["El Murciélago ciego"]
+    # Ni la tabla ni el índice tienen la palabra: sólo su token
+    body = db.execute(text("SELECT body FROM messages_fts WHERE rowid = :id"), {"id": found[0]["id"]}).scalar()
+    assert "murci" not in body.lower() and blind_token("murcielago") in body.split()
+    stored = db.execute(text("SELECT * FROM messages WHERE id = :id"), {"id": found[0]["id"]}).mappings().one()
+    assert not any(isinstance(value, str) and "urci" in value for value in stored.values())
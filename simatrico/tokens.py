@@ -0,0 +1,280 @@
+import argparse
+import asyncio
+import os
+import secrets
+import time
+from collections import OrderedDict, namedtuple
+from fastapi import APIRouter, Depends
+from pydantic import BaseModel
+from jose import jwt, JWTError
+from sqlalchemy import delete, select
+from sqlalchemy.exc import SQLAlchemyError
+from database import AsyncSessionLocal, RevokedToken
+from admin import require_admin
+from keyfile import KeyFile
+import metrics
+
+# Tokens de sesión (JWT HS256) firmados con claves que llevan id ("kid" en la cabecera).
+# Se firma con la actual y se acepta cualquiera del archivo, así que rotar no
+# desconecta a nadie; retirar una clave invalida los tokens firmados con ella.
+#   {"current": "2", "keys": {"1": "<hex>", "2": "<hex>"}}
+#   CHAT_TOKEN_KEYS_PATH  -> archivo de claves, compartido por todos los workers
+#   CHAT_TOKEN_TTL_S      -> validez de cada token
+#   CHAT_TOKEN_CACHE_SIZE -> tokens ya verificados que se recuerdan (por su firma) hasta su exp
+# ⚠️ En producción guarda el archivo fuera del repositorio.
+#   python tokens.py rotate        -> clave nueva para firmar (los workers la ven solos)
+#   python tokens.py retire <kid>  -> quita una clave vieja y con ella sus tokens
+# Las revocaciones (logout, /admin/tokens/revoke) se guardan en la tabla revoked_tokens y
+# cada worker lee las nuevas cada CHAT_TOKEN_SYNC_S; al verificar sólo se mira la memoria.
+KEYS_PATH = os.getenv("CHAT_TOKEN_KEYS_PATH", "token_keys.json")
+TOKEN_TTL_S = int(os.getenv("CHAT_TOKEN_TTL_S", "3600"))
+CACHE_SIZE = int(os.getenv("CHAT_TOKEN_CACHE_SIZE", "10000"))
+ALGORITHM = "HS256"
+# Cada cuánto se leen las revocaciones hechas en otros workers
+SYNC_INTERVAL = float(os.getenv("CHAT_TOKEN_SYNC_S", "1"))
+# Cada cuánto se limpian de las revocaciones los tokens que ya caducaron
+PURGE_INTERVAL = 60.0
+
+router = APIRouter(prefix="/admin", tags=["admin"])
+
+CACHED = metrics.token_verifications.labels("cached")
+VERIFIED = metrics.token_verifications.labels("verified")
+REJECTED = metrics.token_verifications.labels("rejected")
+
+
+class TokenError(Exception):
+    pass
+
+
+Claims = namedtuple("Claims", ("username", "exp", "iat", "jti", "kid"))
+
+
+class TokenService(KeyFile):
+    """Emite y verifica tokens; lo ya verificado no vuelve a pasar por HMAC ni JSON"""
+
+    label = "Archivo de claves de tokens"
+
+    def __init__(self, path: str = KEYS_PATH, ttl: int = TOKEN_TTL_S, cache_size: int = CACHE_SIZE):
+        super().__init__(path)
+        self.ttl = ttl
+        self.cache_size = cache_size
+        self.current = None
+        self.keys = {}
+        # firma -> (cabecera.payload, Claims), del menos al más usado
+        self._verified = OrderedDict()
+        # Revocaciones: jti -> exp, y usuario -> instante antes del cual nada vale
+        self.revoked = {}
+        self.revoked_before = {}
+        self._purged = time.monotonic()
+        # Última fila de revoked_tokens ya aplicada en este proceso
+        self._synced_id = 0
+        # Las guardadas por este proceso, que ya están aplicadas
+        self._own_ids = set()
+        self.synced = 0
+        self.task = None
+        # Funciones f(username, jti) a llamar al revocar (p. ej. cerrar sus sockets);
+        # jti es None cuando se revoca todo lo del usuario
+        self.revoke_hooks = []
+        self.reload()
+
+    # === Archivo de claves ===
+    def initial(self) -> dict:
+        return {"current": "1", "keys": {"1": secrets.token_hex(32)}}
+
+    def load(self, data: dict):
+        self.keys = {kid: bytes.fromhex(key) for kid, key in data["keys"].items()}
+        self.current = data["current"]
+
+    # === Rotación ===
+    def rotate(self) -> str:
+        """Genera una clave nueva y firma con ella; las anteriores siguen verificando"""
+        data = self._read()
+        kid = str(max(int(k) for k in data["keys"]) + 1)
+        data["keys"][kid] = secrets.token_hex(32)
+        data["current"] = kid
+        self._save(data)
+        return kid
+
+    def retire(self, kid: str):
+        data = self._read()
+        if data["current"] == kid:
+            raise ValueError("No se puede retirar la clave actual")
+        data["keys"].pop(kid, None)
+        self._save(data)
+
+    # === Tokens ===
+    def issue(self, username: str) -> str:
+        self._maybe_reload()
+        now = time.time()
+        claims = {"sub": username, "iat": round(now, 3), "exp": int(now + self.ttl), "jti": secrets.token_urlsafe(9)}
+        return jwt.encode(claims, self.keys[self.current], algorithm=ALGORITHM, headers={"kid": self.current})
+
+    def _decode(self, token: str) -> Claims:
+        try:
+            kid = jwt.get_unverified_header(token).get("kid")
+            if kid not in self.keys:
+                # Otro proceso pudo rotar: se mira el archivo (sólo se relee si cambió)
+                self._maybe_reload(force=True)
+            key = self.keys.get(kid)
+            if key is None:
+                raise TokenError("Token inválido")
+            payload = jwt.decode(token, key, algorithms=[ALGORITHM])
+            return Claims(payload["sub"], payload["exp"], payload["iat"], payload["jti"], kid)
+        except (JWTError, KeyError, TypeError):
+            raise TokenError("Token inválido")
+
+    def verify(self, token: str) -> Claims:
+        """Claims del token si es válido; TokenError si no"""
+        self._maybe_reload()
+        signing_input, _, signature = token.rpartition(".")
+        cached = self._verified.get(signature)
+        if cached is not None and cached[0] == signing_input:
+            self._verified.move_to_end(signature)
+            claims = cached[1]
+            CACHED.inc()
+        else:
+            try:
+                claims = self._decode(token)
+            except TokenError:
+                REJECTED.inc()
+                raise
+            self._verified[signature] = (signing_input, claims)
+            if len(self._verified) > self.cache_size:
+                self._verified.popitem(last=False)
+            VERIFIED.inc()
+
+        if claims.exp <= time.time() or claims.kid not in self.keys:
+            # Caducado o firmado con una clave ya retirada
+            self._verified.pop(signature, None)
+            REJECTED.inc()
+            raise TokenError("Token caducado" if claims.kid in self.keys else "Token inválido")
+        if claims.jti in self.revoked or claims.iat < self.revoked_before.get(claims.username, 0):
+            REJECTED.inc()
+            raise TokenError("Token revocado")
+        return claims
+
+    # === Revocación ===
+    async def revoke(self, claims: Claims):
+        """Invalida un token (p. ej. al cerrar sesión) hasta que caduque solo"""
+        await self._store(RevokedToken(username=claims.username, jti=claims.jti, exp=claims.exp))
+
+    async def revoke_user(self, username: str):
+        """Invalida todos los tokens emitidos hasta ahora para username"""
+        now = time.time()
+        # Pasado un TTL ya no queda ningún token anterior a la revocación
+        await self._store(RevokedToken(username=username, issued_before=now, exp=now + self.ttl))
+
+    async def _store(self, revocation: RevokedToken):
+        # Aquí vale ya; los demás workers la ven en su próxima sincronización
+        self._apply(revocation)
+        async with AsyncSessionLocal() as db:
+            db.add(revocation)
+            await db.commit()
+            self._own_ids.add(revocation.id)
+
+    def _apply(self, revocation: RevokedToken):
+        if revocation.jti is not None:
+            self.revoked[revocation.jti] = revocation.exp
+        else:
+            self.revoked_before[revocation.username] = max(
+                revocation.issued_before, self.revoked_before.get(revocation.username, 0))
+        for hook in self.revoke_hooks:
+            hook(revocation.username, revocation.jti)
+        self._purge()
+
+    async def sync(self):
+        """Aplica las revocaciones guardadas desde la última vez (las de otros workers)"""
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(select(RevokedToken).where(RevokedToken.id > self._synced_id)
+                                     .order_by(RevokedToken.id))).scalars().all()
+            if time.monotonic() - self._purged >= PURGE_INTERVAL:
+                await db.execute(delete(RevokedToken).where(RevokedToken.exp <= time.time()))
+                await db.commit()
+        now = time.time()
+        for row in rows:
+            self._synced_id = row.id
+            if row.id in self._own_ids:
+                self._own_ids.discard(row.id)
+            elif row.exp > now:
+                self._apply(row)
+                self.synced += 1
+        self._purge()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(SYNC_INTERVAL)
+            try:
+                await self.sync()
+            except SQLAlchemyError as exc:
+                print(f"Error leyendo revocaciones de tokens: {exc}")
+
+    async def start(self):
+        # Las revocaciones que ya había valen desde el primer token que se verifique
+        await self.sync()
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    def _purge(self):
+        if time.monotonic() - self._purged < PURGE_INTERVAL:
+            return
+        self._purged = time.monotonic()
+        now = time.time()
+        self.revoked = {jti: exp for jti, exp in self.revoked.items() if exp > now}
+        self.revoked_before = {name: at for name, at in self.revoked_before.items() if at + self.ttl > now}
+
+    def stats(self) -> dict:
+        return {
+            "current_kid": self.current,
+            "kids": sorted(self.keys, key=int),
+            "ttl_s": self.ttl,
+            "cached_tokens": len(self._verified),
+            "cache_size": self.cache_size,
+            "revoked_tokens": len(self.revoked),
+            "revoked_users": len(self.revoked_before),
+            "synced_revocations": self.synced,
+        }
+
+
+token_service = TokenService()
+
+
+# === Administración ===
+class RevokeUser(BaseModel):
+    username: str
+
+
+@router.get("/tokens", dependencies=[Depends(require_admin)])
+async def token_stats():
+    return token_service.stats()
+
+
+@router.post("/tokens/rotate", dependencies=[Depends(require_admin)])
+async def rotate_token_key():
+    kid = token_service.rotate()
+    print(f"🔑 Nueva clave de tokens: {kid}")
+    return token_service.stats()
+
+
+@router.post("/tokens/revoke", dependencies=[Depends(require_admin)])
+async def revoke_user_tokens(body: RevokeUser):
+    """Cierra la sesión de un usuario: sus tokens dejan de valer y sus sockets se cierran"""
+    await token_service.revoke_user(body.username)
+    return token_service.stats()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Claves de firma de los tokens")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("rotate", help="clave nueva para firmar; las anteriores siguen verificando")
+    retire = sub.add_parser("retire", help="quita una clave (sus tokens dejan de valer)")
+    retire.add_argument("kid")
+    args = parser.parse_args()
+    if args.command == "rotate":
+        print(f"✅ Clave actual: {token_service.rotate()}")
+    else:
+        token_service.retire(args.kid)
+        print(f"✅ Clave {args.kid} retirada")